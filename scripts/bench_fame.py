@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Compare the cost of tracking one more forwarded hall of fame message as the limit grows.
+
+The former trim sorted all tracked IDs on every forward once the limit was reached, NewestIds pops
+the oldest one from a heap, so its cost should stay flat.
+
+Usage: bench_fame.py [limit ...]  (1k, 10k and 100k by default)
+"""
+
+import random
+import sys
+import time
+
+from grossmann.fame_persistence import NewestIds
+
+
+def legacy_mark(tracked: dict[int, float], limit: int, message_id: int, timestamp: float) -> dict[int, float]:
+    """mark_forwarded with the former _trim."""
+    tracked[message_id] = timestamp
+    if len(tracked) > limit:
+        tracked = dict(sorted(tracked.items(), key=lambda item: item[1], reverse=True)[:limit])
+    return tracked
+
+
+def bench(limit: int) -> tuple[float, float]:
+    """Microseconds per forward once the limit is reached, legacy and NewestIds."""
+    rng = random.Random(limit)
+    # forwards mostly arrive in time order, a backfill adds older ones
+    items = {message_id: message_id + rng.uniform(-100, 100) for message_id in range(limit)}
+    marks = [(limit + i, limit + i + rng.uniform(-100, 100)) for i in range(2_000)]
+
+    # sorting is slow at large limits, fewer forwards are enough for a stable average
+    legacy_marks = marks[: max(20, 2_000_000 // limit)]
+    tracked = dict(items)
+    start = time.perf_counter()
+    for message_id, timestamp in legacy_marks:
+        tracked = legacy_mark(tracked, limit, message_id, timestamp)
+    legacy = (time.perf_counter() - start) / len(legacy_marks)
+
+    ids = NewestIds(limit, items)
+    start = time.perf_counter()
+    for message_id, timestamp in marks:
+        ids.add(message_id, timestamp)
+    heap = (time.perf_counter() - start) / len(marks)
+    return legacy * 1e6, heap * 1e6
+
+
+def main() -> None:
+    limits = [int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 100_000]
+    print(f"{'limit':>8} {'sorted trim':>14} {'NewestIds':>12}")
+    for limit in limits:
+        legacy, heap = bench(limit)
+        print(f"{limit:>8} {legacy:>11.1f} µs {heap:>9.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Benchmark šimek's markov chain hot path and print the results as JSON.
+
+Measures counting trigrams, learning messages, generating replies, saving the model and loading it back
+(the mapped model with its increment log, and the legacy pickle), together with the peak RSS.
+Runs on a synthetic corpus with Zipf-distributed words, or on recorded messages, one per line.
+Compare the JSON of two commits to catch regressions before deploying.
+
+Usage: bench_markov.py [--words 1000000] [--corpus messages.txt] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import pickle
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from common import persistence
+from šimek import utils
+from šimek.markov import TrigramStore
+
+# words per synthetic message, like an average chat message
+MESSAGE_WORDS = 12
+VOCABULARY_SIZE = 50_000
+# replies generated for the latency percentiles
+GENERATIONS = 2_000
+# messages learned with their increments logged, for the latency percentiles
+LOGGED_MESSAGES = 10_000
+
+
+def synthetic_corpus(n_words: int, seed: int = 0) -> list[str]:
+    """Messages of Zipf-distributed words, so a few words are common and most are rare, as in chat."""
+    rng = random.Random(seed)
+    vocabulary = [f"slovo{i}" for i in range(VOCABULARY_SIZE)]
+    weights = [1 / rank for rank in range(1, VOCABULARY_SIZE + 1)]
+    words = rng.choices(vocabulary, weights, k=n_words)
+    return [" ".join(words[i : i + MESSAGE_WORDS]) for i in range(0, n_words, MESSAGE_WORDS)]
+
+
+def recorded_corpus(path: Path, n_words: int | None) -> list[str]:
+    messages = [line for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+    if n_words is None or not messages:
+        return messages
+    corpus, total = [], 0
+    while total < n_words:
+        for message in messages:
+            corpus.append(message)
+            total += len(message.split())
+            if total >= n_words:
+                break
+    return corpus
+
+
+def peak_rss_mb() -> float:
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50_us": cuts[49] * 1e6,
+        "p90_us": cuts[89] * 1e6,
+        "p99_us": cuts[98] * 1e6,
+        "max_us": max(samples) * 1e6,
+    }
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench(messages: list[str], workdir: Path) -> dict:
+    n_words = sum(len(message.split()) for message in messages)
+    results: dict = {"messages": len(messages), "words": n_words}
+
+    _, seconds = timed(utils.build_trigram_counts, messages)
+    results["build_trigram_counts"] = {"seconds": seconds, "words_per_second": n_words / seconds}
+
+    # learning message by message, as on_message does
+    utils._markov_cache = TrigramStore()
+    utils.channel_models = utils.ChannelModels()
+    ingest = utils.MarkovIngest(flush_every=len(messages) + 1)
+    start = time.perf_counter()
+    for message_id, message in enumerate(messages):
+        ingest.add(message_id, message_id % 16, message)
+    seconds = time.perf_counter() - start
+    results["ingest"] = {"seconds": seconds, "messages_per_second": len(messages) / seconds}
+    results["store"] = utils._markov_cache.memory_usage()
+
+    # replies as on a mention, from the channel's model falling back to the global one, and from a channel
+    # without its own model, only the global one
+    samples = [timed(utils.generate_markov, 20, 0)[1] for _ in range(GENERATIONS)]
+    results["generate_markov_channel"] = percentiles(samples)
+    samples = [timed(utils.generate_markov, 20, -1)[1] for _ in range(GENERATIONS)]
+    results["generate_markov_global"] = percentiles(samples)
+
+    # learning as on_message does, the increments go to a log in workdir every MARKOV_FLUSH_EVERY messages,
+    # folded into the snapshot every MARKOV_COMPACT_EVERY records. There is no event loop here, so the model is
+    # compacted inline, the max includes compactions the bot runs in background
+    utils.MARKOV_MODEL_FILE = workdir / "markov_trigram.bin"
+    utils.MARKOV_LOG_FILE = workdir / "markov_trigram.log"
+    ingest = utils.MarkovIngest()
+    logged = messages[:LOGGED_MESSAGES]
+    samples = [timed(ingest.add, message_id, message_id % 16, message)[1] for message_id, message in enumerate(logged)]
+    results["ingest_logged"] = percentiles(samples) if len(samples) > 1 else {}
+    batch = utils.MARKOV_FLUSH_EVERY
+    batches = [messages[i : i + batch] for i in range(0, min(len(messages), 200 * batch), batch)]
+
+    _, seconds = timed(utils._markov_cache.snapshot().save, workdir / "model.bin")
+    results["save"] = {"seconds": seconds, "bytes": (workdir / "model.bin").stat().st_size}
+    with open(workdir / "model.pkl", "wb") as f:
+        pickle.dump(dict(utils._markov_cache.items()), f)
+    with open(workdir / "model.log", "wb") as f:
+        for messages_batch in batches:
+            pickle.dump((0, utils.build_trigram_counts(messages_batch)), f)
+
+    utils._cache_initialized = False
+    _, seconds = timed(utils.load_trigram_counts, workdir / "model.bin", workdir / "model.log", workdir / "none.pkl")
+    results["load_trigram_counts"] = {"seconds": seconds, "log_records": len(batches)}
+    _, seconds = timed(TrigramStore.load, workdir / "model.bin")
+    results["load_mapped"] = {"seconds": seconds}
+    with open(workdir / "model.pkl", "rb") as f:
+        _, seconds = timed(pickle.load, f)
+    results["load_pickle"] = {"seconds": seconds, "bytes": (workdir / "model.pkl").stat().st_size}
+
+    # background appends and compactions must finish before workdir is deleted
+    persistence._executor.submit(lambda: None).result()
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark šimek's markov chain and print the results as JSON.")
+    parser.add_argument("--words", type=int, default=None, help="corpus size, 1M synthetic words by default")
+    parser.add_argument(
+        "--corpus", type=Path, default=None, help="recorded messages, one per line, repeated to --words"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic corpus and of generating")
+    parser.add_argument("--output", type=Path, default=None, help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    if args.corpus is not None and not args.corpus.exists():
+        print(f"File not found: {args.corpus}")
+        sys.exit(1)
+
+    if args.corpus is not None:
+        messages = recorded_corpus(args.corpus, args.words)
+    else:
+        messages = synthetic_corpus(args.words or 1_000_000, args.seed)
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = bench(messages, Path(workdir))
+    results["corpus"] = str(args.corpus) if args.corpus is not None else "synthetic"
+    results["python"] = platform.python_version()
+    results["cpus"] = os.cpu_count()
+
+    output = json.dumps(results, indent=2)
+    if args.output is not None:
+        args.output.write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
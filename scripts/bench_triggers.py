@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Compare classifying messages by šimek's trigger table with the former chain of substring cases.
+
+Usage: bench_triggers.py [messages.txt]  (one message per line, sample messages by default)
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+from common.utils import has_all
+from šimek.triggers import RESPONSES
+
+SAMPLE = [
+    "ahoj lidi, dneska jsem byl v obchodě a koupil jsem si novou klávesnici",
+    "nevím co mám dělat",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ tohle je dobrý",
+    "a co ty na to? já myslím, že je to blbost",
+    "mám velký problém s windows",
+    "kdo jde večer hrát?",
+    "ok",
+]
+
+
+class Substring(str):
+    def __eq__(self, other):
+        return other in self
+
+
+def legacy_classify(mess: str) -> str | None:
+    """The match statement manage_response used before, guards depending on morphodita are off."""
+    match Substring(mess):
+        case "hodný bot":
+            return "hodný bot"
+        case _ if has_all(mess, ["problém", "windows"]):
+            return "windows problém"
+        case _ if has_all(mess, ["nvidia", "driver", "linux"]):
+            return "nvidia driver"
+        case "windows":
+            return "windows"
+        case "debian":
+            return "debian"
+        case "všechno nejlepší":
+            return "všechno nejlepší"
+        case "linux" | "gnu/linux":
+            return "linux"
+        case "hilfe" | "help":
+            return "help"
+        case "novinky":
+            return "novinky"
+        case "schizo":
+            return "schizo"
+        case "anureysm" | "aneuerysm" | "brain damage" | "brian damage":
+            return "aneurysm"
+        case "groku je to pravda" | "groku je toto pravda" | "groku, je to pravda" | "groku, je toto pravda":
+            return "grok"
+        case "?" if mess[-1] == "?":
+            return "?"
+        case "proč" | "proc":
+            return "proč"
+        case "negr":
+            return "negr"
+        case "israel" | "izrael":
+            return "izrael"
+        case "mama" | "mamá" | "mami" | "mommy" | "mamka" | "mamko":
+            return "mama"
+        case "lagtrain":
+            return "lagtrain"
+        case "cum zone":
+            return "cum zone"
+        case "crab rave":
+            return "crab rave"
+        case "já jo":
+            return "já jo"
+        case "já ne":
+            return "já ne"
+        case "chci se zabít" | "suicidal":
+            return "suicidal"
+        case "v píči" | "v pici":
+            return "v píči"
+        case "buisness" | "buisnes" | "buissnes" | "bussiness" | "bussines":
+            return "buisness"
+        case "business" | "byznys":
+            return "business"
+        case "reminder":
+            return "reminder"
+        case "youtu.be" | "youtube.com":
+            return "youtube"
+        case "špatný bot" | "spatny bot":
+            return "špatný bot"
+        case "podle mě" | "myslím si" | "myslim si":
+            return "názor"
+        case "roll joint":
+            return "roll joint"
+    return None
+
+
+def table_classify(mess: str) -> str | None:
+    for trigger in RESPONSES.matches(mess):
+        match trigger.name:
+            case "pomo" | "jsem" | "jsi":
+                continue
+            case "?" if mess[-1] != "?":
+                continue
+        return trigger.name
+    return None
+
+
+def main() -> None:
+    if len(sys.argv) > 1:
+        messages = [line.lower() for line in Path(sys.argv[1]).read_text().splitlines() if line.strip()]
+    else:
+        messages = [message.lower() for message in SAMPLE]
+
+    for mess in messages:
+        assert legacy_classify(mess) == table_classify(mess), mess
+
+    number = max(1, 200_000 // len(messages))
+    for name, classify in [("substring chain", legacy_classify), ("trigger table", table_classify)]:
+        seconds = timeit.timeit(lambda: [classify(mess) for mess in messages], number=number)
+        print(f"{name:>16}: {seconds / (number * len(messages)) * 1e6:.2f} µs per message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""Convert the pickled markov trigram model to the memory-mapped format šimek loads at startup.
+
+Usage: convert_markov.py [markov_trigram.pkl] [markov_trigram.bin]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+from šimek.markov import convert_pickle
+
+MARKOV_DIR = Path(__file__).parent.parent / "data" / "šimek"
+
+
+def main():
+    pickle_path = Path(sys.argv[1]) if len(sys.argv) > 1 else MARKOV_DIR / "markov_trigram.pkl"
+    model_path = Path(sys.argv[2]) if len(sys.argv) > 2 else pickle_path.with_suffix(".bin")
+    if not pickle_path.exists():
+        print(f"File not found: {pickle_path}")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    store = convert_pickle(pickle_path, model_path)
+    print(f"Converted {pickle_path} -> {model_path} in {time.perf_counter() - start:.1f}s")
+    print(f"Store memory usage: {store.memory_usage()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,27 @@
 #!/usr/bin/env python3
-"""Print statistics about the markov trigram pickle file."""
+"""Print statistics about the markov trigram model (mapped .bin or legacy pickle)."""
 
 import pickle
 import sys
 from collections import Counter
 from pathlib import Path
 
-MARKOV_FILE = Path(__file__).parent.parent / "data" / "šimek" / "markov_trigram.pkl"
+from common.persistence import load_pickle_records
+from šimek.markov import TrigramStore, logged_increments
+
+MARKOV_FILE = Path(__file__).parent.parent / "data" / "šimek" / "markov_trigram.bin"
 
 
 def load_trigram_counts(filename: Path) -> dict:
-    with open(filename, "rb") as f:
-        return pickle.load(f)
+    if filename.suffix != ".bin":
+        with open(filename, "rb") as f:
+            return pickle.load(f)
+    store = TrigramStore.load(filename)
+    # increments not yet folded into the snapshot
+    for increment in logged_increments(load_pickle_records(filename.with_suffix(".log")), store.generation):
+        store.merge(increment)
+    print(f"Store memory usage: {store.memory_usage()}")
+    return {key: Counter(next_words) for key, next_words in store.items()}
 
 
 def print_stats(markov_counts: dict) -> None:
@@ -1,6 +1,7 @@
 import time
 
-from šimek.utils import truncate_emojis, find_self_reference
+from šimek.morphodita_utils import find_self_reference
+from šimek.text import truncate_emojis
 
 # load from file
 text_file = "sentences.txt"
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Train šimek's markov trigram model from exported channel history.
+
+Reads JSONL (one message object per line) or CSV exports with a ``content`` column and an optional
+``channel_id`` column, otherwise every file is one channel. Messages are cleaned like the ones šimek
+learns live, counted in parallel shards and merged into the mapped model šimek loads at startup.
+Stop šimek before writing to its model, it would overwrite it on the next compaction.
+
+Usage: train_markov.py export.jsonl [export.csv ...] [--output markov_trigram.bin] [--extend]
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections.abc import Iterable, Iterator
+from multiprocessing import Pool
+from pathlib import Path
+
+from common.persistence import load_pickle_records
+from šimek.markov import TrigramStore, build_trigram_counts, logged_increments
+from šimek.text import MessageViews
+
+MARKOV_FILE = Path(__file__).parent.parent / "data" / "šimek" / "markov_trigram.bin"
+# messages of one channel counted by a worker at once
+SHARD_SIZE = 5_000
+# compacting walks the whole model, offline it's done rarely, trading memory for speed
+TRAIN_COMPACT_THRESHOLD = 5_000_000
+
+
+def read_messages(path: Path) -> Iterator[tuple[str, str]]:
+    """Yield (channel, content) of messages in an export file."""
+    with open(path, encoding="utf-8", newline="") as f:
+        rows: Iterable[dict] = (
+            csv.DictReader(f) if path.suffix == ".csv" else (json.loads(line) for line in f if line.strip())
+        )
+        for row in rows:
+            # DiscordChatExporter capitalizes the CSV columns
+            content = row.get("content", row.get("Content"))
+            if content:
+                yield str(row.get("channel_id", row.get("ChannelId", path))), content
+
+
+def clean(messages: Iterable[tuple[str, str]]) -> Iterator[tuple[str, str]]:
+    """Same cleanup as messages šimek learns in on_message."""
+    for channel, content in messages:
+        yield channel, MessageViews.of(content).mention_safe.replace(",", "")
+
+
+def shards(messages: Iterable[tuple[str, str]], size: int = SHARD_SIZE) -> Iterator[list[str]]:
+    """Group messages of a channel, each shard starts with the last two words of the previous one."""
+    pending: dict[str, list[str]] = {}
+    context: dict[str, str] = {}
+    for channel, text in messages:
+        shard = pending.setdefault(channel, [context.get(channel, "")])
+        shard.append(text)
+        if len(shard) > size:
+            context[channel] = " ".join(" ".join(shard).split()[-2:])
+            yield pending.pop(channel)
+    yield from pending.values()
+
+
+def train(paths: list[Path], store: TrigramStore, processes: int | None = None) -> int:
+    """Merge trigrams of the exported messages into the store, returns the number of messages."""
+    count = 0
+
+    def counted(messages: Iterable[tuple[str, str]]) -> Iterator[tuple[str, str]]:
+        nonlocal count
+        for message in messages:
+            count += 1
+            yield message
+
+    messages = counted(clean(message for path in paths for message in read_messages(path)))
+    with Pool(processes) as pool:
+        for counts in pool.imap_unordered(build_trigram_counts, shards(messages)):
+            store.merge(counts, TRAIN_COMPACT_THRESHOLD)
+    return count
+
+
+def load_existing(path: Path) -> TrigramStore:
+    store = TrigramStore.load(path)
+    for increment in logged_increments(load_pickle_records(path.with_suffix(".log")), store.generation):
+        store.merge(increment)
+    return store
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train šimek's markov trigram model from exported channel history.")
+    parser.add_argument("exports", nargs="+", type=Path, help="JSONL or CSV exports of channel history")
+    parser.add_argument("--output", type=Path, default=MARKOV_FILE, help="model file to write")
+    parser.add_argument("--extend", action="store_true", help="add to the existing model instead of replacing it")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, all cores by default")
+    args = parser.parse_args()
+
+    missing = [path for path in args.exports if not path.exists()]
+    if missing:
+        print(f"File not found: {', '.join(map(str, missing))}")
+        sys.exit(1)
+
+    store = load_existing(args.output) if args.extend and args.output.exists() else TrigramStore()
+    if args.output.exists():
+        # the log of the current model is folded in or replaced, its records are skipped if it outlives the model
+        store.generation = TrigramStore.load(args.output).generation + 1
+    start = time.perf_counter()
+    count = train(args.exports, store, args.processes)
+    trained = time.perf_counter() - start
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = args.output.with_name(args.output.name + ".tmp")
+    store.save(tmp_path)
+    os.replace(tmp_path, args.output)
+    # increments were folded into the model
+    args.output.with_suffix(".log").unlink(missing_ok=True)
+
+    print(f"Trained on {count} messages in {trained:.1f}s ({count / max(trained, 1e-9):,.0f} messages/s)")
+    print(f"Wrote {args.output} in {time.perf_counter() - start - trained:.1f}s")
+    print(f"Store memory usage: {store.memory_usage()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,121 @@
 """Common persistence utilities for async file saving.
 
-Provides thread-safe, non-blocking file persistence with one semaphore per file.
+Saves go through a write-behind queue: each path keeps only its latest pending data, which is written
+at most once per ``SAVE_INTERVAL`` seconds, so bursts of saves coalesce into one write and the last
+state is never dropped. Call ``flush`` on shutdown to write what's pending.
+Also provides append-only pickle logs that are periodically folded into a snapshot file, and
+``KeyValueStore``, a SQLite table updated row by row instead of rewriting a whole file.
 """
 
 import json
 import logging
+import os
 import pickle
+import re
+import sqlite3
 import threading
+import time
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Iterable
 
 logger = logging.getLogger(__name__)
 
 # Shared executor for all background file operations
 _executor = ThreadPoolExecutor(max_workers=1)
 
-# One semaphore per file path to prevent concurrent writes to the same file
-_file_semaphores: dict[str, threading.Semaphore] = {}
-_semaphores_lock = threading.Lock()
+# minimum seconds between two writes of the same file
+SAVE_INTERVAL = float(os.getenv("PERSISTENCE_SAVE_INTERVAL", "1.0"))
 
 PathLike = str | Path
+Writer = Callable[[Path, Any], None]
 
+# latest data waiting to be written, per path
+_pending: dict[Path, tuple[Writer, Any]] = {}
+# paths with a write submitted or waiting for its interval, with the timer in the latter case
+_scheduled: dict[Path, threading.Timer | None] = {}
+_last_write: dict[Path, float] = {}
+_queue_lock = threading.Lock()
+_metrics: Counter[str] = Counter()
 
-def _get_semaphore(file_path: str) -> threading.Semaphore:
-    with _semaphores_lock:
-        if file_path not in _file_semaphores:
-            _file_semaphores[file_path] = threading.Semaphore(1)
-        return _file_semaphores[file_path]
 
+def _write_json(path: Path, data: Any) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
 
-@contextmanager
-def _atomic_save(file_path: PathLike, format_name: str):
-    path = Path(file_path)
-    semaphore = _get_semaphore(str(path))
-    if not semaphore.acquire(blocking=False):
-        yield None  # Another save in progress, skip
-        return
 
+def _write_pickle(path: Path, data: Any) -> None:
+    with open(path, "wb") as f:
+        pickle.dump(data, f)
+
+
+def _save_sync(path: Path, write: Writer, data: Any) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
     try:
         path.parent.mkdir(parents=True, exist_ok=True)
-        yield path
-        logger.debug(f"Saved {format_name} to {path}")
-    except OSError as e:
-        logger.warning(f"Failed to save {format_name} to {path}: {e}")
-    finally:
-        semaphore.release()
+        write(tmp_path, data)
+        os.replace(tmp_path, path)
+        logger.debug(f"Saved {path}")
+    except (OSError, TypeError, ValueError, pickle.PicklingError) as e:
+        _metrics["failed"] += 1
+        logger.warning(f"Failed to save {path}: {e}")
+        tmp_path.unlink(missing_ok=True)
+    else:
+        _metrics["written"] += 1
+
+
+def _write_pending(path: Path) -> None:
+    with _queue_lock:
+        _scheduled.pop(path, None)
+        entry = _pending.pop(path, None)
+        if entry is None:
+            return
+        _last_write[path] = time.monotonic()
+    _save_sync(path, *entry)
+
+
+def _enqueue(file_path: PathLike, write: Writer, data: Any) -> None:
+    path = Path(file_path)
+    with _queue_lock:
+        _metrics["queued"] += 1
+        if path in _pending:
+            _metrics["coalesced"] += 1
+        _pending[path] = (write, data)
+        if path in _scheduled:
+            return  # the scheduled write takes the latest data
+        delay = _last_write.get(path, -SAVE_INTERVAL) + SAVE_INTERVAL - time.monotonic()
+        if delay <= 0:
+            _scheduled[path] = None
+            _executor.submit(_write_pending, path)
+            return
+        timer = _scheduled[path] = threading.Timer(delay, _executor.submit, (_write_pending, path))
+        timer.daemon = True
+        timer.start()
+
+
+def flush(timeout: float | None = None) -> None:
+    """Write all pending saves now and wait for every background file operation to finish."""
+    with _queue_lock:
+        for path, timer in list(_scheduled.items()):
+            if timer is not None:
+                timer.cancel()
+                _scheduled[path] = None
+                _executor.submit(_write_pending, path)
+    _executor.submit(lambda: None).result(timeout)
+
+
+def metrics() -> dict[str, int]:
+    """Counts of queued saves, the ones coalesced into a later save, written and failed writes, and pending paths."""
+    with _queue_lock:
+        return {
+            "queued": _metrics["queued"],
+            "coalesced": _metrics["coalesced"],
+            "written": _metrics["written"],
+            "failed": _metrics["failed"],
+            "pending": len(_pending),
+        }
 
 
 @contextmanager
@@ -62,34 +131,65 @@ def _safe_load(file_path: PathLike, format_name: str, errors: tuple):
         logger.error(f"Failed to load {format_name} from {path}: {e}")
 
 
-def _save_json_sync(file_path: PathLike, data: Any) -> None:
-    with _atomic_save(file_path, "JSON") as path:
-        if path:
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2)
+def _append_pickle_sync(file_path: PathLike, data: Any) -> None:
+    path = Path(file_path)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "ab") as f:
+            pickle.dump(data, f)
+    except OSError as e:
+        logger.warning(f"Failed to append pickle to {path}: {e}")
 
 
-def _save_pickle_sync(file_path: PathLike, data: Any) -> None:
-    with _atomic_save(file_path, "pickle") as path:
-        if path:
-            with open(path, "wb") as f:
-                pickle.dump(data, f)
+def _compact_log_sync(file_path: PathLike, log_path: PathLike, save: Callable[[Path], None]) -> None:
+    path = Path(file_path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        save(tmp_path)
+        os.replace(tmp_path, path)
+        # the log is dropped only once the snapshot containing it is safely on disk
+        Path(log_path).unlink(missing_ok=True)
+        logger.debug(f"Compacted {log_path} into {path}")
+    except OSError as e:
+        logger.warning(f"Failed to compact {log_path} into {path}: {e}")
 
 
 def save_json_async(file_path: PathLike, data: Any) -> None:
     """Save data as JSON in a background thread, non-blocking.
 
-    If a save is already in progress for this file, this call is skipped.
+    The data is written later, so it must not be mutated afterwards. If a save of this file is still
+    pending, it is replaced by this one.
     """
-    _executor.submit(_save_json_sync, file_path, data)
+    _enqueue(file_path, _write_json, data)
 
 
 def save_pickle_async(file_path: PathLike, data: Any) -> None:
     """Save data as pickle in a background thread, non-blocking.
 
-    If a save is already in progress for this file, this call is skipped.
+    The data is written later, so it must not be mutated afterwards. If a save of this file is still
+    pending, it is replaced by this one.
+    """
+    _enqueue(file_path, _write_pickle, data)
+
+
+def append_pickle_async(file_path: PathLike, data: Any) -> None:
+    """Append one pickled record to a log file in a background thread, non-blocking.
+
+    Appends are never skipped and run in submission order.
+    """
+    _executor.submit(_append_pickle_sync, file_path, data)
+
+
+def compact_log_async(file_path: PathLike, log_path: PathLike, save: Callable[[Path], None]) -> None:
+    """Write a new snapshot with ``save(path)`` and delete the log, in a background thread, non-blocking.
+
+    Runs after all previously submitted appends, so the snapshot must already contain them.
+    The snapshot is written to a temporary file first and the log is kept if that fails.
+    The log is deleted only after the snapshot is replaced, a crash in between leaves both, so tag
+    the records in a way that lets the snapshot's owner skip the ones the snapshot contains.
     """
-    _executor.submit(_save_pickle_sync, file_path, data)
+    _executor.submit(_compact_log_sync, file_path, log_path, save)
 
 
 def load_json(file_path: PathLike, default: Any = None) -> Any:
@@ -108,3 +208,132 @@ def load_pickle(file_path: PathLike, default: Any = None) -> Any:
             with open(path, "rb") as f:
                 return pickle.load(f)
     return default
+
+
+def load_pickle_records(file_path: PathLike) -> list[Any]:
+    """Load all records appended by append_pickle_async, dropping a truncated last record."""
+    records: list[Any] = []
+    with _safe_load(file_path, "pickle log", (OSError,)) as path:
+        if path:
+            with open(path, "rb") as f:
+                while True:
+                    try:
+                        records.append(pickle.load(f))
+                    except EOFError:
+                        break
+                    except pickle.UnpicklingError as e:
+                        logger.warning(f"Dropping truncated record from {path}: {e}")
+                        break
+    return records
+
+
+class KeyValueStore:
+    """Table of string keys with JSON values in a SQLite database in WAL mode.
+
+    All database access runs in the background executor, so writes are applied in call order
+    after the other file operations submitted before them. Each write touches only its rows.
+    The database file is created by the first write, reading a missing one gives an empty table.
+    """
+
+    def __init__(self, file_path: PathLike, table: str):
+        if not re.fullmatch(r"[a-z_]+", table):
+            raise ValueError(f"Invalid table name {table!r}")
+        self.path = Path(file_path)
+        if self.path.suffix == ".json":
+            # most likely a path configured before the switch to SQLite, which would overwrite the JSON file
+            raise ValueError(f"Database path {self.path} must not be a JSON file")
+        self._table = table
+        self._connection: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # in WAL mode a commit can be lost on power failure, but the database stays consistent
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {self._table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._connection = connection
+        return self._connection
+
+    def _exists(self) -> bool:
+        return self._connection is not None or self.path.exists()
+
+    def _load_sync(self) -> dict[str, Any]:
+        if not self._exists():
+            return {}
+        rows = self._connect().execute(f"SELECT key, value FROM {self._table}")
+        return {key: json.loads(value) for key, value in rows}
+
+    def _write_sync(self, upserts: list[tuple[str, str]], deletes: list[tuple[str]]) -> bool:
+        """Returns whether the write succeeded."""
+        if not upserts and not self._exists():
+            # nothing to delete from
+            return True
+        try:
+            with self._connect() as connection:
+                connection.executemany(
+                    f"INSERT INTO {self._table} (key, value) VALUES (?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    upserts,
+                )
+                connection.executemany(f"DELETE FROM {self._table} WHERE key = ?", deletes)
+        except sqlite3.Error as e:
+            _metrics["failed"] += 1
+            logger.warning(f"Failed to write to {self._table} in {self.path}: {e}")
+            return False
+        _metrics["written"] += 1
+        return True
+
+    def load(self) -> dict[str, Any]:
+        """Read the whole table, blocking until the pending writes are done. Empty if it can't be read."""
+        try:
+            return _executor.submit(self._load_sync).result()
+        except (sqlite3.Error, json.JSONDecodeError) as e:
+            logger.error(f"Failed to load {self._table} from {self.path}: {e}")
+            return {}
+
+    def put_async(self, key: str, value: Any) -> None:
+        """Insert or replace one row in a background thread, non-blocking."""
+        _executor.submit(self._write_sync, [(key, json.dumps(value))], [])
+
+    def delete_async(self, keys: Iterable[str]) -> None:
+        """Delete rows in a background thread, non-blocking, missing keys are ignored."""
+        deletes = [(key,) for key in keys]
+        if deletes:
+            _executor.submit(self._write_sync, [], deletes)
+
+    def import_json(self, json_path: PathLike, rows: Callable[[Any], dict[str, Any]]) -> int:
+        """Migrate a JSON file into the table, ``rows`` converts its content to keys and values.
+
+        Runs only if the file exists and the table is empty, the file is renamed to ``*.migrated``
+        once the rows are written so it isn't imported again. Returns the number of imported rows.
+        """
+        path = Path(json_path)
+        if not path.exists():
+            return 0
+        try:
+            if _executor.submit(self._load_sync).result():
+                return 0
+        except (sqlite3.Error, json.JSONDecodeError) as e:
+            logger.error(f"Not importing {path}, failed to read {self._table} from {self.path}: {e}")
+            return 0
+        data = load_json(path)
+        if data is None:
+            return 0
+        upserts = [(key, json.dumps(value)) for key, value in rows(data).items()]
+        if not _executor.submit(self._write_sync, upserts, []).result():
+            logger.error(f"Not importing {path}, keeping it for the next start")
+            return 0
+        path.replace(path.with_name(path.name + ".migrated"))
+        logger.info(f"Imported {len(upserts)} rows from {path} into {self._table} in {self.path}")
+        return len(upserts)
+
+    def close(self) -> None:
+        """Close the database once the pending writes are done."""
+        _executor.submit(self._close_sync).result()
+
+    def _close_sync(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,251 @@
+"""Hall of fame backfill engine.
+
+Each scan walks one channel, or one time slice of it, and several scans run concurrently. A scan puts
+its candidates into its own bounded queue, so a scan far ahead of the forwarding pauses instead of
+buffering a whole channel. The queues are drained scan by scan, so the hall of fame stays chronological.
+Forwards are paced by an adaptive rate limiter, and progress edits are coalesced.
+
+Each scan keeps a cursor, the ID of the newest message it's done with, so a backfill can be checkpointed
+and resumed after it. Messages waiting in the queue hold the cursor back, they aren't forwarded yet.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, TypeVar
+
+import disnake
+from disnake import Message
+from disnake.abc import Snowflake
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# scans fetching history at the same time
+SCAN_CONCURRENCY = 4
+# candidates a scan may find ahead of the forwarding
+QUEUE_SIZE = 50
+# time slices a date range of a channel is split into
+SCAN_SLICES = 4
+# seconds between progress edits
+PROGRESS_INTERVAL = 3.0
+
+# seconds between forwards, Discord allows about 5 messages per 5 seconds in a channel,
+# so the limiter never goes faster than that and only backs off
+FORWARD_INTERVAL = 1.0
+MIN_FORWARD_INTERVAL = 1.0
+MAX_FORWARD_INTERVAL = 30.0
+MAX_RETRIES = 5
+
+
+@dataclass
+class Scan:
+    channel: Any  # disnake.TextChannel, anything with history()
+    limit: int | None = None  # newest messages to scan, None scans the whole window
+    after: datetime | Snowflake | None = None
+    before: datetime | Snowflake | None = None
+    cursor: int | None = None  # ID of the message the scan continues after
+    done: bool = False
+
+    async def history(self) -> AsyncIterator[Message]:
+        """Messages oldest-first, after the cursor."""
+        if self.done:
+            return
+        if self.limit is not None:
+            # the newest `limit` messages can only be fetched newest-first
+            messages = [message async for message in self.channel.history(limit=self.limit)]
+            if messages:
+                # pin them as a window, so a resumed scan continues after the cursor instead of taking the newest again
+                self.limit = None
+                self.after = disnake.Object(messages[-1].id - 1)
+                self.before = disnake.Object(messages[0].id + 1)
+            for message in reversed(messages):
+                yield message
+            return
+        after = self.after if self.cursor is None else disnake.Object(self.cursor)
+        async for message in self.channel.history(limit=None, after=after, before=self.before, oldest_first=True):
+            yield message
+
+
+def split_range(after: datetime, before: datetime, slices: int = SCAN_SLICES) -> list[tuple[datetime, datetime]]:
+    step = (before - after) / slices
+    return [(after + step * i, after + step * (i + 1) if i < slices - 1 else before) for i in range(slices)]
+
+
+@dataclass
+class BackfillProgress:
+    scans: int
+    scans_done: int = 0
+    scanned: int = 0
+    candidates: int = 0
+    forwarded_times: list[datetime] = field(default_factory=list)
+
+
+class AdaptiveRateLimiter:
+    """Spaces out calls, backing off on Discord's 429 responses and speeding up again after successes.
+
+    disnake already waits out most rate limits itself, the limiter reacts to the 429s that still surface.
+    """
+
+    def __init__(
+        self,
+        interval: float = FORWARD_INTERVAL,
+        *,
+        min_interval: float = MIN_FORWARD_INTERVAL,
+        max_interval: float = MAX_FORWARD_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+    ):
+        self.interval = interval
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._clock = clock
+        self._sleep = sleep
+        self._next = 0.0
+        self.rate_limited = 0
+
+    async def acquire(self) -> None:
+        now = self._clock()
+        start = max(now, self._next)
+        self._next = start + self.interval
+        if start > now:
+            await self._sleep(start - now)
+
+    def on_success(self) -> None:
+        self.interval = max(self._min_interval, self.interval * 0.9)
+
+    def on_rate_limited(self, retry_after: float) -> None:
+        self.rate_limited += 1
+        self.interval = min(self._max_interval, self.interval * 2)
+        self._next = max(self._next, self._clock() + retry_after)
+
+    async def call(self, func: Callable[..., Awaitable[T]], *args: Any) -> T:
+        """Await ``func(*args)`` at the limiter's pace, retrying up to ``MAX_RETRIES`` times after a 429."""
+        attempt = 0
+        while True:
+            await self.acquire()
+            try:
+                result = await func(*args)
+            except disnake.HTTPException as e:
+                attempt += 1
+                if e.status != 429 or attempt > MAX_RETRIES:
+                    raise
+                retry_after = _retry_after(e, self.interval)
+                logger.warning(f"Rate limited, retrying in {retry_after:.1f}s")
+                self.on_rate_limited(retry_after)
+                continue
+            self.on_success()
+            return result
+
+
+def _retry_after(e: disnake.HTTPException, default: float) -> float:
+    headers = getattr(e.response, "headers", None) or {}
+    for header in ("Retry-After", "X-RateLimit-Reset-After"):
+        try:
+            return float(headers[header])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return default
+
+
+class CoalescedEditor:
+    """Edits a message at most once per interval, keeping only the latest content in between."""
+
+    def __init__(
+        self,
+        edit: Callable[[str], Awaitable[Any]],
+        interval: float = PROGRESS_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._edit = edit
+        self._interval = interval
+        self._clock = clock
+        self._last = -interval
+        self.skipped = 0
+
+    async def update(self, content: str) -> bool:
+        """Returns whether the message was edited, or an edit attempted."""
+        now = self._clock()
+        if now - self._last < self._interval:
+            self.skipped += 1
+            return False
+        self._last = now
+        await self.final(content)
+        return True
+
+    async def final(self, content: str) -> None:
+        try:
+            await self._edit(content)
+        except disnake.HTTPException as e:
+            # the interaction token expires after 15 minutes, a long backfill goes on without progress
+            logger.warning(f"Failed to edit backfill progress: {e}")
+
+
+async def run_backfill(
+    scans: list[Scan],
+    qualifies: Callable[[Message], bool],
+    forward: Callable[[Message], Awaitable[bool]],
+    report: Callable[[BackfillProgress, Message | None], Awaitable[None]],
+    *,
+    concurrency: int = SCAN_CONCURRENCY,
+    queue_size: int = QUEUE_SIZE,
+) -> BackfillProgress:
+    """Scan concurrently and forward the qualifying messages, oldest-first within each scan, scan by scan.
+
+    ``forward`` returns whether the message was forwarded, ``report`` is called after every scanned
+    message and forward, with the last forwarded message. The scans' cursors and done flags are
+    updated as they go, finished scans are skipped.
+    """
+    progress = BackfillProgress(scans=len(scans), scans_done=sum(s.done for s in scans))
+    queues: list[asyncio.Queue[Message | None]] = [asyncio.Queue(queue_size) for _ in scans]
+    # IDs of the queued messages and of the last scanned one, per scan
+    pending: list[deque[int]] = [deque() for _ in scans]
+    scanned_to = [s.cursor for s in scans]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    def advance(i: int) -> None:
+        # a resumed scan starts right before its oldest message that wasn't forwarded yet
+        scans[i].cursor = pending[i][0] - 1 if pending[i] else scanned_to[i]
+
+    async def scan(i: int) -> None:
+        try:
+            # scans start in order and the semaphore is fair, so the scan being drained always runs
+            async with semaphore:
+                async for message in scans[i].history():
+                    progress.scanned += 1
+                    scanned_to[i] = message.id
+                    if qualifies(message):
+                        progress.candidates += 1
+                        pending[i].append(message.id)
+                        advance(i)
+                        await queues[i].put(message)
+                    else:
+                        advance(i)
+                    await report(progress, None)
+        finally:
+            await queues[i].put(None)
+
+    tasks = [asyncio.create_task(scan(i)) for i in range(len(scans))]
+    try:
+        for i, (queue, task) in enumerate(zip(queues, tasks)):
+            if scans[i].done:
+                continue
+            while (message := await queue.get()) is not None:
+                if await forward(message):
+                    progress.forwarded_times.append(message.created_at)
+                pending[i].popleft()
+                advance(i)
+                await report(progress, message)
+            # re-raise the scan's error before it counts as done
+            await task
+            scans[i].done = True
+            progress.scans_done += 1
+    finally:
+        for task in tasks:
+            task.cancel()
+    return progress
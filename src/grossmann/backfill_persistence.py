@@ -0,0 +1,170 @@
+"""Persistence layer for hall of fame backfill checkpoints.
+
+Every backfill is saved as a job holding the cursor of each of its scans, the ID of the message
+the scan continues after. The checkpoints survive bot restarts in a SQLite table, so an interrupted
+backfill can be resumed instead of rescanning the same history. Jobs are deleted once they complete
+or are cancelled, the next job ID is kept in the same table so IDs are never reused.
+"""
+
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+
+import attrs
+import cattrs
+import disnake
+from disnake.utils import time_snowflake
+
+from common.persistence import KeyValueStore
+from grossmann.backfill import Scan
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKFILL_FILE = Path(__file__).parent.parent.parent / "data" / "grossmann" / "backfill_checkpoints.db"
+# row with the next job ID, the other rows are jobs
+NEXT_JOB_ID_KEY = "next_job_id"
+
+
+@attrs.define
+class ScanCheckpoint:
+    """A scan of one channel, the window bounds and the cursor are message IDs."""
+
+    channel_id: int
+    limit: int | None = None
+    after: int | None = None
+    before: int | None = None
+    cursor: int | None = None
+    done: bool = False
+
+
+@attrs.define
+class BackfillJob:
+    job_id: int
+    guild_id: int
+    where: str
+    started_by: str
+    started_at: float  # Unix timestamp
+    scans: list[ScanCheckpoint]
+    scanned: int = 0
+    forwarded: int = 0
+
+    def scans_done(self) -> int:
+        return sum(scan.done for scan in self.scans)
+
+
+# In-memory cache: job_id -> job
+_jobs_cache: dict[int, BackfillJob] = {}
+_next_job_id = 1
+_cache_initialized = False
+_store: KeyValueStore | None = None
+
+
+def _get_backfill_file_path() -> Path:
+    env_path = os.environ.get("GROSSMANN_BACKFILL_FILE")
+    return Path(env_path) if env_path else DEFAULT_BACKFILL_FILE
+
+
+def _load_from_store(store: KeyValueStore) -> tuple[dict[int, BackfillJob], int]:
+    """Jobs and the next job ID, which is above the IDs of all stored jobs."""
+    rows = store.load()
+    next_job_id = rows.pop(NEXT_JOB_ID_KEY, 1)
+    try:
+        jobs = {int(k): cattrs.structure(v, BackfillJob) for k, v in rows.items()}
+    except Exception as e:
+        logger.error(f"Failed to parse backfill checkpoints: {e}")
+        jobs = {}
+    return jobs, max(next_job_id, max(jobs, default=0) + 1)
+
+
+def _init_cache() -> None:
+    global _jobs_cache, _next_job_id, _cache_initialized, _store
+    if _cache_initialized:
+        return
+    _store = KeyValueStore(_get_backfill_file_path(), "backfill_jobs")
+    _jobs_cache, _next_job_id = _load_from_store(_store)
+    _cache_initialized = True
+    logger.info(f"Loaded {len(_jobs_cache)} unfinished hall of fame backfills")
+
+
+def _snowflake(value: datetime | disnake.abc.Snowflake | None, high: bool) -> int | None:
+    # same conversion as history() does for datetimes
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return time_snowflake(value, high=high)
+    return value.id
+
+
+def scan_checkpoint(scan: Scan) -> ScanCheckpoint:
+    return ScanCheckpoint(
+        channel_id=scan.channel.id,
+        limit=scan.limit,
+        after=_snowflake(scan.after, high=True),
+        before=_snowflake(scan.before, high=False),
+        cursor=scan.cursor,
+        done=scan.done,
+    )
+
+
+def restore_scan(checkpoint: ScanCheckpoint, channel: disnake.abc.Messageable) -> Scan:
+    return Scan(
+        channel,
+        limit=checkpoint.limit,
+        after=None if checkpoint.after is None else disnake.Object(checkpoint.after),
+        before=None if checkpoint.before is None else disnake.Object(checkpoint.before),
+        cursor=checkpoint.cursor,
+        done=checkpoint.done,
+    )
+
+
+def new_job_id() -> int:
+    """Short IDs are easy to type in the admin command.
+
+    IDs of finished jobs aren't reused, so a stale command or log line can't refer to a newer backfill.
+    """
+    global _next_job_id
+    job_id = _next_job_id
+    _next_job_id += 1
+    if _store is not None:
+        _store.put_async(NEXT_JOB_ID_KEY, _next_job_id)
+    return job_id
+
+
+def save_job(job: BackfillJob) -> None:
+    """Store the job and persist it in background."""
+    _jobs_cache[job.job_id] = job
+    if _store is not None:
+        _store.put_async(str(job.job_id), cattrs.unstructure(job))
+
+
+def delete_job(job_id: int) -> bool:
+    """Delete the job's checkpoint. Returns True if it existed."""
+    if _jobs_cache.pop(job_id, None) is None:
+        return False
+    if _store is not None:
+        _store.delete_async([str(job_id)])
+    return True
+
+
+def get_job(job_id: int) -> BackfillJob | None:
+    return _jobs_cache.get(job_id)
+
+
+def get_jobs() -> list[BackfillJob]:
+    return list(_jobs_cache.values())
+
+
+def _reset_cache() -> None:
+    """Reset cache state. Used for testing."""
+    global _jobs_cache, _next_job_id, _cache_initialized, _store
+    if _store is not None:
+        _store.close()
+    _jobs_cache = {}
+    _next_job_id = 1
+    _cache_initialized = False
+    _store = None
+
+
+# Load cache at module import (bot start)
+_init_cache()
@@ -1,28 +1,78 @@
 """Persistence layer for hall of fame forwarded messages.
 
 Tracks which original messages were already forwarded so they are not forwarded
-twice, surviving bot restarts via a JSON file. Timestamps are stored as unix
-floats so entries from Discord (timezone-aware) and locally created ones are
-directly comparable.
+twice, surviving bot restarts via a SQLite table updated row by row. Timestamps are
+stored as unix floats so entries from Discord (timezone-aware) and locally created
+ones are directly comparable. The JSON file used before is imported on first start.
 """
 
+import heapq
 import logging
 import os
 from pathlib import Path
 
-from common.persistence import load_json, save_json_async
+from common.persistence import KeyValueStore
 
 logger = logging.getLogger(__name__)
 
-DEFAULT_FAME_FILE = Path(__file__).parent.parent.parent / "data" / "grossmann" / "forwarded_fames.json"
+DEFAULT_FAME_FILE = Path(__file__).parent.parent.parent / "data" / "grossmann" / "forwarded_fames.db"
 
 # Keep only the most recent forwarded messages around for duplicate checking.
 # Sized to cover a full backfill window so re-runs don't re-forward evicted entries.
 MAX_TRACKED = 5000
 
+
+class NewestIds:
+    """Message IDs with timestamps, keeping only the ``maxsize`` newest ones.
+
+    A min-heap on timestamps finds the oldest entry in O(log n). Heap entries of IDs marked again
+    are skipped lazily and the heap is rebuilt once they make up half of it.
+    """
+
+    def __init__(self, maxsize: int, items: dict[int, float] | None = None):
+        self.maxsize = maxsize
+        self.evictions = 0
+        self._timestamps: dict[int, float] = dict(items or {})
+        self._heap: list[tuple[float, int]] = []
+        self._rebuild()
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._timestamps
+
+    def __len__(self) -> int:
+        return len(self._timestamps)
+
+    def _rebuild(self) -> None:
+        self._heap = [(timestamp, message_id) for message_id, timestamp in self._timestamps.items()]
+        heapq.heapify(self._heap)
+
+    def add(self, message_id: int, timestamp: float) -> list[int]:
+        """Track the ID, returns the evicted ones, possibly including this one if it's the oldest."""
+        self._timestamps[message_id] = timestamp
+        heapq.heappush(self._heap, (timestamp, message_id))
+        return self.trim()
+
+    def trim(self) -> list[int]:
+        """Evict the oldest IDs over maxsize and return them."""
+        evicted = []
+        while len(self._timestamps) > self.maxsize:
+            timestamp, message_id = heapq.heappop(self._heap)
+            if self._timestamps.get(message_id) == timestamp:
+                del self._timestamps[message_id]
+                evicted.append(message_id)
+        self.evictions += len(evicted)
+        if len(self._heap) > 2 * len(self._timestamps) + 64:
+            self._rebuild()
+        return evicted
+
+    def as_dict(self) -> dict[int, float]:
+        return dict(self._timestamps)
+
+
 # In-memory cache: original message_id -> unix timestamp when forwarded
-_forwarded_cache: dict[int, float] = {}
+_forwarded_cache = NewestIds(MAX_TRACKED)
 _cache_initialized = False
+_store: KeyValueStore | None = None
 
 
 def _get_fame_file_path() -> Path:
@@ -30,30 +80,35 @@ def _get_fame_file_path() -> Path:
     return Path(env_path) if env_path else DEFAULT_FAME_FILE
 
 
-def _load_from_file() -> dict[int, float]:
-    # JSON object keys are strings, convert them back to ints.
-    data = load_json(_get_fame_file_path(), default={})
-    return {int(k): float(v) for k, v in data.items()}
+def _open_store() -> KeyValueStore:
+    path = _get_fame_file_path()
+    store = KeyValueStore(path, "forwarded_fames")
+    # JSON object keys were strings already
+    store.import_json(path.with_suffix(".json"), lambda data: dict(data))
+    return store
 
 
-def _save_async() -> None:
-    save_json_async(_get_fame_file_path(), {str(k): v for k, v in _forwarded_cache.items()})
+def _load_from_store(store: KeyValueStore) -> dict[int, float]:
+    # keys are strings, convert them back to ints.
+    return {int(k): float(v) for k, v in store.load().items()}
 
 
 def _init_cache() -> None:
-    global _forwarded_cache, _cache_initialized
+    global _forwarded_cache, _cache_initialized, _store
     if _cache_initialized:
         return
-    _forwarded_cache = _load_from_file()
+    _store = _open_store()
+    _forwarded_cache = NewestIds(MAX_TRACKED, _load_from_store(_store))
+    _trim(_forwarded_cache.trim())
     _cache_initialized = True
     logger.info(f"Loaded {len(_forwarded_cache)} forwarded hall of fame IDs from cache")
 
 
-def _trim() -> None:
-    global _forwarded_cache
-    if len(_forwarded_cache) > MAX_TRACKED:
-        newest = sorted(_forwarded_cache.items(), key=lambda item: item[1], reverse=True)[:MAX_TRACKED]
-        _forwarded_cache = dict(newest)
+def _trim(evicted: list[int]) -> None:
+    if evicted:
+        logger.debug(f"Evicted {len(evicted)} oldest forwarded hall of fame IDs")
+        if _store is not None:
+            _store.delete_async(str(k) for k in evicted)
 
 
 def is_forwarded(message_id: int) -> bool:
@@ -63,21 +118,30 @@ def is_forwarded(message_id: int) -> bool:
 
 def mark_forwarded(message_id: int, timestamp: float) -> None:
     """Record a message as forwarded and persist the change."""
-    _forwarded_cache[message_id] = timestamp
-    _trim()
-    _save_async()
+    evicted = _forwarded_cache.add(message_id, timestamp)
+    if _store is not None:
+        _store.put_async(str(message_id), timestamp)
+    _trim(evicted)
 
 
 def get_forwarded() -> dict[int, float]:
     """Return a copy of the tracked forwarded messages."""
-    return dict(_forwarded_cache)
+    return _forwarded_cache.as_dict()
+
+
+def stats() -> dict[str, int]:
+    """Number of tracked IDs, the limit and how many were evicted since start."""
+    return {"tracked": len(_forwarded_cache), "max_tracked": MAX_TRACKED, "evictions": _forwarded_cache.evictions}
 
 
 def _reset_cache() -> None:
     """Reset cache state. Used for testing."""
-    global _forwarded_cache, _cache_initialized
-    _forwarded_cache = {}
+    global _forwarded_cache, _cache_initialized, _store
+    if _store is not None:
+        _store.close()
+    _forwarded_cache = NewestIds(MAX_TRACKED)
     _cache_initialized = False
+    _store = None
 
 
 # Load cache at module import (bot start)
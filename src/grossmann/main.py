@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 import random
@@ -7,7 +8,7 @@ from datetime import datetime, timezone
 from typing import TypeAlias
 
 import disnake
-from common import discord_logging
+from common import discord_logging, persistence
 from common.constants import (
     Channel,
     GROSSMAN_NAME,
@@ -44,14 +45,16 @@ from disnake import (
     Intents,
 )
 from disnake.ext.commands import Param, InteractionBot, default_member_permissions
-from disnake.ext import tasks
 from disnake.ui import Button, View
 from dotenv import load_dotenv
-from grossmann import fame_persistence
+from grossmann import backfill_persistence, fame_persistence
+from grossmann.backfill import AdaptiveRateLimiter, BackfillProgress, CoalescedEditor, Scan, run_backfill, split_range
+from grossmann.backfill_persistence import BackfillJob, ScanCheckpoint
 from grossmann import grossmanndict as grossdi
 from grossmann.grossmanndict import WAIFU_CATEGORIES, WAIFU_ALLOWED_NSFW, WELCOME, GAME_EN, GAME_CZ
 from grossmann.pause_persistence import (
     add_paused_user,
+    next_expiry,
     remove_expired_pauses,
     get_paused_users,
     get_user_pause,
@@ -228,9 +231,10 @@ async def on_ready():
     await hall_of_fame_history_fetching()
     # Restore paused roles for users who were paused before restart
     await restore_paused_users()
-    # Start the background task to check for expired pauses
-    if not check_expired_pauses.is_running():
-        check_expired_pauses.start()
+    # Start the background task removing expired pauses
+    global _pause_expiry_task
+    if _pause_expiry_task is None or _pause_expiry_task.done():
+        _pause_expiry_task = asyncio.create_task(expire_pauses())
     logger.info(f"{client.user} has connected to Discord!")
 
 
@@ -276,9 +280,32 @@ async def restore_paused_users():
             logger.error(f"No permission to add paused role to user {pause.user_id}")
 
 
-@tasks.loop(minutes=1)
+# longest sleep of the expiry task, pauses are in wall-clock time, which may jump while sleeping
+MAX_PAUSE_SLEEP = 3600  # seconds
+_pause_expiry_task: asyncio.Task | None = None
+# set when a pause is added, so the expiry task recomputes its sleep
+_pauses_changed = asyncio.Event()
+
+
+async def expire_pauses():
+    """Background task sleeping until the next pause expires, or until a pause is added."""
+    while True:
+        try:
+            await check_expired_pauses()
+        except Exception as e:
+            logger.exception("Failed to remove expired pauses", exc_info=e)
+        _pauses_changed.clear()
+        timeout = MAX_PAUSE_SLEEP
+        if (expires_at := next_expiry()) is not None:
+            timeout = min(max(expires_at - datetime.now().timestamp(), 0), MAX_PAUSE_SLEEP)
+        try:
+            await asyncio.wait_for(_pauses_changed.wait(), timeout)
+        except TimeoutError:
+            pass
+
+
 async def check_expired_pauses():
-    """Background task to check and remove expired pauses."""
+    """Remove expired pauses and their roles."""
     expired = remove_expired_pauses()
 
     for pause in expired:
@@ -348,10 +375,11 @@ def _parse_backfill_date(value: str | None) -> datetime | None:
     return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
 
 
-async def forward_to_fame_if_qualifies(message: Message) -> bool:
+async def forward_to_fame_if_qualifies(message: Message, limiter: AdaptiveRateLimiter | None = None) -> bool:
     """Forward a message to its hall of fame destination if it qualifies and wasn't sent yet.
 
-    Returns True when a forward happened. Shared by the live reaction listener and the backfill command.
+    Returns True when a forward happened. Shared by the live reaction listener and the backfill command,
+    which paces its forwards with a limiter.
     """
     # Skip the fame channels themselves, and avoid duplicate forwarding by checking if already sent.
     # The persistence cache is a dict lookup, much faster than fetching channel history.
@@ -362,7 +390,10 @@ async def forward_to_fame_if_qualifies(message: Message) -> bool:
 
     # Mark BEFORE forwarding so simultaneous reactions only forward once.
     fame_persistence.mark_forwarded(message.id, datetime.now().timestamp())
-    await message.forward(fame_destination(message))
+    if limiter is not None:
+        await limiter.call(message.forward, fame_destination(message))
+    else:
+        await message.forward(fame_destination(message))
     return True
 
 
@@ -737,6 +768,7 @@ async def pause_me(
     # Add the role and persist
     await user.add_roles(role, reason=f"Paused themselves for {hours} hours")
     expires_at = add_paused_user(user.id, ctx.guild_id, hours)
+    _pauses_changed.set()
 
     await ctx.response.send_message(
         f"✅ You have been paused until {expires_at.strftime('%Y-%m-%d %H:%M:%S')} ({hours} hours).",
@@ -840,66 +872,203 @@ async def backfill_fame(
     before: str | None = Param(
         default=None, description="Scan the whole window before this UTC date (YYYY-MM-DD); overrides limit"
     ),
+    server_wide: bool = Param(default=False, description="Scan all text channels of the server instead of one"),
 ):
     """Two mutually exclusive modes:
 
-    - Count mode (default): scan the most recent `limit` messages, newest-first.
+    - Count mode (default): scan the most recent `limit` messages of each channel.
     - Date-range mode: pass `after` and/or `before` (YYYY-MM-DD, UTC) to scan the entire
-      time window regardless of count. Setting either date ignores `limit`.
+      time window regardless of count. Setting either date ignores `limit`. With both dates
+      the window is split into slices scanned concurrently.
+
+    Channels and slices are scanned concurrently, candidates are forwarded oldest-first
+    within each of them.
     """
     await ctx.response.defer(ephemeral=True)
     target = channel or ctx.channel
+    if server_wide:
+        # history() of a channel the bot can't read raises Forbidden and would fail the whole backfill
+        me = ctx.guild.me
+        channels = [
+            c
+            for c in ctx.guild.text_channels
+            if c.id not in FAME_CHANNELS and c.permissions_for(me).read_message_history
+        ]
+        where = "the server"
+    else:
+        channels = [target]
+        where = target.mention
 
     after_dt = _parse_backfill_date(after)
     before_dt = _parse_backfill_date(before)
+    # Date-range mode scans the whole window (no count cap), count mode the most recent `limit` messages.
+    if after_dt is not None and before_dt is not None:
+        scans = [Scan(c, after=start, before=end) for c in channels for start, end in split_range(after_dt, before_dt)]
+    elif after_dt is not None or before_dt is not None:
+        scans = [Scan(c, after=after_dt, before=before_dt) for c in channels]
+    else:
+        scans = [Scan(c, limit=limit) for c in channels]
+    scan_target = limit * len(channels) if after_dt is None and before_dt is None else None
+
+    job = BackfillJob(
+        job_id=backfill_persistence.new_job_id(),
+        guild_id=ctx.guild_id,
+        where=where,
+        started_by=str(ctx.author),
+        started_at=datetime.now().timestamp(),
+        scans=[backfill_persistence.scan_checkpoint(scan) for scan in scans],
+    )
+    backfill_persistence.save_job(job)
+    await run_backfill_job(ctx, job, scans, scan_target)
 
-    # Date-range mode: scan the whole window (no count cap) oldest-first; disnake already
-    # yields chronologically so no reverse is needed. Otherwise scan the most recent `limit`
-    # messages newest-first and reverse before forwarding.
-    if after_dt is not None or before_dt is not None:
-        history = target.history(limit=None, after=after_dt, before=before_dt, oldest_first=True)
-        scan_target = None
+
+# backfills running in this process: job ID -> task
+_running_backfills: dict[int, asyncio.Task[BackfillProgress]] = {}
+
+
+async def run_backfill_job(
+    ctx: ApplicationCommandInteraction,
+    job: BackfillJob,
+    scans: list[Scan],
+    scan_target: int | None = None,
+    missing: list[ScanCheckpoint] | None = None,
+) -> None:
+    """Run the scans of a backfill, checkpointing them with every progress edit.
+
+    The checkpoint is deleted once the backfill completes, and kept for a resume when it fails or the bot stops.
+    Missing are the checkpoints of channels that weren't found, they are kept for a later resume too.
+    """
+    missing = missing or []
+    limiter = AdaptiveRateLimiter()
+    editor = CoalescedEditor(lambda content: ctx.edit_original_response(content=content))
+    # totals of the previous runs of a resumed backfill
+    scanned_before, forwarded_before = job.scanned, job.forwarded
+    current = BackfillProgress(scans=len(scans))
+
+    def checkpoint() -> None:
+        job.scans = [backfill_persistence.scan_checkpoint(scan) for scan in scans] + missing
+        job.scanned = scanned_before + current.scanned
+        job.forwarded = forwarded_before + len(current.forwarded_times)
+        backfill_persistence.save_job(job)
+
+    async def report(progress: BackfillProgress, message: Message | None) -> None:
+        nonlocal current
+        current = progress
+        scanned = progress_bar(progress.scanned, scan_target) if scan_target else f"scanned {progress.scanned}"
+        content = (
+            f"Scanning {job.where} (backfill {job.job_id})… {scanned}, "
+            f"{progress.scans_done}/{progress.scans} scan(s) done\n"
+            f"Forwarded {len(progress.forwarded_times)} of {progress.candidates} candidate(s) found so far."
+        )
+        if message is not None:
+            content += f"\nLast message from {_fmt_time(message.created_at)}."
+        if await editor.update(content):
+            checkpoint()
+
+    task = asyncio.create_task(
+        run_backfill(scans, qualifies_for_fame, lambda message: forward_to_fame_if_qualifies(message, limiter), report)
+    )
+    _running_backfills[job.job_id] = task
+    try:
+        progress = await task
+    except asyncio.CancelledError:
+        if backfill_persistence.get_job(job.job_id) is not None:
+            # the bot is stopping, not cancelled by an admin
+            checkpoint()
+            raise
+        await editor.final(f"Backfill {job.job_id} of {job.where} cancelled.")
+        return
+    except Exception:
+        checkpoint()
+        await editor.final(
+            f"Backfill {job.job_id} of {job.where} failed, resume it with `/backfill_jobs action:resume job_id:{job.job_id}`."
+        )
+        raise
+    finally:
+        del _running_backfills[job.job_id]
+    unfinished = [checkpoint.channel_id for checkpoint in missing if not checkpoint.done]
+    if unfinished:
+        checkpoint()
     else:
-        history = target.history(limit=limit)
-        scan_target = limit
-
-    # Phase 1: scan history, reporting progress.
-    candidates = []
-    scanned = 0
-    async for message in history:
-        scanned += 1
-        if qualifies_for_fame(message):
-            candidates.append(message)
-        if scanned % 100 == 0:
-            progress = progress_bar(scanned, scan_target) if scan_target else f"scanned {scanned}"
-            await ctx.edit_original_response(
-                content=f"Scanning {target.mention}… {progress}\nFound {len(candidates)} candidate(s) so far."
-            )
-    # Forward oldest-first so the hall of fame stays chronological.
-    if scan_target is not None:
-        candidates.reverse()
-
-    # Phase 2: forward candidates, reporting progress and the message's own timestamp.
-    forwarded_times: list[datetime] = []
-    total = len(candidates)
-    for i, message in enumerate(candidates, start=1):
-        if await forward_to_fame_if_qualifies(message):
-            forwarded_times.append(message.created_at)
-        if i % 5 == 0 or i == total:
-            await ctx.edit_original_response(
-                content=f"Forwarding to hall of fame… {progress_bar(i, total)}\nLast message from {_fmt_time(message.created_at)}."
-            )
+        backfill_persistence.delete_job(job.job_id)
 
+    forwarded_times = progress.forwarded_times
     forwarded = len(forwarded_times)
-    logger.info(f"Backfill of #{target.name} by {ctx.author.name}: forwarded {forwarded} messages")
+    logger.info(
+        f"Backfill {job.job_id} of {job.where} by {ctx.author.name}: forwarded {forwarded} messages, "
+        f"rate limited {limiter.rate_limited} times"
+    )
 
     summary = (
-        f"Backfill of {target.mention} complete: forwarded {forwarded} new message(s) "
-        f"out of {total} candidate(s) in the last {scanned} scanned."
+        f"Backfill of {job.where} complete: forwarded {forwarded} new message(s) "
+        f"out of {progress.candidates} candidate(s) in the last {progress.scanned} scanned."
     )
     if forwarded_times:
         summary += f"\nMessages from {_fmt_time(min(forwarded_times))} to {_fmt_time(max(forwarded_times))}."
-    await ctx.edit_original_response(content=summary)
+    if unfinished:
+        summary += (
+            f"\n{len(unfinished)} channel(s) not found: {', '.join(map(str, unfinished))}, kept in backfill "
+            f"{job.job_id}. Resume it once the bot can see them again, or cancel it."
+        )
+    await editor.final(summary)
+
+
+@client.slash_command(
+    name="backfill_jobs",
+    description="List, resume or cancel hall of fame backfills (admin only).",
+    guild_ids=get_gids(),
+)
+@default_member_permissions(administrator=True)
+async def backfill_jobs(
+    ctx: ApplicationCommandInteraction,
+    action: str = Param(choices=["list", "resume", "cancel"], default="list", description="What to do"),
+    job_id: int | None = Param(default=None, gt=0, description="Backfill to resume or cancel, as listed"),
+):
+    if action == "list":
+        await ctx.response.send_message(backfill_list(ctx.guild_id), ephemeral=True)
+        return
+
+    job = backfill_persistence.get_job(job_id) if job_id is not None else None
+    if job is None or job.guild_id != ctx.guild_id:
+        await ctx.response.send_message(f"No unfinished backfill {job_id}.", ephemeral=True)
+        return
+
+    if action == "cancel":
+        backfill_persistence.delete_job(job.job_id)
+        if task := _running_backfills.get(job.job_id):
+            task.cancel()
+        await ctx.response.send_message(f"Backfill {job.job_id} of {job.where} cancelled.", ephemeral=True)
+        return
+
+    if job.job_id in _running_backfills:
+        await ctx.response.send_message(f"Backfill {job.job_id} is already running.", ephemeral=True)
+        return
+    await ctx.response.defer(ephemeral=True)
+    scans = []
+    missing = []
+    for checkpoint in job.scans:
+        scan_channel = client.get_channel(checkpoint.channel_id)
+        if scan_channel is None:
+            logger.warning(f"Backfill {job.job_id}: channel {checkpoint.channel_id} not found, keeping its checkpoint")
+            missing.append(checkpoint)
+            continue
+        scans.append(backfill_persistence.restore_scan(checkpoint, scan_channel))
+    await run_backfill_job(ctx, job, scans, missing=missing)
+
+
+def backfill_list(guild_id: int) -> str:
+    jobs = [job for job in backfill_persistence.get_jobs() if job.guild_id == guild_id]
+    if not jobs:
+        return "No unfinished backfills."
+    response = "Unfinished backfills:\n"
+    for job in jobs:
+        started_at = datetime.fromtimestamp(job.started_at).strftime("%Y-%m-%d %H:%M:%S")
+        state = "running" if job.job_id in _running_backfills else "interrupted"
+        response += (
+            f"{job.job_id}: {job.where} by {job.started_by} at {started_at}, {state}, "
+            f"{job.scans_done()}/{len(job.scans)} scan(s) done, scanned {job.scanned}, forwarded {job.forwarded}\n"
+        )
+    return response
 
 
 def forwarded_fames() -> str:
@@ -929,6 +1098,7 @@ async def debug_dump(ctx: ApplicationCommandInteraction):
         {ping_content(client)}
         {get_gids()=}
         {forwarded_fames()}
+        {fame_persistence.stats()=}
         {paused_users()}
     """)
     await ctx.response.send_message(response)
@@ -970,6 +1140,8 @@ async def command(ctx: ApplicationCommandInteraction):
 
 async def cleanup():
     """Clean up resources when bot shuts down"""
+    # waits for the pending writes, every reconnect fires on_disconnect too
+    await asyncio.to_thread(persistence.flush)
     await close_http_session()
 
 
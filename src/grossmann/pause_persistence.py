@@ -1,9 +1,12 @@
 """Persistence layer for paused users.
 
-Stores user pause data in a JSON file to survive bot restarts.
-Cache is loaded once at module import and saved atomically in background.
+Stores user pause data in a SQLite table to survive bot restarts, the JSON file used before is imported on first start.
+Cache is loaded once at module import, changed rows are written in background.
+Pauses are indexed by (user_id, guild_id), and a min-heap on expires_at gives the next expiry,
+so the expiry task can sleep until then.
 """
 
+import heapq
 import logging
 import os
 from datetime import datetime
@@ -12,16 +15,21 @@ from pathlib import Path
 import attrs
 import cattrs
 
-from common.persistence import load_json, save_json_async
+from common.persistence import KeyValueStore
 
 logger = logging.getLogger(__name__)
 
 # Default path for pause data storage
-DEFAULT_PAUSE_FILE = Path(__file__).parent.parent.parent / "data" / "grossmann" / "paused_users.json"
+DEFAULT_PAUSE_FILE = Path(__file__).parent.parent.parent / "data" / "grossmann" / "paused_users.db"
+
+PauseKey = tuple[int, int]  # (user_id, guild_id)
 
 # In-memory cache
-_paused_users_cache: list["PausedUser"] = []
+_paused_users_cache: dict[PauseKey, "PausedUser"] = {}
+# (expires_at, user_id, guild_id) of every pause, entries of removed or replaced pauses are skipped lazily
+_expiry_heap: list[tuple[float, int, int]] = []
 _cache_initialized = False
+_store: KeyValueStore | None = None
 
 
 @attrs.define
@@ -49,34 +57,70 @@ def _get_pause_file_path() -> Path:
     return DEFAULT_PAUSE_FILE
 
 
-def _load_from_file() -> list[PausedUser]:
-    """Load paused users from file."""
-    data = load_json(_get_pause_file_path(), default=[])
+def _key(user_id: int, guild_id: int) -> str:
+    return f"{user_id}:{guild_id}"
+
+
+def _open_store() -> KeyValueStore:
+    path = _get_pause_file_path()
+    store = KeyValueStore(path, "paused_users")
+    store.import_json(path.with_suffix(".json"), lambda data: {_key(e["user_id"], e["guild_id"]): e for e in data})
+    return store
+
+
+def _load_from_store(store: KeyValueStore) -> list[PausedUser]:
+    """Load paused users from the store."""
     try:
-        return [cattrs.structure(entry, PausedUser) for entry in data]
+        return [cattrs.structure(entry, PausedUser) for entry in store.load().values()]
     except Exception as e:
         logger.error(f"Failed to parse paused users: {e}")
         return []
 
 
-def _save_async() -> None:
-    """Save current cache state in a background thread, non-blocking."""
-    save_json_async(_get_pause_file_path(), [cattrs.unstructure(p) for p in _paused_users_cache])
+def _save_async(pause: PausedUser) -> None:
+    """Save one pause in a background thread, non-blocking."""
+    if _store is not None:
+        _store.put_async(_key(pause.user_id, pause.guild_id), cattrs.unstructure(pause))
+
+
+def _delete_async(pauses: list[PausedUser]) -> None:
+    """Delete pauses in a background thread, non-blocking."""
+    if _store is not None:
+        _store.delete_async(_key(p.user_id, p.guild_id) for p in pauses)
+
+
+def _track(pause: PausedUser) -> None:
+    """Add a pause to the cache, replacing the user's previous pause in the guild."""
+    _paused_users_cache[pause.user_id, pause.guild_id] = pause
+    heapq.heappush(_expiry_heap, (pause.expires_at, pause.user_id, pause.guild_id))
+
+
+def _is_current(entry: tuple[float, int, int]) -> bool:
+    expires_at, user_id, guild_id = entry
+    pause = _paused_users_cache.get((user_id, guild_id))
+    return pause is not None and pause.expires_at == expires_at
+
+
+def _drop_stale() -> None:
+    while _expiry_heap and not _is_current(_expiry_heap[0]):
+        heapq.heappop(_expiry_heap)
 
 
 def _init_cache() -> None:
     """Initialize cache from file. Called once at module import."""
-    global _paused_users_cache, _cache_initialized
+    global _cache_initialized, _store
     if _cache_initialized:
         return
-    _paused_users_cache = _load_from_file()
+    _store = _open_store()
+    for pause in _load_from_store(_store):
+        _track(pause)
     _cache_initialized = True
     logger.info(f"Loaded {len(_paused_users_cache)} paused users from cache")
 
 
 def get_paused_users() -> list[PausedUser]:
     """Get all paused users from cache."""
-    return list(_paused_users_cache)
+    return list(_paused_users_cache.values())
 
 
 def add_paused_user(user_id: int, guild_id: int, hours: float) -> datetime:
@@ -84,15 +128,12 @@ def add_paused_user(user_id: int, guild_id: int, hours: float) -> datetime:
 
     Returns the expiration datetime.
     """
-    global _paused_users_cache
     expires_at = datetime.now().timestamp() + (hours * 3600)
 
-    # Remove existing entry for this user/guild if present
-    _paused_users_cache = [p for p in _paused_users_cache if not (p.user_id == user_id and p.guild_id == guild_id)]
-
-    # Add new entry
-    _paused_users_cache.append(PausedUser(user_id=user_id, guild_id=guild_id, expires_at=expires_at))
-    _save_async()
+    # Replaces existing entry for this user/guild if present
+    pause = PausedUser(user_id=user_id, guild_id=guild_id, expires_at=expires_at)
+    _track(pause)
+    _save_async(pause)
 
     return datetime.fromtimestamp(expires_at)
 
@@ -102,48 +143,55 @@ def remove_paused_user(user_id: int, guild_id: int) -> bool:
 
     Returns True if the user was found and removed.
     """
-    global _paused_users_cache
-    original_count = len(_paused_users_cache)
-
-    _paused_users_cache = [p for p in _paused_users_cache if not (p.user_id == user_id and p.guild_id == guild_id)]
-
-    if len(_paused_users_cache) < original_count:
-        _save_async()
-        return True
-    return False
+    removed = _paused_users_cache.pop((user_id, guild_id), None)
+    if removed is None:
+        return False
+    _delete_async([removed])
+    return True
 
 
 def get_expired_pauses() -> list[PausedUser]:
     """Get all pauses that have expired."""
-    return [p for p in _paused_users_cache if p.is_expired()]
+    now = datetime.now().timestamp()
+    return [p for p in _paused_users_cache.values() if p.expires_at <= now]
 
 
 def remove_expired_pauses() -> list[PausedUser]:
     """Remove all expired pauses and return the list of removed entries."""
-    global _paused_users_cache
-
-    expired = [p for p in _paused_users_cache if p.is_expired()]
-    _paused_users_cache = [p for p in _paused_users_cache if not p.is_expired()]
+    now = datetime.now().timestamp()
+    expired = []
+    _drop_stale()
+    while _expiry_heap and _expiry_heap[0][0] <= now:
+        _, user_id, guild_id = heapq.heappop(_expiry_heap)
+        expired.append(_paused_users_cache.pop((user_id, guild_id)))
+        _drop_stale()
 
     if expired:
-        _save_async()
+        _delete_async(expired)
 
     return expired
 
 
+def next_expiry() -> float | None:
+    """Unix timestamp of the earliest pause expiry, None if nobody is paused."""
+    _drop_stale()
+    return _expiry_heap[0][0] if _expiry_heap else None
+
+
 def get_user_pause(user_id: int, guild_id: int) -> PausedUser | None:
     """Get the pause entry for a specific user if it exists."""
-    for p in _paused_users_cache:
-        if p.user_id == user_id and p.guild_id == guild_id:
-            return p
-    return None
+    return _paused_users_cache.get((user_id, guild_id))
 
 
 def _reset_cache() -> None:
     """Reset cache state. Used for testing."""
-    global _paused_users_cache, _cache_initialized
-    _paused_users_cache = []
+    global _paused_users_cache, _expiry_heap, _cache_initialized, _store
+    if _store is not None:
+        _store.close()
+    _paused_users_cache = {}
+    _expiry_heap = []
     _cache_initialized = False
+    _store = None
 
 
 # Load cache at module import (bot start)
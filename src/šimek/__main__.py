@@ -0,0 +1,3 @@
+from šimek.main import main
+
+main()
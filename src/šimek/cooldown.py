@@ -0,0 +1,222 @@
+"""Rate limits of šimek's replies.
+
+Every channel and every user has a token bucket on the monotonic clock. A reply takes a token
+from both, a channel refills one token per its cooldown, a user ``USER_BURST`` tokens per
+``USER_COOLDOWN``. A full bucket is the same as no bucket, so buckets are dropped once full
+by a timing wheel, which touches only the buckets expiring in the elapsed ticks.
+
+The state is saved as JSON with wall-clock times, so a restart doesn't reset the cooldowns.
+"""
+
+import datetime as dt
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Literal
+
+from common.persistence import PathLike, load_json, save_json_async
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COOLDOWN_FILE = Path(__file__).parent.parent.parent / "data" / "šimek" / "cooldowns.json"
+
+USER_COOLDOWN = 60  # sekund
+USER_BURST = 3
+
+WHEEL_TICK = 1.0  # seconds
+WHEEL_SLOTS = 512
+
+Kind = Literal["channel", "user"]
+Key = tuple[Kind, int]
+
+
+def get_cooldown_file_path() -> Path:
+    """Get the path for the cooldown state file, allowing override via env var."""
+    env_path = os.environ.get("ŠIMEK_COOLDOWN_FILE")
+    if env_path:
+        return Path(env_path)
+    return DEFAULT_COOLDOWN_FILE
+
+
+@dataclass
+class Bucket:
+    tokens: float
+    updated: float  # monotonic time of the last refill
+    muted_until: float = 0.0  # monotonic
+    last_reply: float = 0.0  # monotonic
+    scheduled: int = -1  # wheel tick the bucket is scheduled to expire in
+
+
+class CooldownManager:
+    def __init__(
+        self,
+        channel_cooldown: Callable[[int], float],
+        *,
+        user_cooldown: float = USER_COOLDOWN,
+        user_burst: int = USER_BURST,
+        file_path: PathLike | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        wall_clock: Callable[[], float] = time.time,
+    ):
+        self._channel_cooldown = channel_cooldown
+        self._user_cooldown = user_cooldown
+        self._user_burst = user_burst
+        self._file_path = file_path
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._buckets: dict[Key, Bucket] = {}
+        self._wheel: list[set[Key]] = [set() for _ in range(WHEEL_SLOTS)]
+        self._tick = self._tick_of(clock())
+        if file_path is not None:
+            self._load(file_path)
+
+    def _capacity(self, key: Key) -> int:
+        return 1 if key[0] == "channel" else self._user_burst
+
+    def _interval(self, key: Key) -> float:
+        """Seconds to refill one token, 0 or less means no limit."""
+        if key[0] == "channel":
+            return self._channel_cooldown(key[1])
+        return self._user_cooldown / self._user_burst
+
+    @staticmethod
+    def _tick_of(t: float) -> int:
+        return int(t // WHEEL_TICK)
+
+    def _refill(self, key: Key, bucket: Bucket, now: float) -> None:
+        capacity, interval = self._capacity(key), self._interval(key)
+        if interval <= 0:
+            bucket.tokens = capacity
+        else:
+            bucket.tokens = min(capacity, bucket.tokens + (now - bucket.updated) / interval)
+        bucket.updated = now
+
+    def _expires_at(self, key: Key, bucket: Bucket) -> float:
+        """When the bucket is full and not muted, so it can be forgotten."""
+        interval = max(self._interval(key), 0)
+        return max(bucket.updated + (self._capacity(key) - bucket.tokens) * interval, bucket.muted_until)
+
+    def _schedule(self, key: Key, bucket: Bucket) -> None:
+        if bucket.scheduled > self._tick:
+            return  # already in the wheel, rescheduled if it isn't expired when its slot comes
+        tick = self._tick_of(self._expires_at(key, bucket)) + 1
+        # beyond the wheel's span the bucket is checked again when its slot comes around
+        tick = min(max(tick, self._tick + 1), self._tick + WHEEL_SLOTS - 1)
+        bucket.scheduled = tick
+        self._wheel[tick % WHEEL_SLOTS].add(key)
+
+    def _advance(self, now: float) -> None:
+        current = self._tick_of(now)
+        # after a long pause every slot is due, but each one is visited once
+        start = max(self._tick + 1, current - WHEEL_SLOTS + 1)
+        for tick in range(start, current + 1):
+            self._tick = tick
+            slot, self._wheel[tick % WHEEL_SLOTS] = self._wheel[tick % WHEEL_SLOTS], set()
+            for key in slot:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    continue
+                bucket.scheduled = -1
+                if self._expires_at(key, bucket) <= now:
+                    del self._buckets[key]
+                else:
+                    self._schedule(key, bucket)
+        self._tick = current
+
+    def _bucket(self, key: Key, now: float) -> Bucket | None:
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            self._refill(key, bucket, now)
+        return bucket
+
+    def wait_time(self, channel_id: int, user_id: int) -> float:
+        """Seconds until šimek may reply to the user in the channel, 0 if it may now."""
+        now = self._clock()
+        self._advance(now)
+        wait = 0.0
+        for key in (("channel", int(channel_id)), ("user", int(user_id))):
+            bucket = self._bucket(key, now)
+            if bucket is None:
+                continue
+            wait = max(wait, bucket.muted_until - now)
+            if bucket.tokens < 1:
+                wait = max(wait, (1 - bucket.tokens) * self._interval(key))
+        return wait
+
+    def record(self, channel_id: int, user_id: int) -> None:
+        """Take a token from the channel and the user after replying."""
+        now = self._clock()
+        self._advance(now)
+        for key in (("channel", int(channel_id)), ("user", int(user_id))):
+            bucket = self._bucket(key, now) or self._buckets.setdefault(key, Bucket(self._capacity(key), now))
+            bucket.tokens = max(bucket.tokens - 1, 0)
+            bucket.last_reply = now
+            self._schedule(key, bucket)
+        self._save()
+
+    def mute(self, channel_id: int, seconds: float) -> None:
+        now = self._clock()
+        self._advance(now)
+        key: Key = ("channel", int(channel_id))
+        bucket = self._bucket(key, now) or self._buckets.setdefault(key, Bucket(self._capacity(key), now))
+        bucket.muted_until = now + seconds
+        self._schedule(key, bucket)
+        self._save()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def state(self) -> list[dict]:
+        """Buckets with wall-clock times, for saving and for the admin commands."""
+        now, wall_now = self._clock(), self._wall_clock()
+        self._advance(now)
+
+        def wall(t: float) -> float:
+            return wall_now - (now - t) if t else 0.0
+
+        return [
+            {
+                "kind": kind,
+                "id": id_,
+                "tokens": bucket.tokens,
+                "updated": wall(bucket.updated),
+                "muted_until": wall(bucket.muted_until) if bucket.muted_until > now else 0.0,
+                "last_reply": wall(bucket.last_reply),
+            }
+            for (kind, id_), bucket in self._buckets.items()
+        ]
+
+    def report(self, name_of: Callable[[Kind, int], str]) -> str:
+        lines = [f"Cooldowns ({len(self)} buckets):"]
+        for entry in sorted(self.state(), key=lambda entry: -entry["last_reply"]):
+            line = f"{entry['kind']} {name_of(entry['kind'], entry['id'])}: {entry['tokens']:.2f} tokens"
+            if entry["last_reply"]:
+                line += f", last reply {dt.datetime.fromtimestamp(entry['last_reply']).strftime('%Y-%m-%d %H:%M:%S')}"
+            if entry["muted_until"]:
+                line += f", muted until {dt.datetime.fromtimestamp(entry['muted_until']).strftime('%H:%M:%S')}"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def _save(self) -> None:
+        if self._file_path is not None:
+            save_json_async(self._file_path, self.state())
+
+    def _load(self, file_path: PathLike) -> None:
+        now, wall_now = self._clock(), self._wall_clock()
+        for entry in load_json(file_path, default=[]):
+            try:
+                key: Key = (entry["kind"], int(entry["id"]))
+                bucket = Bucket(float(entry["tokens"]), now - (wall_now - entry["updated"]))
+                if entry["muted_until"]:
+                    bucket.muted_until = now - (wall_now - entry["muted_until"])
+                if entry.get("last_reply"):
+                    bucket.last_reply = now - (wall_now - entry["last_reply"])
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f"Skipping invalid cooldown entry {entry}: {e}")
+                continue
+            self._refill(key, bucket, now)
+            self._buckets[key] = bucket
+            self._schedule(key, bucket)
+        logger.info(f"Loaded {len(self._buckets)} cooldowns from {file_path}")
@@ -1,20 +1,22 @@
-import datetime as dt
+import asyncio
 import logging
 import os
 import random
-import re
 import textwrap
 
 import disnake
 
 from common.constants import Channel, ŠIMEK_NAME, KEKWR
 from common.http import close_http_session, prepare_http_response, TextResponse
-from common.utils import has_all, ping_function, ping_content, get_gids, has_any
-from common import discord_logging
+from common.utils import ping_function, ping_content, get_gids, has_any
+from common import discord_logging, persistence
 from disnake import Message, ApplicationCommandInteraction, Forbidden
+from disnake.ext import tasks
 from disnake.ext.commands import InteractionBot, default_member_permissions, Param
 from dotenv import load_dotenv
-from šimek import šimekdict
+from šimek import šimekdict, triggers
+from šimek.cooldown import CooldownManager, get_cooldown_file_path
+from šimek.text import YOUTUBE_CHANNEL_PATTERN, remove_mentions, views_of
 from šimek.šimekdict import RANDOM_EMOJIS
 
 # preload all useful stuff
@@ -24,11 +26,24 @@ load_dotenv()
 intents = disnake.Intents.all()
 client = InteractionBot(intents=intents)  # so we can have debug commands
 
-discord_logging.configure_logging(client)
-
-# so logger is configured, this is intentional, files are read when importing these
-from šimek.utils import format_time_ago, markov_chain
-from šimek.morphodita_utils import find_self_reference_a, needs_help_a
+# after load_dotenv, these read their settings from the environment
+from šimek.utils import (
+    MARKOV_PRUNE_HOURS,
+    MarkovIngest,
+    channel_models,
+    generate_markov,
+    load_trigram_counts,
+    prune_markov,
+    stop_process_pool,
+)
+from šimek.morphodita_utils import (
+    cache_stats,
+    find_self_reference_a,
+    needs_help_a,
+    start_loading,
+    start_tagger_processes,
+    tagger_ready,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -75,23 +90,22 @@ CUSTOM_COOLDOWNS = {
     Channel.BOT_TESTING.value: 0,
 }
 
-last_reaction_time: dict[int, dt.datetime] = {}
+# feeds the markov chain
+markov_ingest = MarkovIngest()
 
 
-@client.slash_command(description="Show last reaction times", guild_ids=get_gids())
+@client.slash_command(description="Show cooldowns of channels and users", guild_ids=get_gids())
 @default_member_permissions(administrator=True)
 async def show_last_reaction_times(inter: ApplicationCommandInteraction):
-    await inter.response.send_message(last_reaction_times())
+    await inter.response.send_message(last_reaction_times()[:2000])
 
 
 def last_reaction_times() -> str:
-    response = "Last reaction times per channel:\n"
-    for channel_id, time in last_reaction_time.items():
-        channel = client.get_channel(channel_id)
-        if channel:
-            time_ago = format_time_ago(time)
-            response += f"{channel.name}: {time.strftime('%Y-%m-%d %H:%M:%S')} ({time_ago})\n"
-    return response
+    def name_of(kind: str, id_: int) -> str:
+        target = client.get_channel(id_) if kind == "channel" else client.get_user(id_)
+        return target.name if target else str(id_)
+
+    return cooldowns.report(name_of)
 
 
 @client.slash_command(name="ping_šimek", description="check šimek latency", guild_ids=get_gids())
@@ -107,10 +121,28 @@ async def debug_dump(ctx: ApplicationCommandInteraction):
         {ping_content(client)}
         {get_gids()=}
         {last_reaction_times()}
+        {tagger_ready()=}
+        {cache_stats()=}
+        {channel_models.stats()=}
     """)
     await ctx.response.send_message(response)
 
 
+@client.slash_command(name="prune_markov_šimek", description="Decay and prune the markov model", guild_ids=get_gids())
+@default_member_permissions(administrator=True)
+async def prune_markov_command(inter: ApplicationCommandInteraction):
+    await inter.response.defer()
+    report = await prune_markov(ingest=markov_ingest)
+    await inter.followup.send(f"{report=}" if report else "Pruning is already running.")
+
+
+@tasks.loop(hours=MARKOV_PRUNE_HOURS or 24)
+async def prune_markov_loop():
+    # the first iteration runs right at start, there's nothing new to prune yet
+    if prune_markov_loop.current_loop:
+        await prune_markov(ingest=markov_ingest)
+
+
 # debug command/trolling
 @client.slash_command(name="respond_šimek", description="Respond something as šimek (admin only)", guild_ids=get_gids())
 @default_member_permissions(administrator=True)
@@ -128,16 +160,9 @@ async def respond(
 @client.event
 async def on_ready():
     logger.info(f"{client.user} has connected to Discord!")
-
-
-# we use an evil class magic to hack match case to check for substrings istead of exact matches
-# https://stackoverflow.com/a/78046484
-class Substring(str):
-    def __eq__(self, other):
-        return other in self
-
-
-# evil hack end
+    start_loading()
+    if MARKOV_PRUNE_HOURS > 0 and not prune_markov_loop.is_running():
+        prune_markov_loop.start()
 
 
 def cooldown(channel_id: int):
@@ -149,6 +174,10 @@ def cooldown(channel_id: int):
     return COOLDOWN
 
 
+# the saved cooldowns are loaded by main()
+cooldowns = CooldownManager(cooldown)
+
+
 async def do_response(reply: str, m: Message, *, chance: int = 10, reaction: bool = False):
     """
     reply: str - text or emoji to reply with
@@ -157,64 +186,52 @@ async def do_response(reply: str, m: Message, *, chance: int = 10, reaction: boo
     reaction: bool - if True, add reaction instead of reply
     """
     # safeguard against all role tags
-    if random.randint(1, chance) == 1:
+    if rolled(chance):
         try:
             reply = remove_mentions(reply)
             if reaction:
                 await m.add_reaction(reply)
             else:
                 await m.reply(reply)
-            last_reaction_time[m.channel.id] = dt.datetime.now()
+            cooldowns.record(m.channel.id, m.author.id)
         except Forbidden:
             logger.warning(f"Tried to post {reply=} to {m.content=} in {m.channel.name=}, but it's not allowed")
         except Exception as e:
             logger.exception(f"Failed to send {reply=}, {reaction=} in {m.channel.name=}", exc_info=e)
 
 
-def remove_mentions(reply: str) -> str:
-    return re.sub(r"<@!?&?\d+>|@everyone|@here", "`někdo`", reply)
+def rolled(chance: int) -> bool:
+    """1 in `chance` probability, same roll as do_response, for responses expensive to prepare."""
+    return random.randint(1, chance) == 1
+
+
+def oogway_help() -> str:
+    return f"""„{random.choice(šimekdict.MOT_HLASKY)}“
+                                                                                - Mistr Oogway, {random.randint(461, 490)} př. n. l."""
 
 
 async def manage_response(m: Message):
     # grok feature is above all others and will trigger anywhere
     response = ""
-    mess = m.content.lower()
+    views = views_of(m.content)
+    mess = views.lower
 
-    now = dt.datetime.now()
     # higher priority than the rest
     if "drž hubu" in mess and m.reference and m.reference.resolved and m.reference.resolved.author == client.user:
         await do_response("ok", m, chance=1)
-        last_reaction_time[m.channel.id] = now + dt.timedelta(minutes=5)  # 5-minute timeout after being told to shut up
-        return  # skip setting the time again at the end of the function
+        cooldowns.mute(m.channel.id, 5 * 60)  # 5-minute timeout after being told to shut up
+        return
 
-    last_time = last_reaction_time.get(m.channel.id)
-    if last_time and (seconds_diff := (now - last_time).total_seconds()) < cooldown(m.channel.id):
-        logger.debug(f"Too soon, last replied {seconds_diff} seconds ago")
+    if (wait := cooldowns.wait_time(m.channel.id, m.author.id)) > 0:
+        logger.debug(f"Too soon, can reply in {wait:.0f} seconds")
         return
 
-    if Substring(mess) in [
-        "@grok",
-        "@schizo",
-        "@šimek",
-        "@1420163586310803566",
-        "@&1437546286487175252",
-        "šimku",
-        "simku",
-    ]:
-        # Fetch previous 50 messages (excluding the current one)
-        messages = []
-        async for msg in m.channel.history(limit=50, before=m):
-            if msg.content:
-                msg.content = remove_mentions(msg.content)  # remove bot mentions
-                msg.content = msg.content.replace(",", "")  # cleanup
-                if msg.author == client.user:  # throw away messages from itself
-                    continue
-                messages.append(msg.content)
+    if triggers.MENTIONS.matches(mess):
         response = f"{random.choice(REPLIES)} Protože "
-        response += markov_chain(messages, max_words=random.randint(15, 40))
+        response += generate_markov(max_words=random.randint(15, 40), channel_id=m.channel.id)
         try:
             await m.reply(response)
-            last_reaction_time[m.channel.id] = dt.datetime.now()
+            cooldowns.record(m.channel.id, m.author.id)
         except Forbidden:
             logger.warning(f"Tried to post {response=} to {m.content=} in {m.channel.name=}, but it's not allowed")
         return
@@ -235,125 +252,112 @@ async def manage_response(m: Message):
     elif m.channel.id not in ALLOW_CHANNELS:
         return
     logger.debug("Check passed, getting into main loop")
-    # we are matching whole substrings now, not exact matches, only one case will be executed, if none match, default case will be executed
-
-    # analysing dad jokes and mom jokes
-    jsi_is_ref = jsem_is_ref = False
-    jsi_who = jsem_who = ""
-    help_needed = False
-    if "jsi" in mess:
-        jsi_is_ref, jsi_who, _ = await find_self_reference_a(mess, "jsi", False)
-    if "jsem" in mess:
-        jsem_is_ref, jsem_who, _ = await find_self_reference_a(mess, "jsem", True)
-
-    matched = True
-    oogway_help = f"""„{random.choice(šimekdict.MOT_HLASKY)}“
-                                                                                - Mistr Oogway, {random.randint(461, 490)} př. n. l."""
-    if "pomo" in mess:
-        help_needed = await needs_help_a(mess)
-
-    match Substring(mess):
-        case "hodný bot":
-            await do_response("🙂", m, chance=1, reaction=True)
-        case _ if has_all(mess, ["problém", "windows"]):
-            await do_response(
-                f"Radikální řešení :point_right: https://fedoraproject.org/workstation/download {KEKWR}",
-                m,
-                chance=1,
-            )
-        case _ if has_all(mess, ["nvidia", "driver", "linux"]):
-            await do_response("Nemůžu za to, že si neumíš vybrat distro, smh", m, chance=2)
-        case "windows":
-            await do_response("😔", m, chance=4, reaction=True)
-        case "debian":
-            await do_response("💜", m, chance=4, reaction=True)
-        case "všechno nejlepší":
-            await do_response("🥳", m, chance=1, reaction=True)
-        case "linux" | "gnu/linux":
-            await do_response("🐧", m, chance=10, reaction=True)
-            await do_response(random.choice([šimekdict.LINUX_COPYPASTA, šimekdict.CESKA_LINUX_COPYPASTA]), m, chance=20)
-        case "hilfe" | "help":
-            await do_response(oogway_help, m, chance=3)
-        case "pomo" if help_needed:  # better analysis of czech help, there is no nicer way to do it, pomoz etc.
-            await do_response(oogway_help, m, chance=3)
-        case "novinky":
-            await do_response("😖", m, chance=3, reaction=True)
-            await do_response("Přestaň postovat cringe, bro.", m, chance=10)
-        case "jsem" if jsem_is_ref:
-            await do_response(f"Ahoj, {jsem_who}. Já jsem táta.", m, chance=5)
-        case "schizo":
-            await do_response("never forgeti", m, chance=4)
-        case "anureysm" | "aneuerysm" | "brain damage" | "brian damage":
-            await do_response("https://www.youtube.com/watch?v=kyg1uxOsAUY", m, chance=2)
-        case "groku je to pravda" | "groku je toto pravda" | "groku, je to pravda" | "groku, je toto pravda":
-            await do_response(random.choice(REPLIES), m, chance=1)
-        case "?" if m.content[-1] == "?":  # to not trigger on Youtube links and similar
-            await do_response(f"{random.choice(REPLIES)}", m, chance=12)
-        case "proč" | "proc":
-            await do_response("skill issue", m, chance=8)
-        case "jsi" if jsi_is_ref:
-            await do_response(f"Tvoje máma je {jsi_who}.", m, chance=8)
-        case "negr":
-            await do_response(":pensive:", m, chance=10)
-            await do_response("👍", m, chance=30)
-        case "israel" | "izrael":
-            await do_response(":pensive:", m, chance=5)
-        case "mama" | "mamá" | "mami" | "mommy" | "mamka" | "mamko":
-            match await prepare_http_response(
-                url=f"https://api.humorapi.com/jokes/random?api-key={JOKES_TOKEN}&include-tags=yo_mama", resp_key="joke"
-            ):
-                case TextResponse(_, content):
-                    await do_response(content, m, chance=4)
-        case "lagtrain":
-            await do_response("https://www.youtube.com/watch?v=UnIhRpIT7nc", m, chance=1)
-        case "cum zone":
-            await do_response("https://www.youtube.com/watch?v=j0lN0w5HVT8", m, chance=1)
-        case "crab rave":
-            await do_response("https://youtu.be/LDU_Txk06tM?t=75", m, chance=1)
-        case "já jo":
-            await do_response("já ne", m, chance=4)
-        case "já ne":
-            await do_response("já jo", m, chance=4)
-        case "chci se zabít" | "suicidal":
-            await do_response("omg don't kill yourself, ur too sexy, haha", m, chance=1)
-        case "v píči" | "v pici":
-            await do_response("stejně tak moc v píči jako já včera večer v tvojí mámě loool", m, chance=10)
-        case "buisness" | "buisnes" | "buissnes" | "bussiness" | "bussines":
-            await do_response(
-                "KÁMO lmao ukažte si na toho blbečka, co neumí napsat 'business' XDDDD :index_pointing_at_the_viewer: příště raději napiš 'byznys' dík :)",
-                m,
-                chance=1,
-            )
-        case "business" | "byznys":
-            await do_response("👍", m, chance=1, reaction=True)
-        case "reminder":
-            await do_response("kind reminder: ur a bitch :)", m, chance=4)
-        case "youtu.be" | "youtube.com" if not re.search(
-            r"(?:youtube\.com|youtu\.be)/(?:channel/|c/|user/|@)[^\s/?#]+(?:[/?#][^\s]*)", mess
-        ):
-            await do_response(random.choice(šimekdict.RECENZE), m, chance=5)
-        case "špatný bot" | "spatny bot":
-            await do_response("i'm trying my best :pensive:", m, chance=1)
-        case "podle mě" | "myslím si" | "myslim si":
-            await do_response(f"{random.choice(['souhlasím', 'nesouhlasím', ''])}", m, chance=10)
-        case "roll joint":
-            await do_response("https://youtu.be/LF6ok8IelJo?t=56", m, chance=1)
-        case _:
-            matched = False
-    if matched:
+    # triggers found in the message are tried in priority order, only the first one whose guard passes is executed,
+    # if none match, the default below is executed
+
+    # dad jokes, mom jokes and help requests need morphodita, it's asked only after their dice roll passed,
+    # if the roll fails, the message falls through to the next trigger
+    for trigger in triggers.RESPONSES.matches(mess):
+        match trigger.name:
+            case "hodný bot":
+                await do_response("🙂", m, chance=1, reaction=True)
+            case "windows problém":
+                await do_response(
+                    f"Radikální řešení :point_right: https://fedoraproject.org/workstation/download {KEKWR}",
+                    m,
+                    chance=1,
+                )
+            case "nvidia driver":
+                await do_response("Nemůžu za to, že si neumíš vybrat distro, smh", m, chance=2)
+            case "windows":
+                await do_response("😔", m, chance=4, reaction=True)
+            case "debian":
+                await do_response("💜", m, chance=4, reaction=True)
+            case "všechno nejlepší":
+                await do_response("🥳", m, chance=1, reaction=True)
+            case "linux":
+                await do_response("🐧", m, chance=10, reaction=True)
+                await do_response(
+                    random.choice([šimekdict.LINUX_COPYPASTA, šimekdict.CESKA_LINUX_COPYPASTA]), m, chance=20
+                )
+            case "help":
+                await do_response(oogway_help(), m, chance=3)
+            # better analysis of czech help, there is no nicer way to do it, pomoz etc.
+            case "pomo" if rolled(3) and await needs_help_a(m.content):
+                await do_response(oogway_help(), m, chance=1)
+            case "novinky":
+                await do_response("😖", m, chance=3, reaction=True)
+                await do_response("Přestaň postovat cringe, bro.", m, chance=10)
+            case "jsem" if rolled(5) and (jsem := await find_self_reference_a(m.content, "jsem", True))[0]:
+                await do_response(f"Ahoj, {jsem[1]}. Já jsem táta.", m, chance=1)
+            case "schizo":
+                await do_response("never forgeti", m, chance=4)
+            case "aneurysm":
+                await do_response("https://www.youtube.com/watch?v=kyg1uxOsAUY", m, chance=2)
+            case "grok":
+                await do_response(random.choice(REPLIES), m, chance=1)
+            case "?" if m.content[-1] == "?":  # to not trigger on Youtube links and similar
+                await do_response(f"{random.choice(REPLIES)}", m, chance=12)
+            case "proč":
+                await do_response("skill issue", m, chance=8)
+            case "jsi" if rolled(8) and (jsi := await find_self_reference_a(m.content, "jsi", False))[0]:
+                await do_response(f"Tvoje máma je {jsi[1]}.", m, chance=1)
+            case "negr":
+                await do_response(":pensive:", m, chance=10)
+                await do_response("👍", m, chance=30)
+            case "izrael":
+                await do_response(":pensive:", m, chance=5)
+            case "mama":
+                # fetch the joke only if it's going to be posted
+                if rolled(4):
+                    match await prepare_http_response(
+                        url=f"https://api.humorapi.com/jokes/random?api-key={JOKES_TOKEN}&include-tags=yo_mama",
+                        resp_key="joke",
+                    ):
+                        case TextResponse(_, content):
+                            await do_response(content, m, chance=1)
+            case "lagtrain":
+                await do_response("https://www.youtube.com/watch?v=UnIhRpIT7nc", m, chance=1)
+            case "cum zone":
+                await do_response("https://www.youtube.com/watch?v=j0lN0w5HVT8", m, chance=1)
+            case "crab rave":
+                await do_response("https://youtu.be/LDU_Txk06tM?t=75", m, chance=1)
+            case "já jo":
+                await do_response("já ne", m, chance=4)
+            case "já ne":
+                await do_response("já jo", m, chance=4)
+            case "suicidal":
+                await do_response("omg don't kill yourself, ur too sexy, haha", m, chance=1)
+            case "v píči":
+                await do_response("stejně tak moc v píči jako já včera večer v tvojí mámě loool", m, chance=10)
+            case "buisness":
+                await do_response(
+                    "KÁMO lmao ukažte si na toho blbečka, co neumí napsat 'business' XDDDD :index_pointing_at_the_viewer: příště raději napiš 'byznys' dík :)",
+                    m,
+                    chance=1,
+                )
+            case "business":
+                await do_response("👍", m, chance=1, reaction=True)
+            case "reminder":
+                await do_response("kind reminder: ur a bitch :)", m, chance=4)
+            case "youtube" if not YOUTUBE_CHANNEL_PATTERN.search(mess):
+                await do_response(random.choice(šimekdict.RECENZE), m, chance=5)
+            case "špatný bot":
+                await do_response("i'm trying my best :pensive:", m, chance=1)
+            case "názor":
+                await do_response(f"{random.choice(['souhlasím', 'nesouhlasím', ''])}", m, chance=10)
+            case "roll joint":
+                await do_response("https://youtu.be/LF6ok8IelJo?t=56", m, chance=1)
+            case _:  # guard didn't pass, try the next trigger
+                continue
         return
 
-    without_links = re.sub(r"https?://\S+", "", mess)
-    match Substring(without_links):
-        case "twitter" | "twiter" if not has_any(mess, ["per", "pér"]):
+    match [trigger.name for trigger in triggers.WITHOUT_LINKS.matches(views.without_links)]:
+        case ["twitter"] if not has_any(mess, ["per", "pér"]):
             await do_response("preferuji #twitter-péro", m, chance=2)  # it was too often
         case _:
             if random.randint(1, 500) == 1:
-                messages = []
-                async for msg in m.channel.history(limit=50, before=m):
-                    if msg.content:
-                        messages.append(msg.content)
-                response += markov_chain(messages)
+                response += generate_markov(channel_id=m.channel.id)
                 await m.reply(response)
 
             await do_response(
@@ -385,11 +389,17 @@ async def on_message(m: Message):
         return
     if str(m.author) == ŠIMEK_NAME:
         return
+    if m.channel.id in ALLOW_CHANNELS:
+        # remove bot mentions and cleanup
+        markov_ingest.add(m.id, m.channel.id, views_of(m.content).mention_safe.replace(",", ""))
     await manage_response(m)
 
 
 async def cleanup():
     """Clean up resources when bot shuts down"""
+    markov_ingest.flush()
+    # waits for the pending writes, every reconnect fires on_disconnect too
+    await asyncio.to_thread(persistence.flush)
     await close_http_session()
 
 
@@ -399,11 +409,24 @@ async def on_disconnect():
     await cleanup()
 
 
-if __name__ == "__main__":
+def main() -> None:
+    """Run the bot, started by ``python -m šimek``.
+
+    Everything with side effects is here and not at import, tagger worker processes import the main
+    module of the bot's process again, unless it's a package's ``__main__``.
+    """
+    global cooldowns
+    discord_logging.configure_logging(client)
+    cooldowns = CooldownManager(cooldown, file_path=get_cooldown_file_path())
+    load_trigram_counts()
+    start_tagger_processes()
     try:
         client.run(TOKEN)
     finally:
         # Ensure cleanup runs even if there's an exception
-        import asyncio
-
         asyncio.run(cleanup())
+        stop_process_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,529 @@
+"""Compact trigram store for šimek's Markov chain.
+
+Words are interned to integer IDs and transitions are kept in flat arrays (CSR layout):
+sorted packed bigram keys, per-key offsets into the next-word IDs and their cumulative counts.
+Cumulative counts double as sampling tables, picking the next word is a bisect within the key's slice.
+Fresh counts are merged into a small dict overlay, which is folded into the arrays once it grows.
+The arrays are never mutated in place, so snapshots can share them safely with a background thread.
+
+The arrays and the word table can be saved to a binary file which is memory-mapped read-only on load,
+so startup doesn't deserialize anything and the pages are shared by the OS page cache.
+
+Counts only ever grow, ``pruned`` builds a smaller store by decaying the counts, dropping rare transitions
+and keeping only the most frequent bigrams, see ``PrunePolicy``.
+"""
+
+import heapq
+import mmap
+import pickle
+import random
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from collections.abc import Iterable, Iterator, Mapping
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Literal
+
+Bigram = tuple[str, str]
+TrigramCounts = Mapping[Bigram, Mapping[str, int]]
+IntArray = array | memoryview
+
+# number of overlay transitions that triggers folding the overlay into the arrays
+COMPACT_THRESHOLD = 50_000
+
+_WORD_BITS = 32
+_WORD_MASK = (1 << _WORD_BITS) - 1
+
+# Binary model file: header followed by 8-byte aligned sections, all little-endian:
+# word offsets (Q), word IDs sorted by their UTF-8 bytes (I), UTF-8 word bytes,
+# bigram keys (Q), key offsets (Q), next word IDs (I), cumulative counts (I)
+MODEL_MAGIC = b"SMKV"
+MODEL_VERSION = 2
+# magic, version, word count, key count, transition count, word bytes length, log generation
+_HEADER = struct.Struct("<4sIQQQQQ")
+# version 1 had no log generation
+_HEADER_V1 = struct.Struct("<4sIQQQQ")
+
+
+@dataclass(frozen=True)
+class PrunePolicy:
+    decay: float = 1.0  # counts are multiplied by it on each pass, 1 keeps them
+    min_count: int = 1  # transitions with a smaller decayed count are dropped
+    max_keys: int | None = None  # bigrams kept, the ones with the highest total counts
+
+    def __post_init__(self) -> None:
+        if not 0 < self.decay <= 1:
+            raise ValueError(f"Decay must be in (0, 1], got {self.decay}")
+        if self.min_count < 1:
+            raise ValueError(f"Minimum count must be at least 1, got {self.min_count}")
+        if self.max_keys is not None and self.max_keys < 0:
+            raise ValueError(f"Maximum number of keys must not be negative, got {self.max_keys}")
+
+
+def build_trigram_counts(messages) -> dict[tuple[str, str], Counter[str]]:
+    """Count next words of each bigram, keys and next words in order of their first occurrence."""
+    words = " ".join(messages).lower().split()
+    markov_counts: dict[tuple[str, str], Counter[str]] = {}
+    # one pass counting whole trigrams, then grouped by bigram, without a list of every next word
+    for (first, second, third), count in Counter(zip(words, words[1:], words[2:])).items():
+        next_words = markov_counts.get((first, second))
+        if next_words is None:
+            next_words = markov_counts[first, second] = Counter()
+        next_words[third] = count
+    return markov_counts
+
+
+def logged_increments(records: Iterable, generation: int) -> list[dict]:
+    """Counts of the increment log records that a snapshot of the given generation doesn't contain.
+
+    Records are (generation, counts) pairs, bare counts were logged before generations and count as 0.
+    """
+    increments = []
+    for record in records:
+        record_generation, counts = record if isinstance(record, tuple) else (0, record)
+        if record_generation >= generation:
+            increments.append(counts)
+    return increments
+
+
+def _pack(first: int, second: int) -> int:
+    return (first << _WORD_BITS) | second
+
+
+def _extend(target: array, source: IntArray, start: int, end: int) -> None:
+    """Append ``source[start:end]`` to ``target`` as a raw memory copy."""
+    target.frombytes(memoryview(source)[start:end].cast("B"))
+
+
+class _Vocabulary:
+    """Word <-> ID interning table, optionally on top of a memory-mapped word table."""
+
+    def __init__(
+        self,
+        base_offsets: IntArray | None = None,
+        base_order: IntArray | None = None,
+        base_bytes: bytes | memoryview = b"",
+    ) -> None:
+        self._base_offsets = base_offsets
+        self._base_order = base_order
+        self._base_bytes = base_bytes
+        self._base_size = len(base_order) if base_order is not None else 0
+        self._words: list[str] = []  # words interned after the mapped table
+        self._ids: dict[str, int] = {}  # IDs of words in _words and of mapped words looked up so far
+
+    def __len__(self) -> int:
+        return self._base_size + len(self._words)
+
+    def _base_word(self, word_id: int) -> bytes:
+        assert self._base_offsets is not None
+        return bytes(self._base_bytes[self._base_offsets[word_id] : self._base_offsets[word_id + 1]])
+
+    def word(self, word_id: int) -> str:
+        if word_id < self._base_size:
+            return self._base_word(word_id).decode()
+        return self._words[word_id - self._base_size]
+
+    def get(self, word: str) -> int | None:
+        word_id = self._ids.get(word)
+        if word_id is None and self._base_order is not None:
+            encoded = word.encode()
+            i = bisect_left(self._base_order, encoded, key=self._base_word)
+            if i < self._base_size and self._base_word(self._base_order[i]) == encoded:
+                word_id = self._ids[word] = self._base_order[i]
+        return word_id
+
+    def intern(self, word: str) -> int:
+        word_id = self.get(word)
+        if word_id is None:
+            word_id = self._ids[word] = len(self)
+            self._words.append(word)
+        return word_id
+
+    def copy(self) -> "_Vocabulary":
+        copy = _Vocabulary(self._base_offsets, self._base_order, self._base_bytes)
+        copy._words = list(self._words)
+        copy._ids = dict(self._ids)
+        return copy
+
+    def nbytes(self) -> int:
+        """Approximate size of the in-memory part."""
+        return sys.getsizeof(self._words) + sys.getsizeof(self._ids) + sum(sys.getsizeof(word) for word in self._ids)
+
+
+class _CsrBuilder:
+    """Appends keys with their transitions in ascending key order."""
+
+    def __init__(self) -> None:
+        self.keys = array("Q")
+        self.offsets = array("Q", [0])
+        self.next_ids = array("I")
+        self.cumulative = array("I")
+
+    def add(self, key: int, transitions: Mapping[int, int]) -> None:
+        self.keys.append(key)
+        total = 0
+        for word_id, count in sorted(transitions.items()):
+            total += count
+            self.next_ids.append(word_id)
+            self.cumulative.append(total)
+        self.offsets.append(len(self.next_ids))
+
+    def copy_from(self, store: "TrigramStore", start: int, end: int) -> None:
+        """Copy keys ``start:end`` of the store's arrays unchanged."""
+        if start >= end:
+            return
+        lo, hi = store._offsets[start], store._offsets[end]
+        delta = len(self.next_ids) - lo
+        _extend(self.keys, store._keys, start, end)
+        _extend(self.next_ids, store._next_ids, lo, hi)
+        _extend(self.cumulative, store._cumulative, lo, hi)
+        self.offsets.extend(offset + delta for offset in store._offsets[start + 1 : end + 1])
+
+
+class TrigramStore:
+    """Trigram counts ``(w1, w2) -> {w3: count}`` with interned words and array-backed transitions."""
+
+    def __init__(self) -> None:
+        self._vocabulary = _Vocabulary()
+        # CSR arrays, replaced (never mutated) by compact(), memoryviews of _mapped when loaded from a file
+        self._keys: IntArray = array("Q")
+        self._offsets: IntArray = array("Q", [0])
+        self._next_ids: IntArray = array("I")
+        self._cumulative: IntArray = array("I")  # running count within each key's slice
+        self._mapped: mmap.mmap | None = None
+        # generation of the increment log the store was saved with, its records are already counted
+        self.generation = 0
+        # overlay of counts merged since the last compaction
+        self._pending: dict[int, Counter[int]] = {}
+        self._pending_only: list[int] = []  # overlay keys missing from the arrays, for uniform key selection
+        self._pending_transitions = 0
+        self._new_transitions = 0  # overlay transitions missing from the arrays
+        # sampling tables (next word IDs, cumulative counts) of overlay keys, dropped when the key is merged
+        self._pending_tables: dict[int, tuple[list[int], list[int]]] = {}
+
+    @classmethod
+    def from_counts(cls, counts: TrigramCounts) -> "TrigramStore":
+        """Build a store from the legacy ``{(w1, w2): Counter({w3: count})}`` dict."""
+        store = cls()
+        store.merge(counts)
+        store.compact()
+        return store
+
+    @classmethod
+    def load(cls, path: Path) -> "TrigramStore":
+        """Memory-map a model written by ``save``, nothing is read until it's queried."""
+        if sys.byteorder != "little":
+            raise ValueError("Mapped Markov models are supported only on little-endian machines")
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        magic, version = struct.unpack_from("<4sI", view)
+        if magic != MODEL_MAGIC or version not in (1, MODEL_VERSION):
+            raise ValueError(f"{path} is not a Markov model of version {MODEL_VERSION}")
+        if version == 1:
+            _, _, n_words, n_keys, n_transitions, n_word_bytes = _HEADER_V1.unpack_from(view)
+            generation, position = 0, _HEADER_V1.size
+        else:
+            _, _, n_words, n_keys, n_transitions, n_word_bytes, generation = _HEADER.unpack_from(view)
+            position = _HEADER.size
+
+        def section(length: int, fmt: Literal["B", "I", "Q"] = "B") -> memoryview:
+            nonlocal position
+            start = (position + 7) & ~7
+            position = start + length * struct.calcsize(fmt)
+            return view[start:position].cast(fmt)
+
+        word_offsets = section(n_words + 1, "Q")
+        word_order = section(n_words, "I")
+        word_bytes = section(n_word_bytes)
+        store = cls()
+        store._vocabulary = _Vocabulary(word_offsets, word_order, word_bytes)
+        store._keys = section(n_keys, "Q")
+        store._offsets = section(n_keys + 1, "Q")
+        store._next_ids = section(n_transitions, "I")
+        store._cumulative = section(n_transitions, "I")
+        store._mapped = mapped
+        store.generation = generation
+        return store
+
+    def save(self, path: Path) -> None:
+        """Write the store in the binary format read by ``load``.
+
+        Compacts the store first, so call it on a snapshot when running in a background thread.
+        """
+        self.compact()
+        vocabulary = self._vocabulary
+        words = [vocabulary.word(word_id).encode() for word_id in range(len(vocabulary))]
+        word_offsets = array("Q", [0])
+        for word in words:
+            word_offsets.append(word_offsets[-1] + len(word))
+        word_order = array("I", sorted(range(len(words)), key=words.__getitem__))
+        word_bytes = b"".join(words)
+        with open(path, "wb") as f:
+            f.write(
+                _HEADER.pack(
+                    MODEL_MAGIC,
+                    MODEL_VERSION,
+                    len(words),
+                    len(self._keys),
+                    len(self._next_ids),
+                    len(word_bytes),
+                    self.generation,
+                )
+            )
+            for data in (word_offsets, word_order, word_bytes, self._keys, self._offsets, self._next_ids):
+                f.write(b"\0" * (-f.tell() % 8))
+                f.write(data)
+            f.write(b"\0" * (-f.tell() % 8))
+            f.write(self._cumulative)
+
+    def __len__(self) -> int:
+        return len(self._keys) + len(self._pending_only)
+
+    @property
+    def transitions(self) -> int:
+        """Number of distinct trigrams."""
+        return len(self._next_ids) + self._new_transitions
+
+    def __contains__(self, key: Bigram) -> bool:
+        packed = self._lookup_key(key)
+        return packed is not None and (packed in self._pending or self._base_index(packed) is not None)
+
+    def _lookup_key(self, key: Bigram) -> int | None:
+        first, second = self._vocabulary.get(key[0]), self._vocabulary.get(key[1])
+        if first is None or second is None:
+            return None
+        return _pack(first, second)
+
+    def _unpack(self, packed: int) -> Bigram:
+        return self._vocabulary.word(packed >> _WORD_BITS), self._vocabulary.word(packed & _WORD_MASK)
+
+    def _base_index(self, packed: int) -> int | None:
+        i = bisect_left(self._keys, packed)
+        if i < len(self._keys) and self._keys[i] == packed:
+            return i
+        return None
+
+    def _base_transitions(self, i: int) -> dict[int, int]:
+        lo, hi = self._offsets[i], self._offsets[i + 1]
+        transitions = {}
+        previous = 0
+        for word_id, total in zip(self._next_ids[lo:hi], self._cumulative[lo:hi]):
+            transitions[word_id] = total - previous
+            previous = total
+        return transitions
+
+    def _transitions(self, packed: int) -> dict[int, int]:
+        transitions: dict[int, int] = {}
+        if (i := self._base_index(packed)) is not None:
+            transitions = self._base_transitions(i)
+        for word_id, count in self._pending.get(packed, {}).items():
+            transitions[word_id] = transitions.get(word_id, 0) + count
+        return transitions
+
+    @property
+    def pending_transitions(self) -> int:
+        """Number of transitions in the overlay."""
+        return self._pending_transitions
+
+    def merge(self, counts: TrigramCounts, compact_threshold: int | None = None, *, compact: bool = True) -> None:
+        """Add trigram counts, e.g. the output of ``build_trigram_counts``.
+
+        The overlay is compacted once it holds ``compact_threshold`` transitions, ``COMPACT_THRESHOLD`` by default.
+        With ``compact=False`` it's left to the caller, e.g. to compact a snapshot in a background thread.
+        """
+        intern = self._vocabulary.intern
+        for (first, second), next_words in counts.items():
+            packed = _pack(intern(first), intern(second))
+            i = self._base_index(packed)
+            pending = self._pending.get(packed)
+            if pending is None:
+                pending = self._pending[packed] = Counter()
+                if i is None:
+                    self._pending_only.append(packed)
+            else:
+                self._pending_tables.pop(packed, None)
+            for word, count in next_words.items():
+                word_id = intern(word)
+                if word_id not in pending:
+                    self._pending_transitions += 1
+                    if i is None or word_id not in self._next_ids[self._offsets[i] : self._offsets[i + 1]]:
+                        self._new_transitions += 1
+                pending[word_id] += count
+        if compact and self._pending_transitions >= (
+            COMPACT_THRESHOLD if compact_threshold is None else compact_threshold
+        ):
+            self.compact()
+
+    def compact(self) -> "TrigramStore":
+        """Fold the overlay into freshly built arrays, returns the store."""
+        if not self._pending:
+            return self
+        builder = _CsrBuilder()
+        pos = 0
+        for packed in sorted(self._pending):
+            i = bisect_left(self._keys, packed, pos)
+            builder.copy_from(self, pos, i)
+            transitions = self._pending[packed]
+            if i < len(self._keys) and self._keys[i] == packed:
+                transitions = transitions + Counter(self._base_transitions(i))
+                i += 1
+            builder.add(packed, transitions)
+            pos = i
+        builder.copy_from(self, pos, len(self._keys))
+        self._keys, self._offsets = builder.keys, builder.offsets
+        self._next_ids, self._cumulative = builder.next_ids, builder.cumulative
+        self._pending = {}
+        self._pending_only = []
+        self._pending_transitions = 0
+        self._new_transitions = 0
+        self._pending_tables = {}
+        return self
+
+    def _decayed_transitions(self, i: int, policy: PrunePolicy) -> dict[int, int]:
+        transitions = {}
+        for word_id, count in self._base_transitions(i).items():
+            decayed = count * policy.decay
+            if decayed >= policy.min_count:
+                transitions[word_id] = int(decayed + 0.5)
+        return transitions
+
+    def pruned(self, policy: PrunePolicy) -> "TrigramStore":
+        """Return a new store with decayed counts, rare transitions dropped and at most ``policy.max_keys`` bigrams.
+
+        Compacts the store first, so call it on a snapshot when running in a background thread.
+        Words are kept even if no transition uses them anymore, they are only interned IDs.
+        """
+        self.compact()
+        builder = _CsrBuilder()
+        if policy.max_keys is not None and policy.max_keys < len(self._keys):
+            # the most frequent keys with their decayed transitions, the least frequent one on top of the heap,
+            # ties are broken by key order, so the result doesn't depend on anything but the counts
+            kept: list[tuple[int, int, dict[int, int]]] = []
+            for i in range(len(self._keys)):
+                transitions = self._decayed_transitions(i, policy)
+                entry = (sum(transitions.values()), -i, transitions)
+                if len(kept) < policy.max_keys:
+                    heapq.heappush(kept, entry)
+                elif entry[:2] > kept[0][:2]:
+                    heapq.heapreplace(kept, entry)
+            for _, i, transitions in sorted(kept, key=lambda entry: -entry[1]):
+                if transitions:
+                    builder.add(self._keys[-i], transitions)
+        elif policy.decay == 1 and policy.min_count == 1:
+            builder.copy_from(self, 0, len(self._keys))
+        else:
+            for i in range(len(self._keys)):
+                if transitions := self._decayed_transitions(i, policy):
+                    builder.add(self._keys[i], transitions)
+
+        store = TrigramStore()
+        store._vocabulary = self._vocabulary.copy()
+        store._mapped = self._mapped  # the word table may still be mapped
+        store._keys, store._offsets = builder.keys, builder.offsets
+        store._next_ids, store._cumulative = builder.next_ids, builder.cumulative
+        return store
+
+    def snapshot(self) -> "TrigramStore":
+        """Return a copy that is safe to hand over to another thread, e.g. for saving."""
+        copy = TrigramStore()
+        copy._vocabulary = self._vocabulary.copy()
+        copy._keys, copy._offsets = self._keys, self._offsets
+        copy._next_ids, copy._cumulative = self._next_ids, self._cumulative
+        copy._mapped = self._mapped
+        copy.generation = self.generation
+        copy._pending = {packed: Counter(pending) for packed, pending in self._pending.items()}
+        copy._pending_only = list(self._pending_only)
+        copy._pending_transitions = self._pending_transitions
+        copy._new_transitions = self._new_transitions
+        return copy
+
+    def random_key(self) -> Bigram | None:
+        """Pick a bigram uniformly at random, None if the store is empty."""
+        if not len(self):
+            return None
+        i = random.randrange(len(self))
+        packed = self._keys[i] if i < len(self._keys) else self._pending_only[i - len(self._keys)]
+        return self._unpack(packed)
+
+    def _pending_table(self, packed: int) -> tuple[list[int], list[int]]:
+        table = self._pending_tables.get(packed)
+        if table is None:
+            next_ids: list[int] = []
+            cumulative: list[int] = []
+            total = 0
+            for word_id, count in self._transitions(packed).items():
+                total += count
+                next_ids.append(word_id)
+                cumulative.append(total)
+            table = self._pending_tables[packed] = next_ids, cumulative
+        return table
+
+    def sample(self, key: Bigram) -> str | None:
+        """Pick the next word after ``key`` weighted by counts, None if the bigram is unknown."""
+        packed = self._lookup_key(key)
+        if packed is None:
+            return None
+        next_ids: list[int] | IntArray
+        cumulative: list[int] | IntArray
+        if packed in self._pending:
+            next_ids, cumulative = self._pending_table(packed)
+            lo, hi = 0, len(next_ids)
+        elif (i := self._base_index(packed)) is not None:
+            next_ids, cumulative = self._next_ids, self._cumulative
+            lo, hi = self._offsets[i], self._offsets[i + 1]
+        else:
+            return None
+        j = bisect_right(cumulative, random.randrange(cumulative[hi - 1]), lo, hi)
+        return self._vocabulary.word(next_ids[j])
+
+    def items(self) -> Iterator[tuple[Bigram, dict[str, int]]]:
+        """Iterate over bigrams and their next-word counts in the legacy dict shape."""
+        keys = set(self._keys)
+        keys.update(self._pending)
+        word = self._vocabulary.word
+        for packed in sorted(keys):
+            yield self._unpack(packed), {word(word_id): count for word_id, count in self._transitions(packed).items()}
+
+    def memory_usage(self) -> dict[str, int]:
+        """Report sizes of the store, byte counts are approximate.
+
+        Mapped bytes live in the page cache and are shared, they are not part of the other counts.
+        """
+        arrays = (self._keys, self._offsets, self._next_ids, self._cumulative)
+        array_bytes = sum(memoryview(arr).nbytes for arr in arrays if isinstance(arr, array))
+        vocabulary_bytes = self._vocabulary.nbytes()
+        pending_bytes = (
+            sys.getsizeof(self._pending)
+            + sys.getsizeof(self._pending_only)
+            + sum(sys.getsizeof(pending) for pending in self._pending.values())
+            + sys.getsizeof(self._pending_tables)
+        )
+        return {
+            "words": len(self._vocabulary),
+            "keys": len(self),
+            "transitions": self.transitions,
+            "pending_keys": len(self._pending),
+            "array_bytes": array_bytes,
+            "vocabulary_bytes": vocabulary_bytes,
+            "pending_bytes": pending_bytes,
+            "mapped_bytes": len(self._mapped) if self._mapped is not None else 0,
+            # size of the arrays whether they are mapped or not, as saved to the model file
+            "model_bytes": sum(memoryview(arr).nbytes for arr in arrays),
+            "total_bytes": array_bytes + vocabulary_bytes + pending_bytes,
+        }
+
+
+def convert_pickle(pickle_path: Path, model_path: Path) -> TrigramStore:
+    """Convert a pickled model (legacy dict or ``TrigramStore``) to the mapped format and load it."""
+    with open(pickle_path, "rb") as f:
+        counts = pickle.load(f)
+    store = counts if isinstance(counts, TrigramStore) else TrigramStore.from_counts(counts)
+    model_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = model_path.with_name(model_path.name + ".tmp")
+    store.save(tmp_path)
+    tmp_path.replace(model_path)
+    return TrigramStore.load(model_path)
@@ -1,25 +1,107 @@
+import asyncio
 import logging
+import os
 import os.path as osp
-from dataclasses import dataclass
+import threading
+from dataclasses import dataclass, replace
+from typing import Any
 
 from ufal.morphodita import Tagger, Forms, TaggedLemmas, TokenRanges, Morpho, TaggedLemmasForms
-from šimek.utils import run_async, truncate_emojis
+from šimek.text import views_of
+from šimek.utils import LruCache, run_async, start_process_pool, uses_process_pool, worker_count
 
 logger = logging.getLogger(__name__)
 
-logger.info("Preparing to load tagger.")
-# we can not optimize the loading time, because the C code blocks GIL, so we can not postpone it.
 cur_dir = osp.dirname(__file__)
 tagger_path = "czech-morfflex2.0-pdtc1.0-220710/czech-morfflex2.0-pdtc1.0-220710.tagger"
-tagger = Tagger.load(osp.join(cur_dir, tagger_path))
 dict_path = "./czech-morfflex2.0-pdtc1.0-220710/czech-morfflex2.0-220710.dict"
-morpho = Morpho.load(osp.join(cur_dir, dict_path))
-if not tagger:
-    raise Exception(f"Cannot load tagger from file {tagger_path}")
-tokenizer = tagger.newTokenizer()
-if tokenizer is None:
-    raise Exception("No tokenizer is defined for the supplied model!")
-logger.info("Tagger loaded.")
+
+
+@dataclass(frozen=True)
+class _Models:
+    tagger: Tagger
+    tokenizer: Any
+    morpho: Morpho
+
+
+_models: _Models | None = None
+_load_lock = threading.Lock()
+_ready = threading.Event()
+_workers_starting: asyncio.Task | None = None
+
+
+def load_models() -> _Models:
+    """Load the tagger and dictionary, blocks until they are loaded, loads only once."""
+    global _models
+    with _load_lock:
+        if _models is None:
+            logger.info("Preparing to load tagger.")
+            tagger = Tagger.load(osp.join(cur_dir, tagger_path))
+            if not tagger:
+                raise Exception(f"Cannot load tagger from file {tagger_path}")
+            tokenizer = tagger.newTokenizer()
+            if tokenizer is None:
+                raise Exception("No tokenizer is defined for the supplied model!")
+            _models = _Models(tagger, tokenizer, Morpho.load(osp.join(cur_dir, dict_path)))
+            _ready.set()
+            logger.info("Tagger loaded.")
+    return _models
+
+
+def _load_in_background() -> None:
+    try:
+        load_models()
+    except Exception as e:
+        logger.error("Failed to load tagger", exc_info=e)
+
+
+def start_loading() -> None:
+    """Load the models in a background thread, does nothing if they are loaded or being loaded.
+
+    The C code holds the GIL while loading, so the bot stalls for a few seconds either way. Called
+    once šimek is connected, so at least it doesn't delay getting online after a deploy.
+    With worker processes only they load the models, it waits for them instead.
+    """
+    global _workers_starting
+    if _ready.is_set() or _load_lock.locked():
+        return
+    if uses_process_pool():
+        if _workers_starting is None or _workers_starting.done():
+            _workers_starting = asyncio.get_running_loop().create_task(_wait_for_workers())
+        return
+    threading.Thread(target=_load_in_background, name="tagger-loader", daemon=True).start()
+
+
+def _warm_up() -> None:
+    load_models()
+
+
+async def _wait_for_workers() -> None:
+    try:
+        # returns once a worker loaded the models, in šimek's process if the pool broke meanwhile
+        await run_async(_warm_up)
+    except Exception as e:
+        logger.error("Failed to load tagger in worker processes", exc_info=e)
+        return
+    _ready.set()
+
+
+def tagger_ready() -> bool:
+    """Whether the models are loaded, the async functions return a "not found" result until then."""
+    return _ready.is_set()
+
+
+# 0 tags in šimek's process, more starts worker processes, each loading its own copy of the models
+TAGGER_PROCESSES = int(os.getenv("ŠIMEK_TAGGER_PROCESSES", "0"))
+CACHE_SIZE = 1024
+# normalized text -> analysis
+_analysis_cache: LruCache[str, "Analysis"] = LruCache(CACHE_SIZE)
+# (normalized text, keyword, use vocative) -> find_self_reference result
+_self_reference_cache: LruCache[tuple[str, str, bool], tuple[bool, str, int]] = LruCache(CACHE_SIZE)
+# normalized text -> needs_help result
+_help_cache: LruCache[str, bool] = LruCache(CACHE_SIZE)
+# (lemma, vocative tag) -> generated form, "" if morphodita doesn't know the word
+_vocative_cache: LruCache[tuple[str, str], str] = LruCache(CACHE_SIZE)
 
 
 @dataclass
@@ -37,11 +119,166 @@ class Token:
         return True
 
 
-async def find_self_reference_a(text: str, keyword: str, use_vocative: bool) -> tuple[bool, str, int]:
-    return await run_async(find_self_reference, text, keyword, use_vocative)
+@dataclass(frozen=True)
+class Analysis:
+    """Message tokenized and tagged once, shared by all keyword checks.
+
+    Tokens must not be modified, parse_sentence_with_keyword hands out copies.
+    """
+
+    text: str  # lowercased, without emojis
+    sentences: list[list[Token]]
+
+
+def normalize(text: str) -> str:
+    return views_of(text).emoji_free
+
+
+def analyze(text: str) -> Analysis:
+    text = normalize(text)
+    analysis = _analysis_cache.get(text)
+    if analysis is None:
+        analysis = _tag(text)
+        _analysis_cache.put(text, analysis)
+    return analysis
+
+
+def _tag(text: str) -> Analysis:
+    models = load_models()
+    tokenizer, tagger = models.tokenizer, models.tagger
+    forms = Forms()
+    lemmas = TaggedLemmas()
+    tokens = TokenRanges()
+    tokenizer.setText(text)
+    sentences: list[list[Token]] = []
+    t_iter = 0
+    while tokenizer.nextSentence(forms, tokens):
+        tagger.tag(forms, lemmas)
+        sentence = []
+        for i in range(len(lemmas)):
+            lemma = lemmas[i]
+            token = tokens[i]
+            sentence.append(
+                Token(
+                    text[t_iter : token.start], lemma.lemma, lemma.tag, text[token.start : token.start + token.length]
+                )
+            )
+            t_iter = token.start + token.length
+        sentences.append(sentence)
+    return Analysis(text, sentences)
+
+
+def analyze_batch(texts: list[str]) -> list[Analysis]:
+    return [analyze(text) for text in texts]
 
 
-def find_self_reference(text: str, keyword: str, use_vocative: bool) -> tuple[bool, str, int]:
+def _tag_batch(texts: list[str]) -> list[Analysis]:
+    """Tag normalized texts, runs in a worker process when those are enabled."""
+    return [_tag(text) for text in texts]
+
+
+def _init_worker() -> None:
+    load_models()
+    logger.info(f"Tagger worker {os.getpid()} ready.")
+
+
+def start_tagger_processes(processes: int = TAGGER_PROCESSES) -> None:
+    """Tag in worker processes, so a burst of messages doesn't queue behind a single tagger."""
+    start_process_pool(processes, _init_worker)
+
+
+class _AnalysisBatcher:
+    """Coalesces concurrent analyze requests into batches, tagged back-to-back in one executor job.
+
+    Requests for the same text while it's waiting or being tagged share the result.
+    """
+
+    def __init__(self) -> None:
+        self._pending: dict[str, asyncio.Future[Analysis]] = {}
+        self._task: asyncio.Task | None = None
+
+    async def analyze(self, text: str) -> Analysis:
+        future = self._pending.get(text)
+        if future is None:
+            future = self._pending[text] = asyncio.get_running_loop().create_future()
+            if self._task is None:
+                self._task = asyncio.create_task(self._run())
+        # shield, so one cancelled caller doesn't cancel the result for the others
+        return await asyncio.shield(future)
+
+    async def _run(self) -> None:
+        try:
+            # requests arriving while a batch is tagged form the next batch
+            while self._pending:
+                batch, self._pending = self._pending, {}
+                texts = list(batch)
+                # one chunk per worker, so the batch is tagged in parallel
+                size = -(-len(texts) // worker_count())
+                chunks = [texts[i : i + size] for i in range(0, len(texts), size)]
+                try:
+                    tagged = await asyncio.gather(*(run_async(_tag_batch, chunk) for chunk in chunks))
+                except Exception as e:
+                    logger.error(f"Failed to analyze batch of {len(batch)} messages", exc_info=e)
+                    for future in batch.values():
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                results = [analysis for chunk in tagged for analysis in chunk]
+                for text, future, result in zip(texts, batch.values(), results):
+                    _analysis_cache.put(text, result)
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self._task = None
+
+
+_batcher = _AnalysisBatcher()
+
+
+async def analyze_a(text: str) -> Analysis:
+    """Tokenize and tag text in the background, concurrent calls are batched together."""
+    text = normalize(text)
+    if (analysis := _analysis_cache.get(text)) is not None:
+        return analysis
+    return await _batcher.analyze(text)
+
+
+async def find_self_reference_a(text: str | Analysis, keyword: str, use_vocative: bool) -> tuple[bool, str, int]:
+    if not tagger_ready():
+        return False, "", 0
+    analysis = text if isinstance(text, Analysis) else await analyze_a(text)
+    key = (analysis.text, keyword, use_vocative)
+    result = _self_reference_cache.get(key)
+    if result is None:
+        if use_vocative:
+            # generating the vocative asks morphodita, so it runs in the background like tagging
+            result = await run_async(_find_self_reference, analysis, keyword, use_vocative)
+        else:
+            result = _find_self_reference(analysis, keyword, use_vocative)
+        _self_reference_cache.put(key, result)
+    return result
+
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    return {
+        "analysis": _analysis_cache.stats(),
+        "self_reference": _self_reference_cache.stats(),
+        "help": _help_cache.stats(),
+        "vocative": _vocative_cache.stats(),
+    }
+
+
+def find_self_reference(text: str | Analysis, keyword: str, use_vocative: bool) -> tuple[bool, str, int]:
+    analysis = text if isinstance(text, Analysis) else analyze(text)
+    key = (analysis.text, keyword, use_vocative)
+    result = _self_reference_cache.get(key)
+    if result is None:
+        result = _find_self_reference(analysis, keyword, use_vocative)
+        _self_reference_cache.put(key, result)
+    return result
+
+
+def _find_self_reference(text: Analysis, keyword: str, use_vocative: bool) -> tuple[bool, str, int]:
     lemmas_forms = TaggedLemmasForms()
     toks, word_count, keyword_idx, _ = parse_sentence_with_keyword(text, [keyword], False)
     if word_count == 0:  # keyword is not separate work, but substring in a word
@@ -56,7 +293,7 @@ def find_self_reference(text: str, keyword: str, use_vocative: bool) -> tuple[bo
     valid_me = singular_noun and not other_present_verb and not other_past_verb
     # správné skloňování
     if use_vocative:
-        nouns2vocative(lemmas_forms, toks, text)
+        nouns2vocative(lemmas_forms, toks, text.text)
     result = "".join([tok.text if i == 0 else tok.text_before + tok.text for i, tok in enumerate(toks[keyword_idx:])])
     return valid_me, result, word_count
 
@@ -68,19 +305,40 @@ def nouns2vocative(lemmas_forms: TaggedLemmasForms, toks: list[Token], text: str
                 continue
             tok_tags = tok.lemma_tag
             tok_tags = tok_tags[:4] + "5" + tok_tags[5:]
-            morpho.generate(tok.lemma, tok_tags, morpho.GUESSER, lemmas_forms)
-            if len(lemmas_forms) == 0:  # unknown word to morphodita, no variant generated
+            form = _vocative_cache.get((tok.lemma, tok_tags))
+            if form is None:
+                morpho = load_models().morpho
+                morpho.generate(tok.lemma, tok_tags, morpho.GUESSER, lemmas_forms)
+                form = (
+                    next(form.form for lemma_forms in lemmas_forms for form in lemma_forms.forms)
+                    if len(lemmas_forms)
+                    else ""
+                )
+                _vocative_cache.put((tok.lemma, tok_tags), form)
+            if not form:  # unknown word to morphodita, no variant generated
                 return
-            tok.text = next(form.form for lemma_forms in lemmas_forms for form in lemma_forms.forms)
+            tok.text = form
         except Exception as e:
             logger.error(f"Selhalo skloňování v {text=}: {tok=}", exc_info=e)
 
 
-async def needs_help_a(text: str) -> bool:
-    return await run_async(needs_help, text)
+async def needs_help_a(text: str | Analysis) -> bool:
+    if not tagger_ready():
+        return False
+    analysis = text if isinstance(text, Analysis) else await analyze_a(text)
+    return needs_help(analysis)
+
+
+def needs_help(text: str | Analysis) -> bool:
+    analysis = text if isinstance(text, Analysis) else analyze(text)
+    result = _help_cache.get(analysis.text)
+    if result is None:
+        result = _needs_help(analysis)
+        _help_cache.put(analysis.text, result)
+    return result
 
 
-def needs_help(text: str) -> bool:
+def _needs_help(text: Analysis) -> bool:
     keywords = ["pomoc", "pomoci", "pomoct"]
     toks, word_count, _, nested = parse_sentence_with_keyword(text, keywords, after_keyword=False, match_lemma=True)
     if nested:
@@ -113,42 +371,29 @@ def needs_help(text: str) -> bool:
 
 
 def parse_sentence_with_keyword(
-    text: str, keywords: list[str], after_keyword: bool, match_lemma: bool = False
+    text: str | Analysis, keywords: list[str], after_keyword: bool, match_lemma: bool = False
 ) -> tuple[list[Token], int, int, bool]:
-    text = truncate_emojis(text.lower())
+    analysis = text if isinstance(text, Analysis) else analyze(text)
     word_count = 0
     keyword_idx = 0
-    forms = Forms()
-    lemmas = TaggedLemmas()
-    tokens = TokenRanges()
-    # Tag
-    tokenizer.setText(text)
     toks: list[Token] = []
-    t_iter = 0
     has_word = False
     nesting_char = '"'
     cur_nested = False  # assuming only 1 level of " nesting
     keyword_nested = False
-    while tokenizer.nextSentence(forms, tokens):
+    for sentence in analysis.sentences:
         has_word = False
         sentence_end = False
         toks = []
-        tagger.tag(forms, lemmas)
 
-        for i in range(len(lemmas)):
+        for tagged in sentence:
             word_count += 1
             if sentence_end:
                 has_word = False
                 sentence_end = False
                 toks = []
 
-            lemma = lemmas[i]
-            token = tokens[i]
-
-            tok = Token(
-                text[t_iter : token.start], lemma.lemma, lemma.tag, text[token.start : token.start + token.length]
-            )
-            t_iter = token.start + token.length
+            tok = replace(tagged)  # copy, callers modify the tokens
 
             # interpunkce
             if tok.lemma_tag[0] == "Z":
@@ -0,0 +1,58 @@
+"""Normalized views of message text.
+
+A message is normalized once, the trigger matcher, morphodita and the Markov chain all read
+the views they need from the same cached MessageViews.
+"""
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+MENTION_PATTERN = re.compile(r"<@!?&?\d+>|@everyone|@here")
+LINK_PATTERN = re.compile(r"https?://\S+")
+YOUTUBE_CHANNEL_PATTERN = re.compile(r"(?:youtube\.com|youtu\.be)/(?:channel/|c/|user/|@)[^\s/?#]+(?:[/?#][^\s]*)")
+# emojis are sometimes analyzed as noun
+EMOJI_PATTERN = re.compile(
+    "["
+    "\U0001f600-\U0001f64f"  # emoticons
+    "\U0001f300-\U0001f5ff"  # symbols & pictographs
+    "\U0001f680-\U0001f6ff"  # transport & map symbols
+    "\U0001f1e0-\U0001f1ff"  # flags (iOS)
+    "\U00002702-\U000027b0"  # other symbols
+    "\U000024c2-\U0001f251"
+    "]+",
+    flags=re.UNICODE,
+)
+
+
+def remove_mentions(text: str) -> str:
+    return MENTION_PATTERN.sub("`někdo`", text)
+
+
+def truncate_emojis(text: str) -> str:
+    return EMOJI_PATTERN.sub("", text)
+
+
+@dataclass(frozen=True)
+class MessageViews:
+    content: str
+    lower: str
+    without_links: str  # lowercase
+    mention_safe: str  # original case, mentions can't ping anyone
+    emoji_free: str  # lowercase, what morphodita analyzes
+
+    @classmethod
+    def of(cls, content: str) -> "MessageViews":
+        lower = content.lower()
+        return cls(
+            content=content,
+            lower=lower,
+            without_links=LINK_PATTERN.sub("", lower),
+            mention_safe=remove_mentions(content),
+            emoji_free=truncate_emojis(lower),
+        )
+
+
+@lru_cache(maxsize=1024)
+def views_of(content: str) -> MessageViews:
+    return MessageViews.of(content)
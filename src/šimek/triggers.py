@@ -0,0 +1,143 @@
+"""Trigger words of šimek's responses.
+
+The tables are in priority order, first trigger whose guard in ``manage_response`` passes wins. All keywords
+of a table are compiled into a single regex, so a message is scanned once instead of once per keyword.
+Run ``scripts/bench_triggers.py`` to compare it with checking the keywords one by one.
+"""
+
+import re
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Trigger:
+    name: str
+    any_of: frozenset[str] = frozenset()  # one of them must be in the message
+    all_of: frozenset[str] = frozenset()  # all of them must be in the message
+
+    @classmethod
+    def of(cls, name: str, *any_of: str, all_of: tuple[str, ...] = ()) -> "Trigger":
+        """Trigger on any of the keywords, all of all_of, or just the name if no keywords are given."""
+        if not any_of and not all_of:
+            any_of = (name,)
+        return cls(name, frozenset(any_of), frozenset(all_of))
+
+    def matches(self, found: set[str]) -> bool:
+        return (not self.any_of or not self.any_of.isdisjoint(found)) and self.all_of <= found
+
+
+def _trie_pattern(words: set[str]) -> str:
+    """Regex matching any of the words, alternatives share their common prefixes, so matching doesn't backtrack."""
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        # greedy, so the longest keyword starting at a position is matched
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class TriggerTable:
+    def __init__(self, triggers: list[Trigger]):
+        self.triggers = triggers
+        words = {word for trigger in triggers for word in trigger.any_of | trigger.all_of}
+        if "" in words:
+            raise ValueError("Empty trigger keyword")
+        # greedy, so each match is the longest keyword starting at its position
+        self._pattern = re.compile(_trie_pattern(words))
+        # keywords inside a matched one, they may start at the same position and aren't reported by the regex
+        self._contained = {word: frozenset(other for other in words if other in word) for word in words}
+        # offsets inside a keyword where a longer keyword may start, the scan skips over them after a match
+        self._overlaps = {
+            word: [
+                i
+                for i in range(1, len(word))
+                if any(other.startswith(word[i:]) and len(other) > len(word) - i for other in words)
+            ]
+            for word in words
+        }
+        # positions of triggers using a keyword, so only triggers with a found keyword are checked
+        self._by_keyword: dict[str, list[int]] = {word: [] for word in words}
+        for i, trigger in enumerate(triggers):
+            for word in trigger.any_of | trigger.all_of:
+                self._by_keyword[word].append(i)
+
+    def keywords_in(self, text: str) -> set[str]:
+        found: set[str] = set()
+        for match in self._pattern.finditer(text):
+            word = match.group()
+            found |= self._contained[word]
+            for i in self._overlaps[word]:
+                if overlapping := self._pattern.match(text, match.start() + i):
+                    found |= self._contained[overlapping.group()]
+        return found
+
+    def matches(self, text: str) -> list[Trigger]:
+        """Triggers whose keywords are in text, in priority order."""
+        found = self.keywords_in(text)
+        if not found:
+            return []
+        candidates = sorted({i for word in found for i in self._by_keyword[word]})
+        return [self.triggers[i] for i in candidates if self.triggers[i].matches(found)]
+
+
+MENTIONS = TriggerTable(
+    [
+        Trigger.of(
+            "mention", "@grok", "@schizo", "@šimek", "@1420163586310803566", "@&1437546286487175252", "šimku", "simku"
+        )
+    ]
+)
+
+RESPONSES = TriggerTable(
+    [
+        Trigger.of("hodný bot"),
+        Trigger.of("windows problém", all_of=("problém", "windows")),
+        Trigger.of("nvidia driver", all_of=("nvidia", "driver", "linux")),
+        Trigger.of("windows"),
+        Trigger.of("debian"),
+        Trigger.of("všechno nejlepší"),
+        Trigger.of("linux", "linux", "gnu/linux"),
+        Trigger.of("help", "hilfe", "help"),
+        Trigger.of("pomo"),
+        Trigger.of("novinky"),
+        Trigger.of("jsem"),
+        Trigger.of("schizo"),
+        Trigger.of("aneurysm", "anureysm", "aneuerysm", "brain damage", "brian damage"),
+        Trigger.of(
+            "grok", "groku je to pravda", "groku je toto pravda", "groku, je to pravda", "groku, je toto pravda"
+        ),
+        Trigger.of("?"),
+        Trigger.of("proč", "proč", "proc"),
+        Trigger.of("jsi"),
+        Trigger.of("negr"),
+        Trigger.of("izrael", "israel", "izrael"),
+        Trigger.of("mama", "mama", "mamá", "mami", "mommy", "mamka", "mamko"),
+        Trigger.of("lagtrain"),
+        Trigger.of("cum zone"),
+        Trigger.of("crab rave"),
+        Trigger.of("já jo"),
+        Trigger.of("já ne"),
+        Trigger.of("suicidal", "chci se zabít", "suicidal"),
+        Trigger.of("v píči", "v píči", "v pici"),
+        Trigger.of("buisness", "buisness", "buisnes", "buissnes", "bussiness", "bussines"),
+        Trigger.of("business", "business", "byznys"),
+        Trigger.of("reminder"),
+        Trigger.of("youtube", "youtu.be", "youtube.com"),
+        Trigger.of("špatný bot", "špatný bot", "spatny bot"),
+        Trigger.of("názor", "podle mě", "myslím si", "myslim si"),
+        Trigger.of("roll joint"),
+    ]
+)
+
+# matched against the message without links
+WITHOUT_LINKS = TriggerTable([Trigger.of("twitter", "twitter", "twiter")])
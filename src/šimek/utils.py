@@ -1,46 +1,153 @@
 import asyncio
 import datetime as dt
 import logging
-import re
-from collections import Counter, defaultdict
-from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import os
+import pickle
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Any, Callable, TypeVar
-import random
+from typing import Any, Callable, Generic, Hashable, TypeVar
 
-from common.persistence import load_pickle, save_pickle_async
+from common.persistence import append_pickle_async, compact_log_async, load_pickle_records
+from šimek.markov import (
+    COMPACT_THRESHOLD,
+    PrunePolicy,
+    TrigramStore,
+    build_trigram_counts,
+    convert_pickle,
+    logged_increments,
+)
 
 T = TypeVar("T")
+K = TypeVar("K", bound=Hashable)
+# legacy pickled model, converted to MARKOV_MODEL_FILE on first start
 MARKOV_FILE = Path(__file__).parent.parent.parent / "data" / "šimek" / "markov_trigram.pkl"
+# memory-mapped snapshot of the model
+MARKOV_MODEL_FILE = MARKOV_FILE.with_suffix(".bin")
+# trigram increments appended since the last snapshot
+MARKOV_LOG_FILE = MARKOV_FILE.with_suffix(".log")
+# number of logged increments after which the log is folded into the snapshot
+MARKOV_COMPACT_EVERY = 100
+# ingested messages per increment appended to the log
+MARKOV_FLUSH_EVERY = 50
+# message IDs remembered, so a message is ingested once
+MARKOV_SEEN_SIZE = 10_000
+# trigrams of all per-channel models together, cold channels are evicted over it,
+# compacted they take about 60 bytes each with the words, the default about 11MB by memory_usage()
+MARKOV_CHANNEL_BUDGET = int(os.getenv("ŠIMEK_MARKOV_CHANNEL_BUDGET", "200000"))
+# overlay transitions of a channel model that trigger its compaction, overlay entries take about 300 bytes each
+MARKOV_CHANNEL_COMPACT_THRESHOLD = 5_000
+# maintenance pass keeping the model bounded on a long-running bot, see prune_markov
+MARKOV_PRUNE_HOURS = float(os.getenv("ŠIMEK_MARKOV_PRUNE_HOURS", "0"))  # 0 disables the periodic pass
+MARKOV_PRUNE_POLICY = PrunePolicy(
+    decay=float(os.getenv("ŠIMEK_MARKOV_DECAY", "1")),
+    min_count=int(os.getenv("ŠIMEK_MARKOV_MIN_COUNT", "1")),
+    max_keys=int(os.getenv("ŠIMEK_MARKOV_MAX_KEYS", "0")) or None,
+)
 
 # CPU-heavy věci budeme dělat v separátním threadu
 executor = ThreadPoolExecutor(max_workers=1)
+# rebuilds of the Markov model, separate so they don't hold up tagging
+_markov_executor = ThreadPoolExecutor(max_workers=1)
+# optional worker processes, which don't share the GIL with the bot, see start_process_pool
+_process_pool: ProcessPoolExecutor | None = None
+_process_count = 0
 
 # Cached trigram counts (initialized at module load)
-_markov_cache: dict = {}
+_markov_cache = TrigramStore()
 _cache_initialized = False
+_logged_increments = 0
+# bumped by each snapshot, log records of older generations are already in the snapshot
+_log_generation = 0
+# increments merged while the model is rebuilt in background, replayed onto the rebuilt model
+_replay: list[dict] | None = None
+_compaction: asyncio.Task | None = None
 
 logger = logging.getLogger(__name__)
 
 
+def start_process_pool(processes: int, initializer: Callable[[], None] | None = None) -> None:
+    """Run run_async jobs in worker processes from now on.
+
+    Jobs must be picklable and must not rely on state of the bot's process. Falls back to the
+    in-process executor if the pool can't be started or breaks later.
+    """
+    global _process_pool, _process_count
+    if processes <= 0 or _process_pool is not None:
+        return
+    try:
+        # forkserver, forking the bot itself is unsafe, it runs threads
+        context = multiprocessing.get_context("forkserver")
+        # the default preloads the bot's main module, only the tagger is needed
+        context.set_forkserver_preload(["šimek.morphodita_utils"])
+        _process_pool = ProcessPoolExecutor(processes, mp_context=context, initializer=initializer)
+    except (OSError, ValueError) as e:
+        logger.error("Failed to start worker processes, running in-process", exc_info=e)
+        return
+    _process_count = processes
+    logger.info(f"Started process pool with {processes} workers")
+
+
+def stop_process_pool() -> None:
+    global _process_pool, _process_count
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+    _process_pool, _process_count = None, 0
+
+
+def uses_process_pool() -> bool:
+    return _process_pool is not None
+
+
+def worker_count() -> int:
+    """Number of run_async jobs which can run in parallel."""
+    return _process_count if _process_pool is not None else 1
+
+
 async def run_async(func: Callable[..., T], *args: Any) -> T:
-    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    loop = asyncio.get_running_loop()
+    if (pool := _process_pool) is not None:
+        try:
+            return await loop.run_in_executor(pool, func, *args)
+        except BrokenProcessPool as e:
+            logger.error("Worker process died, falling back to in-process mode", exc_info=e)
+            if pool is _process_pool:
+                stop_process_pool()
+    return await loop.run_in_executor(executor, func, *args)
+
+
+class LruCache(Generic[K, T]):
+    """Thread-safe bounded cache evicting the least recently used entry, counts hits and misses."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, T] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> T | None:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return value
 
+    def put(self, key: K, value: T) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
 
-def truncate_emojis(text):
-    # emojis are sometimes analyzed as noun
-    emoji_pattern = re.compile(
-        "["
-        "\U0001f600-\U0001f64f"  # emoticons
-        "\U0001f300-\U0001f5ff"  # symbols & pictographs
-        "\U0001f680-\U0001f6ff"  # transport & map symbols
-        "\U0001f1e0-\U0001f1ff"  # flags (iOS)
-        "\U00002702-\U000027b0"  # other symbols
-        "\U000024c2-\U0001f251"
-        "]+",
-        flags=re.UNICODE,
-    )
-    return emoji_pattern.sub(r"", text)
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
 
 
 def format_time_ago(time: dt.datetime) -> str:
@@ -74,64 +181,281 @@ def format_time_ago(time: dt.datetime) -> str:
         return f"{time_ago} ago"
 
 
-def build_trigram_counts(messages):
-    words = " ".join(messages).lower().split()
-    if len(words) < 3:
-        return {}
-    markov = defaultdict(list)
-    for i in range(len(words) - 2):
-        key = (words[i], words[i + 1])
-        next_word = words[i + 2]
-        markov[key].append(next_word)
-    markov_counts = {k: Counter(v) for k, v in markov.items()}
-    return markov_counts
+def _load_model(filename: Path, legacy_filename: Path) -> TrigramStore:
+    try:
+        if filename.exists():
+            return TrigramStore.load(filename)
+        if legacy_filename.exists():
+            logger.info(f"Converting {legacy_filename} to {filename}")
+            return convert_pickle(legacy_filename, filename)
+    except (OSError, ValueError, pickle.PickleError) as e:
+        logger.error(f"Failed to load trigrams from {filename}: {e}")
+    return TrigramStore()
 
 
-def load_trigram_counts(filename=MARKOV_FILE):
-    """Load trigram counts from file into global cache. Call once at bot start."""
-    global _markov_cache, _cache_initialized
+def load_trigram_counts(
+    filename=MARKOV_MODEL_FILE, log_filename=MARKOV_LOG_FILE, legacy_filename=MARKOV_FILE
+) -> TrigramStore:
+    """Map the trigram snapshot and replay the increment log into global cache. Call once at bot start.
+
+    Not called at import, so worker processes and scripts importing this module don't load the model.
+    """
+    global _markov_cache, _cache_initialized, _logged_increments, _log_generation
     if _cache_initialized:
         return _markov_cache
-    _markov_cache = load_pickle(filename, default={})
+    _markov_cache = _load_model(filename, legacy_filename)
+    _log_generation = _markov_cache.generation
+    increments = logged_increments(load_pickle_records(log_filename), _log_generation)
+    for increment in increments:
+        _markov_cache.merge(increment)
+    _logged_increments = len(increments)
     if _markov_cache:
-        logger.info("Loaded trigrams from cache")
+        logger.info(f"Loaded trigrams from cache: {_markov_cache.memory_usage()}")
     _cache_initialized = True
     return _markov_cache
 
 
-def markov_chain(messages, max_words=20):
-    global _markov_cache
-    # Build new trigram counts from messages
-    new_counts = build_trigram_counts(messages)
-    # Update global cache in place
-    for key, counter in new_counts.items():
-        if key in _markov_cache:
-            _markov_cache[key].update(counter)
-        else:
-            _markov_cache[key] = counter
-    # Save asynchronously in background thread
-    save_pickle_async(MARKOV_FILE, dict(_markov_cache))
-    markov_counts = _markov_cache
-
-    if not markov_counts:
+def save_trigram_increment(counts: dict) -> None:
+    """Append trigram increments to the log, occasionally folding the log into the snapshot."""
+    global _logged_increments
+    if not counts:
+        return
+    append_pickle_async(MARKOV_LOG_FILE, (_log_generation, counts))
+    _logged_increments += 1
+    if _logged_increments >= MARKOV_COMPACT_EVERY:
+        _save_snapshot(_markov_cache)
+
+
+def _save_snapshot(model: TrigramStore) -> None:
+    """Fold the log into a snapshot of the model, which must already contain the logged increments.
+
+    The snapshot starts a new log generation. If the bot dies after the snapshot is replaced but
+    before the old log is deleted, the old records are skipped on load instead of counted twice.
+    """
+    global _logged_increments, _log_generation
+    _log_generation += 1
+    snapshot = model.snapshot()
+    snapshot.generation = _log_generation
+    compact_log_async(MARKOV_MODEL_FILE, MARKOV_LOG_FILE, snapshot.save)
+    _logged_increments = 0
+
+
+class ChannelModels:
+    """Trigrams learned in each channel, generating from them backs off to the global model.
+
+    The models only live in memory, they are rebuilt from new messages after a restart. Together they hold
+    at most ``budget`` trigrams, the least recently used channels are dropped to stay under it.
+    A model is compacted in background once its overlay holds ``compact_threshold`` transitions,
+    like the global one.
+    """
+
+    def __init__(self, budget: int = MARKOV_CHANNEL_BUDGET, compact_threshold: int = MARKOV_CHANNEL_COMPACT_THRESHOLD):
+        self._budget = budget
+        self._compact_threshold = compact_threshold
+        self._models: OrderedDict[int, TrigramStore] = OrderedDict()
+        self._transitions = 0
+        self.evictions = 0
+        # increments merged while a channel's model is compacted, replayed onto the compacted model
+        self._replay: dict[int, list[dict]] = {}
+        self._compactions: set[asyncio.Task] = set()
+
+    def get(self, channel_id: int) -> TrigramStore | None:
+        model = self._models.get(channel_id)
+        if model is not None:
+            self._models.move_to_end(channel_id)
+        return model
+
+    def merge(self, channel_id: int, counts: dict) -> None:
+        model = self.get(channel_id)
+        if model is None:
+            model = self._models[channel_id] = TrigramStore()
+        before = model.transitions
+        model.merge(counts, compact=False)
+        self._transitions += model.transitions - before
+        if (replay := self._replay.get(channel_id)) is not None:
+            replay.append(counts)
+        elif model.pending_transitions >= self._compact_threshold:
+            self._compact(channel_id, model)
+        while self._transitions > self._budget and self._models:
+            _, evicted = self._models.popitem(last=False)
+            self._transitions -= evicted.transitions
+            self.evictions += 1
+
+    def _compact(self, channel_id: int, model: TrigramStore) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            model.compact()
+            return
+        # the snapshot is taken now, later merges are replayed
+        self._replay[channel_id] = []
+        task = loop.create_task(self._swap_compacted(channel_id, model, model.snapshot()))
+        self._compactions.add(task)
+        task.add_done_callback(self._compactions.discard)
+
+    async def _swap_compacted(self, channel_id: int, model: TrigramStore, snapshot: TrigramStore) -> None:
+        try:
+            compacted = await asyncio.get_running_loop().run_in_executor(_markov_executor, snapshot.compact)
+        finally:
+            replay = self._replay.pop(channel_id)
+        if self._models.get(channel_id) is not model:
+            return  # evicted meanwhile
+        for counts in replay:
+            compacted.merge(counts, compact=False)
+        # same trigrams, the budget accounting doesn't change
+        self._models[channel_id] = compacted
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "channels": len(self._models),
+            "transitions": self._transitions,
+            "budget": self._budget,
+            "evictions": self.evictions,
+        }
+
+
+channel_models = ChannelModels()
+
+
+def _merge(counts: dict) -> None:
+    _markov_cache.merge(counts, compact=False)
+    if _replay is not None:
+        _replay.append(counts)
+    elif _markov_cache.pending_transitions >= COMPACT_THRESHOLD:
+        _compact_markov()
+
+
+def _compact_markov() -> None:
+    """Fold the model's overlay into its arrays, in background when called on the event loop."""
+    global _compaction
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # bot start or a worker thread, there is no event loop to block
+        _markov_cache.compact()
+        return
+    if _compaction is None or _compaction.done():
+        _compaction = loop.create_task(_rebuild_markov(TrigramStore.compact))
+
+
+async def _rebuild_markov(build: Callable[[TrigramStore], TrigramStore]) -> TrigramStore | None:
+    """Run ``build`` on a snapshot of the model in a background thread and swap the result in.
+
+    Messages keep being learned meanwhile, they are replayed onto the new model.
+    Returns the new model, None if a rebuild is already running.
+    """
+    global _markov_cache, _replay
+    if _replay is not None:
+        return None
+    snapshot = _markov_cache.snapshot()
+    _replay = []
+    try:
+        # not run_async, a mapped store can't be sent to worker processes
+        rebuilt = await asyncio.get_running_loop().run_in_executor(_markov_executor, build, snapshot)
+        for counts in _replay:
+            rebuilt.merge(counts, compact=False)
+    finally:
+        _replay = None
+    _markov_cache = rebuilt
+    return rebuilt
+
+
+class MarkovIngest:
+    """Feeds new messages into the Markov model as they arrive, each message once.
+
+    Trigrams continue across messages of a channel, as when the model was built from channel history.
+    The model is updated right away, the increments are appended to the log in batches.
+    """
+
+    def __init__(self, seen_size: int = MARKOV_SEEN_SIZE, flush_every: int = MARKOV_FLUSH_EVERY):
+        self._seen: OrderedDict[int, None] = OrderedDict()
+        self._seen_size = seen_size
+        self._flush_every = flush_every
+        # last two words of each channel
+        self._context: dict[int, list[str]] = {}
+        self._pending: defaultdict[tuple[str, str], Counter[str]] = defaultdict(Counter)
+        self._pending_messages = 0
+
+    def add(self, message_id: int, channel_id: int, text: str) -> bool:
+        """Learn trigrams of the message, returns False if it was seen already."""
+        if message_id in self._seen:
+            return False
+        self._seen[message_id] = None
+        if len(self._seen) > self._seen_size:
+            self._seen.popitem(last=False)
+
+        words = self._context.get(channel_id, []) + text.lower().split()
+        self._context[channel_id] = words[-2:]
+        counts = build_trigram_counts([" ".join(words)])
+        _merge(counts)
+        channel_models.merge(channel_id, counts)
+        for key, next_words in counts.items():
+            self._pending[key].update(next_words)
+        self._pending_messages += 1
+        if self._pending_messages >= self._flush_every:
+            self.flush()
+        return True
+
+    def flush(self) -> None:
+        """Append the pending increments to the log, call on shutdown too."""
+        save_trigram_increment(dict(self._pending))
+        self._pending = defaultdict(Counter)
+        self._pending_messages = 0
+
+
+async def prune_markov(
+    policy: PrunePolicy = MARKOV_PRUNE_POLICY, ingest: MarkovIngest | None = None
+) -> dict[str, int] | None:
+    """Decay and prune the model in a background thread, then swap it in and save it.
+
+    Messages keep being learned meanwhile, they are replayed onto the pruned model. Pass the ingest
+    so its buffered increments are logged before the new snapshot, which already contains them.
+    Returns sizes before and after and the bytes reclaimed, None if a pass is already running.
+    """
+    global _logged_increments
+    if _compaction is not None and not _compaction.done():
+        # the pass compacts the model too, it starts from the compacted one
+        await asyncio.shield(_compaction)
+    before = _markov_cache.memory_usage()
+    pruned = await _rebuild_markov(lambda snapshot: snapshot.pruned(policy))
+    if pruned is None:
+        return None
+
+    _logged_increments = 0  # so flushing doesn't compact on its own, the snapshot below follows
+    if ingest is not None:
+        ingest.flush()
+    _save_snapshot(pruned)
+
+    after = pruned.memory_usage()
+    report = {
+        "keys_before": before["keys"],
+        "keys_after": after["keys"],
+        "transitions_before": before["transitions"],
+        "transitions_after": after["transitions"],
+        "bytes_before": before["model_bytes"] + before["pending_bytes"],
+        "bytes_after": after["model_bytes"] + after["pending_bytes"],
+    }
+    report["bytes_reclaimed"] = report["bytes_before"] - report["bytes_after"]
+    logger.info(f"Pruned trigrams with {policy}: {report}")
+    return report
+
+
+def generate_markov(max_words=20, channel_id: int | None = None):
+    """Generate from the channel's model if it knows the words so far, from the global one otherwise."""
+    local = channel_models.get(channel_id) if channel_id is not None else None
+    start_key = (local.random_key() if local else None) or _markov_cache.random_key()
+    if start_key is None:
         return "Not enough data for trigram Markov chain."
 
-    start_key = random.choice(list(markov_counts.keys()))
     sentence = [start_key[0], start_key[1]]
 
     for _ in range(max_words - 2):
-        if start_key in markov_counts:
-            next_words, weights = zip(*markov_counts[start_key].items())
-            next_word = random.choices(next_words, weights=weights)[0]
-            sentence.append(next_word)
-            if next_word.endswith((".", "!", "?:D", ":D", ":)", "😂", "🤣", ":kekw:")):
-                break
-            start_key = (start_key[1], next_word)
-        else:
+        next_word = (local.sample(start_key) if local else None) or _markov_cache.sample(start_key)
+        if next_word is None:
             break
+        sentence.append(next_word)
+        if next_word.endswith((".", "!", "?:D", ":D", ":)", "😂", "🤣", ":kekw:")):
+            break
+        start_key = (start_key[1], next_word)
 
     return " ".join(sentence).lower()
-
-
-# Load trigram counts at module import (bot start)
-load_trigram_counts()
@@ -0,0 +1,184 @@
+import pickle
+import time
+from concurrent.futures import wait
+
+import pytest
+
+from common import persistence
+
+
+def _drain_executor() -> None:
+    wait([persistence._executor.submit(lambda: None)])
+
+
+def test_append_and_load_pickle_records(tmp_path):
+    log = tmp_path / "nested" / "records.log"
+    persistence.append_pickle_async(log, {"a": 1})
+    persistence.append_pickle_async(log, {"b": 2})
+    _drain_executor()
+
+    assert persistence.load_pickle_records(log) == [{"a": 1}, {"b": 2}]
+
+
+def test_load_pickle_records_drops_truncated_record(tmp_path):
+    log = tmp_path / "records.log"
+    with open(log, "wb") as f:
+        pickle.dump("complete", f)
+        f.write(pickle.dumps("truncated")[:-3])
+
+    assert persistence.load_pickle_records(log) == ["complete"]
+    assert persistence.load_pickle_records(tmp_path / "missing.log") == []
+
+
+def _write_snapshot(path):
+    path.write_text("snapshot")
+
+
+def _fail_snapshot(path):
+    raise OSError("disk full")
+
+
+def test_compact_log_replaces_snapshot_and_log(tmp_path):
+    snapshot, log = tmp_path / "snapshot.bin", tmp_path / "snapshot.log"
+    persistence.append_pickle_async(log, "old increment")
+    persistence.compact_log_async(snapshot, log, _write_snapshot)
+    persistence.append_pickle_async(log, "new increment")
+    _drain_executor()
+
+    assert snapshot.read_text() == "snapshot"
+    assert persistence.load_pickle_records(log) == ["new increment"]
+    assert not (tmp_path / "snapshot.bin.tmp").exists()
+
+
+def test_compact_log_keeps_log_when_snapshot_fails(tmp_path):
+    snapshot, log = tmp_path / "snapshot.bin", tmp_path / "snapshot.log"
+    persistence.append_pickle_async(log, "increment")
+    persistence.compact_log_async(snapshot, log, _fail_snapshot)
+    _drain_executor()
+
+    assert not snapshot.exists()
+    assert persistence.load_pickle_records(log) == ["increment"]
+
+
+def test_saves_coalesce_to_latest(tmp_path, monkeypatch):
+    monkeypatch.setattr(persistence, "SAVE_INTERVAL", 60)
+    path = tmp_path / "state.json"
+    before = persistence.metrics()
+
+    persistence.save_json_async(path, {"version": 1})
+    persistence.flush()
+    # within the interval the saves wait and only the latest one is written
+    persistence.save_json_async(path, {"version": 2})
+    persistence.save_json_async(path, {"version": 3})
+    assert persistence.load_json(path) == {"version": 1}
+    assert persistence.metrics()["pending"] == 1
+
+    persistence.flush()
+    assert persistence.load_json(path) == {"version": 3}
+    after = persistence.metrics()
+    assert after["queued"] - before["queued"] == 3
+    assert after["coalesced"] - before["coalesced"] == 1
+    assert after["written"] - before["written"] == 2
+    assert after["pending"] == 0
+
+
+def test_save_after_interval_is_written(tmp_path, monkeypatch):
+    monkeypatch.setattr(persistence, "SAVE_INTERVAL", 0.05)
+    path = tmp_path / "state.pkl"
+
+    persistence.save_pickle_async(path, "first")
+    persistence.save_pickle_async(path, "second")
+    persistence.flush()
+    persistence.save_pickle_async(path, "third")
+    time.sleep(0.2)
+    _drain_executor()
+
+    assert persistence.load_pickle(path) == "third"
+    assert not (tmp_path / "state.pkl.tmp").exists()
+
+
+def test_failed_save_is_counted(tmp_path):
+    before = persistence.metrics()["failed"]
+
+    persistence.save_json_async(tmp_path / "state.json", {"not serializable": object()})
+    persistence.flush()
+
+    assert persistence.metrics()["failed"] == before + 1
+    assert not (tmp_path / "state.json").exists()
+    assert not (tmp_path / "state.json.tmp").exists()
+
+
+def test_key_value_store_writes_rows(tmp_path):
+    store = persistence.KeyValueStore(tmp_path / "nested" / "state.db", "items")
+    store.put_async("a", {"x": 1})
+    store.put_async("b", 2)
+    store.put_async("a", {"x": 3})
+    store.delete_async(["b", "missing"])
+    store.close()
+
+    reopened = persistence.KeyValueStore(tmp_path / "nested" / "state.db", "items")
+    assert reopened.load() == {"a": {"x": 3}}
+    reopened.close()
+
+
+def test_key_value_store_creates_database_on_first_write(tmp_path):
+    store = persistence.KeyValueStore(tmp_path / "nested" / "state.db", "items")
+    assert store.load() == {}
+    store.delete_async(["a"])
+    store.close()
+    assert not (tmp_path / "nested").exists()
+
+    store.put_async("a", 1)
+    store.close()
+    assert (tmp_path / "nested" / "state.db").exists()
+
+
+def test_key_value_store_imports_json_once(tmp_path):
+    legacy = tmp_path / "state.json"
+    legacy.write_text('{"a": 1, "b": 2}')
+    store = persistence.KeyValueStore(tmp_path / "state.db", "items")
+
+    assert store.import_json(legacy, lambda data: {key: value * 10 for key, value in data.items()}) == 2
+    assert store.load() == {"a": 10, "b": 20}
+    assert not legacy.exists()
+    assert (tmp_path / "state.json.migrated").exists()
+    # a table with data isn't overwritten
+    legacy.write_text('{"c": 3}')
+    assert store.import_json(legacy, dict) == 0
+    assert store.load() == {"a": 10, "b": 20}
+    store.close()
+
+
+def test_key_value_store_rejects_table_names():
+    with pytest.raises(ValueError):
+        persistence.KeyValueStore("state.db", "items; DROP TABLE x")
+
+
+def test_key_value_store_rejects_json_path(tmp_path):
+    with pytest.raises(ValueError):
+        persistence.KeyValueStore(tmp_path / "state.json", "items")
+
+
+def test_key_value_store_keeps_json_when_import_fails(tmp_path):
+    legacy = tmp_path / "state.json"
+    legacy.write_text('{"a": 1}')
+    # not a SQLite database, reading and writing the table fail
+    broken = tmp_path / "state.db"
+    broken.write_text('{"a": 1}')
+    store = persistence.KeyValueStore(broken, "items")
+
+    assert store.import_json(legacy, dict) == 0
+    assert legacy.exists()
+    assert not (tmp_path / "state.json.migrated").exists()
+    store.close()
+
+
+def test_key_value_store_keeps_json_when_write_fails(tmp_path, monkeypatch):
+    legacy = tmp_path / "state.json"
+    legacy.write_text('{"a": 1}')
+    store = persistence.KeyValueStore(tmp_path / "state.db", "items")
+    monkeypatch.setattr(store, "_write_sync", lambda upserts, deletes: False)
+
+    assert store.import_json(legacy, dict) == 0
+    assert legacy.exists()
+    store.close()
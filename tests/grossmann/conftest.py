@@ -8,6 +8,7 @@ from unittest.mock import AsyncMock, MagicMock, patch
 import pytest
 
 from common.constants import KouzelniciChamberRoles, ListenerType
+from grossmann import backfill_persistence, fame_persistence, pause_persistence
 from ..conftest import MOCK_USER_ID, MOCK_VOTER_ID
 
 # Mock environment variables for testing
@@ -21,6 +22,21 @@ TEST_ALLOWED_CHANNEL_ID = 22222
 MOCK_CHAMBER_ROLE_ID = KouzelniciChamberRoles.ITPERO.role_id
 
 
+@pytest.fixture(autouse=True)
+def temp_persistence_files(tmp_path, monkeypatch) -> Generator[None, Any, None]:
+    """Keep the databases of every test in its temporary directory, not in the repo's data directory."""
+    monkeypatch.setenv("GROSSMANN_FAME_FILE", str(tmp_path / "forwarded_fames.db"))
+    monkeypatch.setenv("GROSSMANN_PAUSE_FILE", str(tmp_path / "paused_users.db"))
+    monkeypatch.setenv("GROSSMANN_BACKFILL_FILE", str(tmp_path / "backfill_checkpoints.db"))
+    modules = (fame_persistence, pause_persistence, backfill_persistence)
+    for module in modules:
+        module._reset_cache()
+        module._init_cache()
+    yield
+    for module in modules:
+        module._reset_cache()
+
+
 @pytest.fixture
 def mock_ctx_with_message(mock_ctx, mock_message):
     """Create a mock context that returns a message from original_message()."""
@@ -0,0 +1,251 @@
+"""Tests for the hall of fame backfill engine and its checkpoints."""
+
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import disnake
+import pytest
+from disnake.utils import time_snowflake
+
+from grossmann import backfill
+from grossmann import backfill_persistence as bp
+from grossmann.backfill import AdaptiveRateLimiter, CoalescedEditor, Scan, run_backfill, split_range
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _rate_limited(retry_after="2"):
+    response = MagicMock()
+    response.status = 429
+    response.reason = "Too Many Requests"
+    response.headers = {"Retry-After": retry_after}
+    return disnake.HTTPException(response, "rate limited")
+
+
+def _message(msg_id):
+    msg = MagicMock()
+    msg.id = msg_id
+    msg.created_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return msg
+
+
+def _channel(messages, delay=0.0):
+    async def history(limit=None, after=None, before=None, oldest_first=None):
+        for msg in messages:
+            await asyncio.sleep(delay)
+            yield msg
+
+    channel = MagicMock()
+    channel.history = history
+    return channel
+
+
+async def test_rate_limiter_spaces_calls():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(1.0, min_interval=0.5, clock=clock, sleep=clock.sleep)
+
+    for _ in range(3):
+        await limiter.acquire()
+
+    assert clock.sleeps == [1.0, 1.0]
+
+
+async def test_rate_limiter_backs_off_on_429_and_retries():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(1.0, clock=clock, sleep=clock.sleep)
+    func = AsyncMock(side_effect=[_rate_limited("5"), "ok"])
+
+    assert await limiter.call(func, "arg") == "ok"
+
+    func.assert_called_with("arg")
+    assert limiter.rate_limited == 1
+    # waited for Retry-After, the doubled interval then shrinks after the success
+    assert clock.sleeps == [5.0]
+    assert limiter.interval == pytest.approx(1.8)
+
+
+async def test_rate_limiter_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(backfill, "MAX_RETRIES", 1)
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(1.0, clock=clock, sleep=clock.sleep)
+
+    with pytest.raises(disnake.HTTPException):
+        await limiter.call(AsyncMock(side_effect=_rate_limited()))
+
+
+async def test_coalesced_editor_edits_at_most_once_per_interval():
+    clock = FakeClock()
+    edit = AsyncMock()
+    editor = CoalescedEditor(edit, interval=3.0, clock=clock)
+
+    await editor.update("a")
+    clock.now = 1.0
+    await editor.update("b")
+    clock.now = 3.5
+    await editor.update("c")
+    await editor.final("done")
+
+    assert [c.args[0] for c in edit.call_args_list] == ["a", "c", "done"]
+    assert editor.skipped == 1
+
+
+def test_split_range_covers_window():
+    after = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    before = datetime(2024, 1, 5, tzinfo=timezone.utc)
+
+    slices = split_range(after, before, 4)
+
+    assert slices[0] == (after, datetime(2024, 1, 2, tzinfo=timezone.utc))
+    assert slices[-1][1] == before
+    assert all(slices[i][1] == slices[i + 1][0] for i in range(3))
+
+
+async def test_run_backfill_forwards_scan_by_scan():
+    """A later scan finishing first still forwards after the earlier ones."""
+    slow = [_message(i) for i in range(1, 4)]
+    fast = [_message(i) for i in range(10, 13)]
+    scans = [Scan(_channel(slow, delay=0.01), after=datetime(2024, 1, 1)), Scan(_channel(fast), after=None)]
+    forwarded = []
+
+    async def forward(msg):
+        forwarded.append(msg.id)
+        return msg.id != 11
+
+    progress = await run_backfill(scans, lambda msg: msg.id != 2, forward, AsyncMock(), queue_size=1)
+
+    assert forwarded == [1, 3, 10, 11, 12]
+    assert progress.scanned == 6
+    assert progress.candidates == 5
+    assert len(progress.forwarded_times) == 4
+    assert progress.scans_done == 2
+
+
+async def test_scan_with_limit_yields_oldest_first():
+    newest_first = [_message(3), _message(2), _message(1)]
+
+    messages = [msg.id async for msg in Scan(_channel(newest_first), limit=3).history()]
+
+    assert messages == [1, 2, 3]
+
+
+async def test_run_backfill_cursor_waits_for_queued_candidates():
+    """A failing forward leaves the cursor before the message, so a resume retries it."""
+    scan = Scan(_channel([_message(1), _message(2), _message(3)]), after=None)
+
+    async def forward(msg):
+        if msg.id == 2:
+            raise RuntimeError("forward failed")
+        return True
+
+    with pytest.raises(RuntimeError):
+        await run_backfill([scan], lambda msg: msg.id == 2, forward, AsyncMock())
+
+    assert scan.cursor == 1
+    assert not scan.done
+
+
+async def test_run_backfill_marks_scans_done_and_skips_them():
+    done = Scan(_channel([_message(1)]), done=True)
+    scan = Scan(_channel([_message(5), _message(6)]))
+    forward = AsyncMock(return_value=True)
+
+    progress = await run_backfill([done, scan], lambda msg: True, forward, AsyncMock())
+
+    assert [c.args[0].id for c in forward.call_args_list] == [5, 6]
+    assert scan.done and scan.cursor == 6
+    assert progress.scans_done == 2
+
+
+async def test_scan_with_limit_is_pinned_and_resumes_after_cursor():
+    captured = {}
+
+    async def history(limit=None, after=None, before=None, oldest_first=None):
+        captured.update(limit=limit, after=after, before=before)
+        for msg_id in (30, 20, 10):
+            yield _message(msg_id)
+
+    channel = MagicMock()
+    channel.history = history
+    scan = Scan(channel, limit=3)
+    assert [msg.id async for msg in scan.history()] == [10, 20, 30]
+
+    # the scanned messages became a window
+    assert scan.limit is None
+    assert (scan.after.id, scan.before.id) == (9, 31)
+    scan.cursor = 20
+    [msg async for msg in scan.history()]
+    assert captured["limit"] is None
+    assert (captured["after"].id, captured["before"].id) == (20, 31)
+
+
+def test_checkpoints_survive_restart(tmp_path):
+    path = tmp_path / "backfill_checkpoints.db"
+    with patch.object(bp, "_get_backfill_file_path", return_value=path):
+        bp._reset_cache()
+        bp._init_cache()
+        channel = MagicMock()
+        channel.id = 123
+        after = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        scan = Scan(channel, after=after, before=disnake.Object(999), cursor=500)
+        job = bp.BackfillJob(
+            job_id=bp.new_job_id(),
+            guild_id=1,
+            where="#general",
+            started_by="Admin",
+            started_at=1700000000.0,
+            scans=[bp.scan_checkpoint(scan)],
+            scanned=10,
+        )
+        bp.save_job(job)
+
+        bp._reset_cache()
+        bp._init_cache()
+        restored = bp.get_job(1)
+        assert restored == job
+        assert bp.new_job_id() == 2
+
+        resumed = bp.restore_scan(restored.scans[0], channel)
+        assert resumed.after.id == time_snowflake(after, high=True)
+        assert (resumed.before.id, resumed.cursor, resumed.done) == (999, 500, False)
+        bp._reset_cache()
+
+
+def test_job_ids_are_not_reused(tmp_path):
+    with patch.object(bp, "_get_backfill_file_path", return_value=tmp_path / "backfill_checkpoints.db"):
+        bp._reset_cache()
+        bp._init_cache()
+        job = bp.BackfillJob(
+            bp.new_job_id(), guild_id=1, where="#general", started_by="Admin", started_at=0.0, scans=[]
+        )
+        bp.save_job(job)
+        bp.delete_job(job.job_id)
+        assert bp.new_job_id() == 2
+
+        bp._reset_cache()
+        bp._init_cache()
+        assert bp.get_jobs() == []
+        assert bp.new_job_id() == 3
+        bp._reset_cache()
+
+
+async def test_rate_limiter_never_goes_below_discord_limit():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(clock=clock, sleep=clock.sleep)
+
+    for _ in range(20):
+        await limiter.call(AsyncMock())
+
+    assert limiter.interval == backfill.FORWARD_INTERVAL
+    assert set(clock.sleeps) == {1.0}
@@ -11,7 +11,7 @@ from grossmann import fame_persistence as fame
 @pytest.fixture
 def temp_fame_file(tmp_path):
     """Create a temporary fame file and isolate the cache for testing."""
-    fame_file = tmp_path / "forwarded_fames.json"
+    fame_file = tmp_path / "forwarded_fames.db"
     with patch.object(fame, "_get_fame_file_path", return_value=fame_file):
         fame._reset_cache()
         fame._init_cache()
@@ -44,12 +44,57 @@ def test_mark_trims_to_max_tracked(temp_fame_file):
 
 def test_survives_restart(temp_fame_file):
     """Forwarded IDs saved by a previous session are reloaded on startup."""
-    # Simulate a file written by a previous run (JSON keys are strings).
-    temp_fame_file.write_text(json.dumps({"555": 1700000000.0}), encoding="utf-8")
+    fame.mark_forwarded(555, 1700000000.0)
 
-    # Simulate a restart: drop the in-memory cache and reload from file.
+    # Simulate a restart: drop the in-memory cache and reload from the database.
     fame._reset_cache()
     fame._init_cache()
 
     assert fame.is_forwarded(555)
     assert fame.get_forwarded()[555] == 1700000000.0
+
+
+def test_trimmed_ids_are_deleted_from_database(temp_fame_file):
+    for i in range(fame.MAX_TRACKED + 1):
+        fame.mark_forwarded(i, float(i))
+    assert fame.stats() == {"tracked": fame.MAX_TRACKED, "max_tracked": fame.MAX_TRACKED, "evictions": 1}
+
+    fame._reset_cache()
+    fame._init_cache()
+
+    assert len(fame.get_forwarded()) == fame.MAX_TRACKED
+    assert not fame.is_forwarded(0)
+
+
+def test_newest_ids_evicts_oldest_by_timestamp():
+    ids = fame.NewestIds(2)
+    assert ids.add(1, 10.0) == []
+    assert ids.add(2, 30.0) == []
+    # marking again updates the timestamp, the old heap entry is skipped
+    assert ids.add(1, 40.0) == []
+    assert ids.add(3, 20.0) == [3]
+    assert ids.add(4, 50.0) == [2]
+
+    assert ids.as_dict() == {1: 40.0, 4: 50.0}
+    assert ids.evictions == 2
+    assert 4 in ids and 2 not in ids
+
+
+def test_newest_ids_trims_loaded_items():
+    ids = fame.NewestIds(2, {1: 3.0, 2: 1.0, 3: 2.0})
+
+    assert ids.trim() == [2]
+    assert ids.as_dict() == {1: 3.0, 3: 2.0}
+
+
+def test_imports_legacy_json_file(temp_fame_file):
+    """The JSON file written before the database existed is migrated once."""
+    fame._reset_cache()
+    # JSON keys are strings
+    temp_fame_file.with_suffix(".json").write_text(json.dumps({"555": 1700000000.0}), encoding="utf-8")
+
+    fame._init_cache()
+
+    assert fame.get_forwarded() == {555: 1700000000.0}
+    assert not temp_fame_file.with_suffix(".json").exists()
+    assert temp_fame_file.with_suffix(".json.migrated").exists()
@@ -19,6 +19,7 @@ from .conftest import MOCK_CHAMBER_ROLE_ID
 from ..conftest import MOCK_MESSAGE_ID, MOCK_USER_ID, MOCK_VOTER_ID
 from grossmann import grossmanndict as grossdi
 from grossmann import main
+from grossmann import backfill_persistence as bp
 from grossmann import fame_persistence as fame
 from grossmann.utils import batch_react, AccessVoting
 
@@ -26,7 +27,7 @@ from grossmann.utils import batch_react, AccessVoting
 @pytest.fixture
 def temp_fame_file(tmp_path):
     """Isolate hall of fame persistence in a temporary file per test."""
-    fame_file = tmp_path / "forwarded_fames.json"
+    fame_file = tmp_path / "forwarded_fames.db"
     with patch.object(fame, "_get_fame_file_path", return_value=fame_file):
         fame._reset_cache()
         fame._init_cache()
@@ -34,6 +35,17 @@ def temp_fame_file(tmp_path):
         fame._reset_cache()
 
 
+@pytest.fixture
+def temp_backfill_file(tmp_path):
+    """Isolate backfill checkpoints in a temporary file per test."""
+    backfill_file = tmp_path / "backfill_checkpoints.db"
+    with patch.object(bp, "_get_backfill_file_path", return_value=backfill_file):
+        bp._reset_cache()
+        bp._init_cache()
+        yield backfill_file
+        bp._reset_cache()
+
+
 # Test batch_react utility function
 async def test_batch_react_adds_all_reactions(mock_message):
     """Test batch_react function adds all reactions in order."""
@@ -533,7 +545,7 @@ async def test_forward_to_fame_routes_memes_to_thread(mock_message, temp_fame_fi
     mock_message.forward.assert_called_once_with(thread)
 
 
-async def test_backfill_fame_forwards_only_qualifying(mock_ctx, temp_fame_file):
+async def test_backfill_fame_forwards_only_qualifying(mock_ctx, temp_fame_file, temp_backfill_file):
     """Backfill forwards missed qualifying messages, oldest first, and skips the rest."""
 
     def make_msg(msg_id, count, created_at):
@@ -555,6 +567,7 @@ async def test_backfill_fame_forwards_only_qualifying(mock_ctx, temp_fame_file):
             yield msg
 
     target = MagicMock()
+    target.id = Channel.GENERAL
     target.name = "general"
     target.mention = "#general"
     target.history = mock_history
@@ -563,7 +576,7 @@ async def test_backfill_fame_forwards_only_qualifying(mock_ctx, temp_fame_file):
     with patch.object(main, "client") as mock_client:
         mock_client.get_channel.return_value = AsyncMock()
 
-        await main.backfill_fame(mock_ctx, channel=None, limit=500, after=None, before=None)
+        await main.backfill_fame(mock_ctx, channel=None, limit=500, after=None, before=None, server_wide=False)
 
     newest_good.forward.assert_called_once()
     oldest_good.forward.assert_called_once()
@@ -577,7 +590,7 @@ async def test_backfill_fame_forwards_only_qualifying(mock_ctx, temp_fame_file):
     assert "2024-03-03 10:00 UTC" in final_summary
 
 
-async def test_backfill_fame_skips_already_forwarded(mock_ctx, temp_fame_file):
+async def test_backfill_fame_skips_already_forwarded(mock_ctx, temp_fame_file, temp_backfill_file):
     """Backfill does not re-forward messages already recorded as forwarded."""
     already = AsyncMock()
     already.id = 777
@@ -591,6 +604,7 @@ async def test_backfill_fame_skips_already_forwarded(mock_ctx, temp_fame_file):
         yield already
 
     target = MagicMock()
+    target.id = Channel.GENERAL
     target.name = "general"
     target.mention = "#general"
     target.history = mock_history
@@ -599,13 +613,13 @@ async def test_backfill_fame_skips_already_forwarded(mock_ctx, temp_fame_file):
     with patch.object(main, "client") as mock_client:
         mock_client.get_channel.return_value = AsyncMock()
 
-        await main.backfill_fame(mock_ctx, channel=None, limit=500, after=None, before=None)
+        await main.backfill_fame(mock_ctx, channel=None, limit=500, after=None, before=None, server_wide=False)
 
     already.forward.assert_not_called()
     assert "forwarded 0" in mock_ctx.edit_original_response.call_args.kwargs["content"]
 
 
-async def test_backfill_fame_after_date_scans_whole_window(mock_ctx, temp_fame_file):
+async def test_backfill_fame_after_date_scans_whole_window(mock_ctx, temp_fame_file, temp_backfill_file):
     """An 'after' date scans the whole time window (no count cap) and forwards chronologically."""
 
     def make_msg(msg_id, count, created_at):
@@ -630,6 +644,7 @@ async def test_backfill_fame_after_date_scans_whole_window(mock_ctx, temp_fame_f
             yield msg
 
     target = MagicMock()
+    target.id = Channel.GENERAL
     target.name = "general"
     target.mention = "#general"
     target.history = mock_history
@@ -638,7 +653,7 @@ async def test_backfill_fame_after_date_scans_whole_window(mock_ctx, temp_fame_f
     with patch.object(main, "client") as mock_client:
         mock_client.get_channel.return_value = AsyncMock()
 
-        await main.backfill_fame(mock_ctx, channel=None, limit=500, after="2026-05-27", before=None)
+        await main.backfill_fame(mock_ctx, channel=None, limit=500, after="2026-05-27", before=None, server_wide=False)
 
     # The count cap is bypassed and the whole window is requested oldest-first.
     assert captured["limit"] is None
@@ -649,6 +664,156 @@ async def test_backfill_fame_after_date_scans_whole_window(mock_ctx, temp_fame_f
     assert "forwarded 2" in mock_ctx.edit_original_response.call_args.kwargs["content"]
 
 
+async def test_backfill_fame_server_wide_skips_unreadable_channels(mock_ctx, temp_fame_file, temp_backfill_file):
+    """Server-wide backfill scans the readable channels except the hall of fame."""
+
+    def make_channel(channel_id, readable=True):
+        channel = MagicMock()
+        channel.id = channel_id
+        channel.permissions_for.return_value.read_message_history = readable
+        channel.history = MagicMock(side_effect=lambda **kwargs: _empty_history())
+        return channel
+
+    async def _empty_history():
+        return
+        yield
+
+    general = make_channel(Channel.GENERAL)
+    hidden = make_channel(Channel.MEMES_SHITPOSTING, readable=False)
+    fame_channel = make_channel(Channel.HALL_OF_FAME)
+    mock_ctx.guild.text_channels = [general, hidden, fame_channel]
+
+    with patch.object(main, "client"):
+        await main.backfill_fame(mock_ctx, channel=None, limit=500, after=None, before=None, server_wide=True)
+
+    general.history.assert_called_once()
+    hidden.history.assert_not_called()
+    fame_channel.history.assert_not_called()
+    hidden.permissions_for.assert_called_once_with(mock_ctx.guild.me)
+    assert "complete" in mock_ctx.edit_original_response.call_args.kwargs["content"]
+
+
+async def test_backfill_fame_failure_keeps_checkpoint_for_resume(mock_ctx, temp_fame_file, temp_backfill_file):
+    """A failed backfill can be resumed after the last handled message, and is deleted once complete."""
+
+    def make_msg(msg_id, count):
+        msg = AsyncMock()
+        msg.id = msg_id
+        msg.channel = MagicMock()
+        msg.channel.id = Channel.GENERAL
+        msg.reactions = [_reaction("⭐", count)]
+        msg.created_at = datetime(2026, 5, 28, 9, msg_id)
+        return msg
+
+    first, second = make_msg(1, 11), make_msg(2, 15)
+    calls = []
+
+    async def failing_history(limit=100, after=None, before=None, oldest_first=None):
+        yield first
+        raise RuntimeError("connection lost")
+
+    async def resumed_history(limit=100, after=None, before=None, oldest_first=None):
+        calls.append(after)
+        yield second
+
+    target = MagicMock()
+    target.id = Channel.GENERAL
+    target.mention = "#general"
+    target.history = failing_history
+    mock_ctx.channel = target
+
+    with patch.object(main, "client") as mock_client:
+        mock_client.get_channel.return_value = AsyncMock()
+        with pytest.raises(RuntimeError):
+            await main.backfill_fame(
+                mock_ctx, channel=None, limit=500, after="2026-05-27", before=None, server_wide=False
+            )
+
+        (job,) = bp.get_jobs()
+        assert job.scans[0].cursor == 1
+        assert not job.scans[0].done
+        assert job.forwarded == 1
+        assert "failed" in mock_ctx.edit_original_response.call_args.kwargs["content"]
+        assert f"{job.job_id}: #general" in main.backfill_list(mock_ctx.guild_id)
+
+        target.history = resumed_history
+        mock_client.get_channel.side_effect = (
+            lambda channel_id: target if channel_id == Channel.GENERAL else AsyncMock()
+        )
+        await main.backfill_jobs(mock_ctx, action="resume", job_id=job.job_id)
+
+    first.forward.assert_called_once()
+    second.forward.assert_called_once()
+    # the resumed scan continues after the first message
+    assert calls[0].id == 1
+    assert bp.get_jobs() == []
+    assert "forwarded 1" in mock_ctx.edit_original_response.call_args.kwargs["content"]
+
+
+async def test_backfill_jobs_resume_keeps_checkpoints_of_missing_channels(mock_ctx, temp_fame_file, temp_backfill_file):
+    """Channels the bot can't see on resume keep their checkpoints, and the job isn't deleted."""
+
+    async def empty_history(limit=100, after=None, before=None, oldest_first=None):
+        return
+        yield
+
+    general = MagicMock()
+    general.id = Channel.GENERAL
+    general.history = empty_history
+    job = bp.BackfillJob(
+        job_id=bp.new_job_id(),
+        guild_id=mock_ctx.guild_id,
+        where="the whole server",
+        started_by="Admin",
+        started_at=datetime.now().timestamp(),
+        scans=[
+            bp.ScanCheckpoint(channel_id=Channel.GENERAL, cursor=1),
+            bp.ScanCheckpoint(channel_id=Channel.MEMES_SHITPOSTING, cursor=42),
+        ],
+    )
+    bp.save_job(job)
+
+    with patch.object(main, "client") as mock_client:
+        mock_client.get_channel.side_effect = lambda channel_id: general if channel_id == Channel.GENERAL else None
+        await main.backfill_jobs(mock_ctx, action="resume", job_id=job.job_id)
+
+    kept = bp.get_job(job.job_id)
+    assert kept is not None
+    assert kept.scans == [
+        bp.ScanCheckpoint(channel_id=Channel.GENERAL, cursor=1, done=True),
+        bp.ScanCheckpoint(channel_id=Channel.MEMES_SHITPOSTING, cursor=42),
+    ]
+    content = mock_ctx.edit_original_response.call_args.kwargs["content"]
+    assert f"1 channel(s) not found: {Channel.MEMES_SHITPOSTING}" in content
+
+
+async def test_backfill_jobs_cancel_deletes_checkpoint(mock_ctx, temp_backfill_file):
+    job = bp.BackfillJob(
+        job_id=bp.new_job_id(),
+        guild_id=mock_ctx.guild_id,
+        where="#general",
+        started_by="Admin",
+        started_at=datetime.now().timestamp(),
+        scans=[bp.ScanCheckpoint(channel_id=Channel.GENERAL, cursor=42)],
+    )
+    bp.save_job(job)
+
+    await main.backfill_jobs(mock_ctx, action="cancel", job_id=job.job_id)
+
+    assert bp.get_job(job.job_id) is None
+    assert "cancelled" in mock_ctx.response.send_message.call_args.args[0]
+    assert main.backfill_list(mock_ctx.guild_id) == "No unfinished backfills."
+
+
+async def test_backfill_jobs_ignores_other_guilds(mock_ctx, temp_backfill_file):
+    bp.save_job(bp.BackfillJob(1, guild_id=1, where="#general", started_by="Admin", started_at=0.0, scans=[]))
+
+    await main.backfill_jobs(mock_ctx, action="cancel", job_id=1)
+
+    assert bp.get_job(1) is not None
+    assert "No unfinished backfill 1" in mock_ctx.response.send_message.call_args.args[0]
+
+
 # Test on_member_join event
 async def test_on_member_join_sends_welcome(mock_member):
     """Test on_member_join sends welcome message."""
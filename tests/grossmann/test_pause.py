@@ -1,5 +1,7 @@
 """Tests for the pause functionality in Grossmann bot."""
 
+import asyncio
+import json
 from datetime import datetime
 from unittest.mock import AsyncMock, MagicMock, patch
 
@@ -14,7 +16,7 @@ from grossmann.pause_persistence import PausedUser
 @pytest.fixture
 def temp_pause_file(tmp_path):
     """Create a temporary pause file for testing."""
-    pause_file = tmp_path / "paused_users.json"
+    pause_file = tmp_path / "paused_users.db"
     with patch.object(pp, "_get_pause_file_path", return_value=pause_file):
         # Reset and reinitialize cache with the patched path
         pp._reset_cache()
@@ -106,9 +108,9 @@ class TestPausePersistence:
         """Test getting expired pauses."""
         now = datetime.now().timestamp()
         # Add expired user (expires 100 seconds ago)
-        pp._paused_users_cache.append(PausedUser(user_id=1, guild_id=100, expires_at=now - 100))
+        pp._track(PausedUser(user_id=1, guild_id=100, expires_at=now - 100))
         # Add non-expired user (expires in 1 hour)
-        pp._paused_users_cache.append(PausedUser(user_id=2, guild_id=100, expires_at=now + 3600))
+        pp._track(PausedUser(user_id=2, guild_id=100, expires_at=now + 3600))
 
         expired = pp.get_expired_pauses()
 
@@ -119,9 +121,9 @@ class TestPausePersistence:
         """Test removing expired pauses."""
         now = datetime.now().timestamp()
         # Add expired user (expires 100 seconds ago)
-        pp._paused_users_cache.append(PausedUser(user_id=1, guild_id=100, expires_at=now - 100))
+        pp._track(PausedUser(user_id=1, guild_id=100, expires_at=now - 100))
         # Add non-expired user (expires in 1 hour)
-        pp._paused_users_cache.append(PausedUser(user_id=2, guild_id=100, expires_at=now + 3600))
+        pp._track(PausedUser(user_id=2, guild_id=100, expires_at=now + 3600))
 
         removed = pp.remove_expired_pauses()
 
@@ -132,6 +134,23 @@ class TestPausePersistence:
         assert len(remaining) == 1
         assert remaining[0].user_id == 2
 
+    def test_next_expiry_skips_replaced_and_removed_pauses(self, temp_pause_file):
+        """Test the earliest expiry ignores pauses that were replaced or removed."""
+        now = datetime.now().timestamp()
+        pp._track(PausedUser(user_id=1, guild_id=100, expires_at=now - 100))
+        pp._track(PausedUser(user_id=1, guild_id=100, expires_at=now + 300))
+        pp._track(PausedUser(user_id=2, guild_id=100, expires_at=now + 200))
+        pp._track(PausedUser(user_id=3, guild_id=100, expires_at=now + 100))
+        pp.remove_paused_user(3, 100)
+
+        assert pp.next_expiry() == now + 200
+        assert pp.remove_expired_pauses() == []
+
+        pp.remove_paused_user(2, 100)
+        assert pp.next_expiry() == now + 300
+        pp.remove_paused_user(1, 100)
+        assert pp.next_expiry() is None
+
     def test_get_user_pause_exists(self, temp_pause_file):
         """Test getting pause entry for existing user."""
         pp.add_paused_user(123, 456, 1.0)
@@ -147,6 +166,32 @@ class TestPausePersistence:
         pause = pp.get_user_pause(123, 456)
         assert pause is None
 
+    def test_pauses_survive_restart(self, temp_pause_file):
+        """Test added, replaced and removed pauses are reloaded from the database."""
+        pp.add_paused_user(1, 100, 1.0)
+        pp.add_paused_user(1, 100, 2.0)
+        pp.add_paused_user(2, 100, 1.0)
+        pp.remove_paused_user(2, 100)
+
+        pp._reset_cache()
+        pp._init_cache()
+
+        result = pp.get_paused_users()
+        assert len(result) == 1
+        assert result[0].user_id == 1
+        assert result[0].expires_at == pytest.approx(datetime.now().timestamp() + 7200, abs=60)
+
+    def test_imports_legacy_json_file(self, temp_pause_file):
+        """Test the JSON file written before the database existed is migrated once."""
+        pp._reset_cache()
+        legacy_file = temp_pause_file.with_suffix(".json")
+        legacy_file.write_text(json.dumps([{"user_id": 1, "guild_id": 100, "expires_at": 1700000000.0}]))
+
+        pp._init_cache()
+
+        assert pp.get_paused_users() == [PausedUser(user_id=1, guild_id=100, expires_at=1700000000.0)]
+        assert not legacy_file.exists()
+
 
 class TestPauseCommand:
     """Tests for the /pause_me command (self-service pause)."""
@@ -211,7 +256,7 @@ class TestBackgroundTask:
     async def test_check_expired_pauses_removes_role(self, temp_pause_file):
         """Test that expired pauses are processed and roles removed."""
         now = datetime.now().timestamp()
-        pp._paused_users_cache.append(PausedUser(user_id=123, guild_id=456, expires_at=now - 100))
+        pp._track(PausedUser(user_id=123, guild_id=456, expires_at=now - 100))
 
         mock_role = MagicMock()
         mock_role.id = 999
@@ -231,10 +276,27 @@ class TestBackgroundTask:
         mock_member.remove_roles.assert_called_once()
         assert pp.get_paused_users() == []
 
+    async def test_expire_pauses_wakes_up_for_new_pause(self, temp_pause_file):
+        """Test the expiry task sleeps until a pause added meanwhile expires."""
+        with (
+            patch.object(main, "client") as mock_client,
+            patch.object(main, "get_paused_role_id", return_value=999),
+        ):
+            mock_client.get_guild.return_value = None
+            task = asyncio.create_task(main.expire_pauses())
+            await asyncio.sleep(0.01)
+
+            pp._track(PausedUser(user_id=123, guild_id=456, expires_at=datetime.now().timestamp() + 0.05))
+            main._pauses_changed.set()
+            await asyncio.sleep(0.2)
+            task.cancel()
+
+        assert pp.get_paused_users() == []
+
     async def test_restore_paused_users_on_startup(self, temp_pause_file):
         """Test that paused users are restored when bot starts."""
         now = datetime.now().timestamp()
-        pp._paused_users_cache.append(PausedUser(user_id=123, guild_id=456, expires_at=now + 3600))
+        pp._track(PausedUser(user_id=123, guild_id=456, expires_at=now + 3600))
 
         mock_role = MagicMock()
         mock_role.id = 999
@@ -256,7 +318,7 @@ class TestBackgroundTask:
     async def test_restore_paused_users_skips_expired(self, temp_pause_file):
         """Test that expired pauses are not restored on startup."""
         now = datetime.now().timestamp()
-        pp._paused_users_cache.append(PausedUser(user_id=123, guild_id=456, expires_at=now - 100))
+        pp._track(PausedUser(user_id=123, guild_id=456, expires_at=now - 100))
 
         mock_guild = MagicMock()
         mock_guild.get_role.return_value = MagicMock()
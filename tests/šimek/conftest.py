@@ -4,6 +4,8 @@ from unittest.mock import patch, MagicMock
 
 import pytest
 
+from šimek import morphodita_utils
+
 
 @pytest.fixture()
 def first_rand_answer() -> Generator[MagicMock, Any, None]:
@@ -20,3 +22,9 @@ def always_answer() -> Generator[MagicMock, Any, None]:
     with patch("random.randint") as mock_randint:
         mock_randint.return_value = 1  # so the probability triggers always in tests
         yield mock_randint
+
+
+@pytest.fixture(scope="session")
+def loaded_tagger() -> None:
+    # šimek loads the models in the background once connected, tests need them right away
+    morphodita_utils.load_models()
@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+from šimek.cooldown import WHEEL_SLOTS, CooldownManager
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def make_manager(clock, **kwargs) -> CooldownManager:
+    return CooldownManager(lambda channel_id: 30, clock=clock, wall_clock=lambda: clock.now + 1e9, **kwargs)
+
+
+def test_channel_cooldown(clock):
+    cooldowns = make_manager(clock)
+    assert cooldowns.wait_time(1, 10) == 0
+
+    cooldowns.record(1, 10)
+    assert cooldowns.wait_time(1, 11) == pytest.approx(30)
+    assert cooldowns.wait_time(2, 11) == 0
+
+    clock.now += 30
+    assert cooldowns.wait_time(1, 11) == 0
+
+
+def test_user_burst_across_channels(clock):
+    cooldowns = make_manager(clock, user_cooldown=60, user_burst=3)
+    for channel_id in range(3):
+        cooldowns.record(channel_id, 10)
+
+    assert cooldowns.wait_time(3, 10) == pytest.approx(20)
+    assert cooldowns.wait_time(3, 11) == 0
+
+
+def test_mute(clock):
+    cooldowns = make_manager(clock)
+    cooldowns.mute(1, 300)
+
+    clock.now += 299
+    assert cooldowns.wait_time(1, 10) == pytest.approx(1)
+    clock.now += 1
+    assert cooldowns.wait_time(1, 10) == 0
+
+
+def test_disabled_cooldown(clock):
+    cooldowns = CooldownManager(lambda channel_id: -1, clock=clock)
+    cooldowns.record(1, 10)
+
+    assert cooldowns.wait_time(1, 11) == 0
+
+
+@pytest.mark.parametrize("elapsed", [61, 5 * WHEEL_SLOTS])
+def test_full_buckets_expire(clock, elapsed):
+    cooldowns = make_manager(clock, user_cooldown=60)
+    cooldowns.record(1, 10)
+    cooldowns.mute(2, 3 * WHEEL_SLOTS)
+    assert len(cooldowns) == 3
+
+    clock.now += elapsed
+    cooldowns.wait_time(3, 11)
+    assert len(cooldowns) == (1 if elapsed < 3 * WHEEL_SLOTS else 0)
+
+
+def test_state_survives_restart(clock, tmp_path):
+    cooldowns = make_manager(clock)
+    cooldowns.record(1, 10)
+    cooldowns.mute(2, 300)
+    clock.now += 10
+    (tmp_path / "cooldowns.json").write_text(json.dumps(cooldowns.state()))
+
+    # monotonic clock starts over after a restart, wall clock goes on
+    restarted_clock = FakeClock(5.0)
+    restarted = CooldownManager(
+        lambda channel_id: 30,
+        file_path=tmp_path / "cooldowns.json",
+        clock=restarted_clock,
+        wall_clock=lambda: clock.now + 1e9,
+    )
+
+    assert restarted.wait_time(1, 11) == pytest.approx(20)
+    assert restarted.wait_time(2, 11) == pytest.approx(290)
+    assert "muted until" in restarted.report(lambda kind, id_: f"{kind}-{id_}")
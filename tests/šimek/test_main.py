@@ -1,11 +1,24 @@
 """Basic smoke tests for Šimek Discord bot."""
 
+import os
 import re
+import runpy
+import subprocess
+import sys
 from unittest.mock import AsyncMock, patch, call
 
 import pytest
 from common.constants import KEKWR
 from šimek import main
+from šimek.cooldown import CooldownManager
+
+pytestmark = pytest.mark.usefixtures("loaded_tagger")
+
+
+@pytest.fixture(autouse=True)
+def fresh_cooldowns():
+    with patch.object(main, "cooldowns", CooldownManager(main.cooldown)):
+        yield
 
 
 @pytest.mark.parametrize(
@@ -176,3 +189,80 @@ async def test_do_response_escaping(mock_message, always_answer, mention, expect
     await main.do_response(reply_text, mock_message)
 
     mock_message.reply.assert_called_once_with(expected)
+
+
+async def test_nlp_skipped_when_roll_fails(mock_message):
+    """Morphodita and the joke API are asked only after the dice roll passed."""
+    main.COOLDOWN = -1
+    mock_message.content = "jsem hloupý, tvoje mama potřebuje pomoct"
+
+    with (
+        patch("random.randint", return_value=2),
+        patch("šimek.main.find_self_reference_a", new_callable=AsyncMock) as mock_find,
+        patch("šimek.main.needs_help_a", new_callable=AsyncMock) as mock_help,
+        patch("šimek.main.prepare_http_response", new_callable=AsyncMock) as mock_http,
+    ):
+        await main.manage_response(mock_message)
+
+    mock_find.assert_not_awaited()
+    mock_help.assert_not_awaited()
+    mock_http.assert_not_awaited()
+
+
+async def test_on_message_ingests_markov_once(mock_message):
+    mock_message.content = "Ahoj <@123>, jak se máš"
+    with (
+        patch.object(main, "markov_ingest") as mock_ingest,
+        patch.object(main, "manage_response", new_callable=AsyncMock),
+    ):
+        await main.on_message(mock_message)
+
+    mock_ingest.add.assert_called_once_with(mock_message.id, mock_message.channel.id, "Ahoj `někdo` jak se máš")
+
+
+def test_reimporting_main_has_no_side_effects():
+    """Workers of a bot started as a script run its main module again, as ``__mp_main__``."""
+    with (
+        patch("common.discord_logging.configure_logging") as mock_logging,
+        patch.object(CooldownManager, "_load") as mock_load_cooldowns,
+        patch("šimek.utils.load_trigram_counts") as mock_load_markov,
+        patch("šimek.morphodita_utils.start_tagger_processes") as mock_start_workers,
+    ):
+        runpy.run_path(main.__file__, run_name="__mp_main__")
+
+    mock_logging.assert_not_called()
+    mock_load_cooldowns.assert_not_called()
+    mock_load_markov.assert_not_called()
+    mock_start_workers.assert_not_called()
+
+
+# starts šimek like ``python -m šimek`` with main() replaced, the tagger worker reports the bot's modules it imported
+WORKER_MODULES_PROBE = """
+import runpy
+import šimek.main
+from šimek import utils
+
+def probe():
+    utils.start_process_pool(1)
+    # multiprocessing aliases every process's __main__ as __mp_main__, it's the bot's one if it has the client
+    modules = "__import__('sys').modules"
+    imported = f"[name for name in ('šimek.main', '__mp_main__') if hasattr({modules}.get(name), 'client')]"
+    print(utils._process_pool.submit(eval, imported).result())
+    utils.stop_process_pool()
+
+šimek.main.main = probe
+runpy.run_module("šimek", run_name="__main__", alter_sys=True)
+"""
+
+
+def test_tagger_workers_dont_import_main():
+    result = subprocess.run(
+        [sys.executable, "-c", WORKER_MODULES_PROBE],
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "[]"
@@ -0,0 +1,232 @@
+import pickle
+from collections import Counter
+from unittest.mock import patch
+
+import pytest
+
+from šimek import markov
+from šimek.markov import PrunePolicy, TrigramStore, build_trigram_counts, logged_increments
+
+MESSAGES = [
+    "jsem hloupý bot a jsem rád",
+    "jsem hloupý člověk",
+    "a jsem rád že jsem tady",
+]
+
+
+def test_merge_matches_legacy_counts():
+    counts = build_trigram_counts(MESSAGES)
+    store = TrigramStore()
+    store.merge(counts)
+
+    assert len(store) == len(counts)
+    assert dict(store.items()) == counts
+
+
+def test_compact_keeps_counts():
+    counts = build_trigram_counts(MESSAGES)
+    store = TrigramStore.from_counts(counts)
+    store.merge(counts)
+    expected = {key: dict(Counter(next_words) + Counter(next_words)) for key, next_words in counts.items()}
+
+    assert dict(store.items()) == expected
+    store.compact()
+    assert dict(store.items()) == expected
+    assert store.memory_usage()["pending_keys"] == 0
+
+
+def test_merge_compacts_over_threshold():
+    store = TrigramStore()
+    with patch.object(markov, "COMPACT_THRESHOLD", 3):
+        store.merge(build_trigram_counts(MESSAGES))
+
+    assert store.memory_usage()["pending_keys"] == 0
+    assert ("jsem", "hloupý") in store
+
+
+def test_merge_with_custom_threshold():
+    store = TrigramStore()
+    store.merge(build_trigram_counts(MESSAGES), compact_threshold=10**6)
+    assert store.memory_usage()["pending_keys"] == len(build_trigram_counts(MESSAGES))
+
+    store.merge({}, compact_threshold=1)
+    assert store.memory_usage()["pending_keys"] == 0
+
+
+def test_sample_and_random_key():
+    store = TrigramStore.from_counts({("a", "b"): Counter({"c": 1})})
+    store.merge({("b", "c"): Counter({"d": 1})})
+
+    assert store.sample(("a", "b")) == "c"
+    assert store.sample(("b", "c")) == "d"
+    assert store.sample(("c", "d")) is None
+    assert store.sample(("neznámé", "slovo")) is None
+    assert {store.random_key() for _ in range(50)} == {("a", "b"), ("b", "c")}
+    assert TrigramStore().random_key() is None
+
+
+def test_snapshot_is_independent_and_picklable():
+    store = TrigramStore.from_counts(build_trigram_counts(MESSAGES))
+    snapshot = store.snapshot()
+    store.merge({("nové", "slovo"): Counter({"tady": 1})})
+
+    restored = pickle.loads(pickle.dumps(snapshot))
+    assert ("nové", "slovo") not in restored
+    assert dict(restored.items()) == build_trigram_counts(MESSAGES)
+
+
+def test_memory_usage():
+    counts = build_trigram_counts(MESSAGES)
+    store = TrigramStore.from_counts(counts)
+
+    usage = store.memory_usage()
+    transitions = sum(len(next_words) for next_words in counts.values())
+    assert usage["keys"] == len(counts)
+    assert usage["transitions"] == transitions
+    # 8B per key, 8B per offset, 4B next word ID + 4B count per transition
+    assert usage["array_bytes"] == 8 * len(counts) + 8 * (len(counts) + 1) + 8 * transitions
+    assert usage["total_bytes"] >= usage["array_bytes"] + usage["vocabulary_bytes"]
+
+
+def test_sample_follows_weights():
+    store = TrigramStore.from_counts({("a", "b"): Counter({"c": 1, "d": 3})})
+
+    with patch("random.randrange", side_effect=[0, 1, 3]):
+        assert [store.sample(("a", "b")) for _ in range(3)] == ["c", "d", "d"]
+
+
+def test_sample_table_invalidated_on_merge():
+    store = TrigramStore.from_counts({("a", "b"): Counter({"c": 1})})
+    store.merge({("a", "b"): Counter({"c": 1})})
+    assert store.sample(("a", "b")) == "c"
+
+    store.merge({("a", "b"): Counter({"d": 98})})
+    samples = {store.sample(("a", "b")) for _ in range(50)}
+    assert "d" in samples
+    assert samples <= {"c", "d"}
+
+
+def test_save_and_load_mapped(tmp_path):
+    counts = build_trigram_counts(MESSAGES)
+    TrigramStore.from_counts(counts).save(tmp_path / "model.bin")
+
+    store = TrigramStore.load(tmp_path / "model.bin")
+    assert dict(store.items()) == counts
+    assert len(store) == len(counts)
+    assert store.sample(("hloupý", "člověk")) == "a"
+    assert store.memory_usage()["array_bytes"] == 0
+
+
+def test_save_and_load_keep_generation(tmp_path):
+    store = TrigramStore.from_counts(build_trigram_counts(MESSAGES))
+    store.generation = 3
+    store.snapshot().save(tmp_path / "model.bin")
+
+    assert TrigramStore.load(tmp_path / "model.bin").generation == 3
+
+
+def test_load_version_1_model(tmp_path):
+    counts = build_trigram_counts(MESSAGES)
+    TrigramStore.from_counts(counts).save(tmp_path / "model.bin")
+    data = (tmp_path / "model.bin").read_bytes()
+    fields = markov._HEADER.unpack_from(data)
+    (tmp_path / "v1.bin").write_bytes(markov._HEADER_V1.pack(fields[0], 1, *fields[2:6]) + data[markov._HEADER.size :])
+
+    store = TrigramStore.load(tmp_path / "v1.bin")
+    assert store.generation == 0
+    assert dict(store.items()) == counts
+
+
+def test_logged_increments_skip_older_generations():
+    records = [{"legacy": 1}, (0, {"old": 1}), (1, {"current": 1}), (2, {"newer": 1})]
+
+    assert logged_increments(records, 0) == [{"legacy": 1}, {"old": 1}, {"current": 1}, {"newer": 1}]
+    assert logged_increments(records, 1) == [{"current": 1}, {"newer": 1}]
+
+
+def test_mapped_store_accepts_merges(tmp_path):
+    TrigramStore.from_counts(build_trigram_counts(MESSAGES)).save(tmp_path / "model.bin")
+    store = TrigramStore.load(tmp_path / "model.bin")
+
+    store.merge({("jsem", "hloupý"): Counter({"pes": 2}), ("nové", "slovo"): Counter({"jsem": 1})})
+    expected = build_trigram_counts(MESSAGES)
+    expected[("jsem", "hloupý")]["pes"] += 2
+    expected[("nové", "slovo")] = Counter({"jsem": 1})
+    assert dict(store.items()) == expected
+
+    store.snapshot().save(tmp_path / "model2.bin")
+    store.compact()
+    assert dict(store.items()) == expected
+    assert dict(TrigramStore.load(tmp_path / "model2.bin").items()) == expected
+
+
+def test_load_rejects_other_files(tmp_path):
+    (tmp_path / "model.bin").write_bytes(b"\0" * 64)
+
+    with pytest.raises(ValueError):
+        TrigramStore.load(tmp_path / "model.bin")
+
+
+def test_convert_pickle(tmp_path):
+    counts = build_trigram_counts(MESSAGES)
+    with open(tmp_path / "markov.pkl", "wb") as f:
+        pickle.dump(counts, f)
+
+    store = markov.convert_pickle(tmp_path / "markov.pkl", tmp_path / "markov.bin")
+    assert dict(store.items()) == counts
+
+
+def test_transitions_counts_overlay_entries_in_arrays_once():
+    store = TrigramStore.from_counts({("a", "b"): Counter({"c": 1}), ("b", "c"): Counter({"d": 1})})
+    store.merge({("a", "b"): Counter({"c": 2, "e": 1}), ("x", "y"): Counter({"z": 1})})
+
+    assert store.transitions == 4
+    assert store.pending_transitions == 3
+    store.compact()
+    assert store.transitions == 4
+
+
+def test_pruned_decays_and_drops_rare_transitions():
+    store = TrigramStore.from_counts({("a", "b"): Counter({"c": 4, "d": 1}), ("b", "c"): Counter({"d": 1})})
+    store.merge({("a", "b"): Counter({"c": 1})})
+
+    pruned = store.pruned(PrunePolicy(decay=0.5))
+
+    assert dict(pruned.items()) == {("a", "b"): {"c": 3}}
+    assert pruned.sample(("a", "b")) == "c"
+    assert pruned.memory_usage()["model_bytes"] < store.memory_usage()["model_bytes"]
+    # the original is untouched
+    assert dict(store.items()) == {("a", "b"): {"c": 5, "d": 1}, ("b", "c"): {"d": 1}}
+
+
+def test_pruned_min_count_and_max_keys(tmp_path):
+    counts = {("a", "b"): Counter({"c": 3, "d": 1}), ("b", "c"): Counter({"d": 5}), ("c", "d"): Counter({"e": 2})}
+    TrigramStore.from_counts(counts).save(tmp_path / "model.bin")
+    store = TrigramStore.load(tmp_path / "model.bin")
+
+    assert dict(store.pruned(PrunePolicy(min_count=2)).items()) == {
+        ("a", "b"): {"c": 3},
+        ("b", "c"): {"d": 5},
+        ("c", "d"): {"e": 2},
+    }
+    assert dict(store.pruned(PrunePolicy(max_keys=2)).items()) == {("a", "b"): {"c": 3, "d": 1}, ("b", "c"): {"d": 5}}
+    assert dict(store.pruned(PrunePolicy()).items()) == counts
+
+
+def test_pruned_max_keys_breaks_ties_by_key_order_and_decays_once():
+    counts = {("a", "b"): Counter({"x": 2}), ("b", "c"): Counter({"x": 2}), ("c", "d"): Counter({"x": 1, "y": 3})}
+    store = TrigramStore.from_counts(counts)
+
+    with patch.object(
+        TrigramStore, "_decayed_transitions", autospec=True, side_effect=TrigramStore._decayed_transitions
+    ) as decayed:
+        pruned = store.pruned(PrunePolicy(max_keys=2))
+
+    assert dict(pruned.items()) == {("a", "b"): {"x": 2}, ("c", "d"): {"x": 1, "y": 3}}
+    assert decayed.call_count == 3
+
+
+@pytest.mark.parametrize("kwargs", [{"decay": 0}, {"decay": 1.5}, {"min_count": 0}, {"max_keys": -1}])
+def test_prune_policy_rejects_invalid_values(kwargs):
+    with pytest.raises(ValueError):
+        PrunePolicy(**kwargs)
@@ -1,6 +1,21 @@
+import asyncio
+import threading
+from unittest.mock import AsyncMock, patch
+
 import pytest
 
-from šimek.morphodita_utils import find_self_reference, needs_help, Token
+from šimek import morphodita_utils
+from šimek.morphodita_utils import (
+    Analysis,
+    Token,
+    analyze,
+    analyze_a,
+    find_self_reference,
+    find_self_reference_a,
+    needs_help,
+    needs_help_a,
+)
+from šimek.utils import LruCache
 
 
 @pytest.mark.parametrize(
@@ -155,3 +170,94 @@ def test_needs_help(content, expected):
 )
 def test_token(token: Token, tag: str, expected: bool):
     assert token.tag_matches(tag) == expected
+
+
+def test_shared_analysis_matches_text():
+    text = "jsem programátor, potřebuju pomoct"
+    analysis = analyze(text)
+
+    assert find_self_reference(analysis, "jsem", True) == find_self_reference(text, "jsem", True)
+    # vocative of the previous call must not leak into the shared tokens
+    assert find_self_reference(analysis, "jsem", False) == find_self_reference(text, "jsem", False)
+    assert needs_help(analysis) == needs_help(text)
+
+
+async def test_analyze_a_coalesces_concurrent_requests():
+    with (
+        patch.object(morphodita_utils, "_analysis_cache", LruCache(8)),
+        patch("šimek.morphodita_utils._tag_batch", wraps=morphodita_utils._tag_batch) as mock_batch,
+    ):
+        first, second, third = await asyncio.gather(
+            analyze_a("jsem programátor"), analyze_a("Jsem programátor"), analyze_a("pomoc")
+        )
+        cached = await analyze_a("jsem programátor")
+
+    mock_batch.assert_called_once_with(["jsem programátor", "pomoc"])
+    assert cached is first
+    assert first is second
+    assert third.text == "pomoc"
+
+
+def test_repeated_message_hits_cache():
+    with (
+        patch.object(morphodita_utils, "_analysis_cache", LruCache(8)),
+        patch.object(morphodita_utils, "_self_reference_cache", LruCache(8)),
+        patch("šimek.morphodita_utils._tag", wraps=morphodita_utils._tag) as mock_tag,
+    ):
+        first = find_self_reference("jsem programátor", "jsem", True)
+        second = find_self_reference("Jsem programátor", "jsem", True)
+
+        assert first == second
+        mock_tag.assert_called_once_with("jsem programátor")
+        assert morphodita_utils.cache_stats()["self_reference"]["hits"] == 1
+
+
+async def test_not_ready_while_loading():
+    with patch.object(morphodita_utils, "_ready", threading.Event()):
+        assert await find_self_reference_a("jsem programátor", "jsem", True) == (False, "", 0)
+        assert await needs_help_a("potřebuju pomoct") is False
+
+
+def test_start_loading_in_background():
+    ready = threading.Event()
+    with (
+        patch.object(morphodita_utils, "_models", None),
+        patch.object(morphodita_utils, "_ready", ready),
+        patch.object(morphodita_utils, "_load_lock", threading.Lock()),
+    ):
+        morphodita_utils.start_loading()
+        assert ready.wait(timeout=60)
+        assert morphodita_utils.tagger_ready()
+        assert morphodita_utils._models is not None
+
+
+async def test_start_loading_waits_for_worker_processes():
+    ready = threading.Event()
+    with (
+        patch.object(morphodita_utils, "_models", None),
+        patch.object(morphodita_utils, "_ready", ready),
+        patch.object(morphodita_utils, "uses_process_pool", return_value=True),
+        patch.object(morphodita_utils, "run_async", AsyncMock()) as mock_run,
+    ):
+        morphodita_utils.start_loading()
+        await morphodita_utils._workers_starting
+
+        mock_run.assert_awaited_once_with(morphodita_utils._warm_up)
+        assert ready.is_set()
+        # šimek's process doesn't load its own copy
+        assert morphodita_utils._models is None
+
+
+async def test_vocative_is_generated_in_background():
+    analysis = Analysis("jsem programátor", [])
+    ready = threading.Event()
+    ready.set()
+    with (
+        patch.object(morphodita_utils, "_ready", ready),
+        patch.object(morphodita_utils, "_self_reference_cache", LruCache(8)),
+        patch.object(morphodita_utils, "run_async", AsyncMock(return_value=(True, "programátore", 2))) as mock_run,
+    ):
+        assert await find_self_reference_a(analysis, "jsem", True) == (True, "programátore", 2)
+        assert await find_self_reference_a(analysis, "jsem", True) == (True, "programátore", 2)
+
+    mock_run.assert_awaited_once_with(morphodita_utils._find_self_reference, analysis, "jsem", True)
@@ -0,0 +1,21 @@
+import pytest
+
+from šimek.text import MessageViews, views_of
+
+
+def test_views():
+    views = MessageViews.of("Ahoj <@123> 😀 koukni https://Twitter.com/X @everyone")
+
+    assert views.lower == "ahoj <@123> 😀 koukni https://twitter.com/x @everyone"
+    assert views.without_links == "ahoj <@123> 😀 koukni  @everyone"
+    assert views.mention_safe == "Ahoj `někdo` 😀 koukni https://Twitter.com/X `někdo`"
+    assert views.emoji_free == "ahoj <@123>  koukni https://twitter.com/x @everyone"
+
+
+@pytest.mark.parametrize("mention", ["<@&123456789>", "<@123456789>", "<@!123456789>", "@here", "@everyone"])
+def test_mentions_are_safe(mention):
+    assert views_of(f"Hello {mention}").mention_safe == "Hello `někdo`"
+
+
+def test_views_are_cached():
+    assert views_of("jsem programátor") is views_of("jsem programátor")
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from šimek.triggers import RESPONSES, Trigger, TriggerTable
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("bussiness", {"bussines", "bussiness"}),  # shorter keyword starting at the same position
+        ("gnu/linux", {"gnu/linux", "linux"}),
+        ("jsemjsi", {"jsem", "jsi"}),
+        ("mamamami", {"mama", "mami"}),  # overlapping keywords
+        ("nic", set()),
+    ],
+)
+def test_keywords_in(text, expected):
+    table = TriggerTable(
+        [
+            Trigger.of("mama", "mama", "mamka", "mami"),
+            Trigger.of("linux", "linux", "gnu/linux"),
+            Trigger.of("jsem"),
+            Trigger.of("jsi"),
+            Trigger.of("buisness", "bussines", "bussiness"),
+        ]
+    )
+
+    assert table.keywords_in(text) == expected
+
+
+def test_matches_keeps_priority_and_all_of():
+    table = TriggerTable(
+        [Trigger.of("windows problém", all_of=("problém", "windows")), Trigger.of("windows"), Trigger.of("linux")]
+    )
+
+    assert [t.name for t in table.matches("linux a windows")] == ["windows", "linux"]
+    assert [t.name for t in table.matches("windows mají problém")] == ["windows problém", "windows"]
+    assert table.matches("problém") == []
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["mám velký problém s windows", "Groku, je to pravda?".lower(), "https://youtu.be/abc", "nic", "jsem programátor?"],
+)
+def test_matches_same_as_substring_checks(text):
+    expected = [
+        trigger
+        for trigger in RESPONSES.triggers
+        if (not trigger.any_of or any(word in text for word in trigger.any_of))
+        and all(word in text for word in trigger.all_of)
+    ]
+
+    assert RESPONSES.matches(text) == expected
+
+
+def test_keywords_in_overlapping_keywords():
+    words = {word for trigger in RESPONSES.triggers for word in trigger.any_of | trigger.all_of}
+    rng = random.Random(42)
+    for _ in range(500):
+        # glue keyword fragments together, so keywords overlap each other
+        text = "".join(rng.choice(sorted(words))[rng.randrange(3) :] for _ in range(4))
+        assert RESPONSES.keywords_in(text) == {word for word in words if word in text}, text
@@ -1,9 +1,17 @@
+import asyncio
 import datetime as dt
-from unittest.mock import patch
+import os
+import pickle
+import random
+from collections import Counter
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import MagicMock, patch
 
 import pytest
 
 from šimek import utils
+from šimek.markov import PrunePolicy, TrigramStore
 
 
 async def test_run_async():
@@ -13,7 +21,7 @@ async def test_run_async():
 
 def test_build_trigram_counts():
     """Test trigram counting function."""
-    utils._markov_cache = {}
+    utils._markov_cache = TrigramStore()
     messages = ["hello world test", "world test again"]
     result = utils.build_trigram_counts(messages)
 
@@ -22,11 +30,26 @@ def test_build_trigram_counts():
     assert ("world", "test") in result
 
 
-def test_markov_chain_insufficient_data():
+def test_build_trigram_counts_matches_naive_counting():
+    rng = random.Random(0)
+    messages = [" ".join(rng.choices(["a", "B", "c", "d", "e."], k=rng.randint(0, 8))) for _ in range(200)]
+    words = " ".join(messages).lower().split()
+    expected: dict[tuple[str, str], Counter[str]] = {}
+    for i in range(len(words) - 2):
+        expected.setdefault((words[i], words[i + 1]), Counter())[words[i + 2]] += 1
+
+    result = utils.build_trigram_counts(messages)
+    assert result == expected
+    # same order too, so the model is built identically
+    assert list(result) == list(expected)
+    assert all(list(result[key]) == list(expected[key]) for key in expected)
+    assert utils.build_trigram_counts(["a b"]) == {}
+
+
+def test_generate_markov_insufficient_data():
     """Test markov chain with insufficient data."""
-    utils._markov_cache = {}
-    messages = ["hi"]
-    result = utils.markov_chain(messages)
+    utils._markov_cache = TrigramStore.from_counts(utils.build_trigram_counts(["hi"]))
+    result = utils.generate_markov(channel_id=10)
 
     assert "Not enough data" in result
 
@@ -79,3 +102,247 @@ def test_format_time_ago_accepts_aware_datetime():
     result = utils.format_time_ago(aware_past)
 
     assert result.endswith("ago")
+
+
+def test_ingest_flush_logs_increments_and_generates_from_store():
+    utils._markov_cache = TrigramStore()
+    ingest = utils.MarkovIngest()
+    with (
+        patch.object(utils, "channel_models", utils.ChannelModels()),
+        patch("šimek.utils.append_pickle_async") as mock_append,
+    ):
+        ingest.add(1, 10, "a b c d e.")
+        ingest.flush()
+        result = utils.generate_markov(channel_id=20)
+
+    assert result in {"a b c d e.", "b c d e.", "c d e."}
+    mock_append.assert_called_once_with(
+        utils.MARKOV_LOG_FILE, (utils._log_generation, utils.build_trigram_counts(["a b c d e."]))
+    )
+
+
+def test_save_trigram_increment_compacts_periodically():
+    utils._markov_cache = TrigramStore()
+    with (
+        patch.object(utils, "_logged_increments", 0),
+        patch.object(utils, "_log_generation", 0),
+        patch.object(utils, "MARKOV_COMPACT_EVERY", 2),
+        patch("šimek.utils.append_pickle_async") as mock_append,
+        patch("šimek.utils.compact_log_async") as mock_compact,
+    ):
+        utils.save_trigram_increment({})
+        utils.save_trigram_increment({("a", "b"): Counter({"c": 1})})
+        mock_compact.assert_not_called()
+        utils.save_trigram_increment({("b", "c"): Counter({"d": 1})})
+        utils.save_trigram_increment({("c", "d"): Counter({"e": 1})})
+
+    assert [call.args[1][0] for call in mock_append.call_args_list] == [0, 0, 1]
+    mock_compact.assert_called_once()
+    assert mock_compact.call_args[0][:2] == (utils.MARKOV_MODEL_FILE, utils.MARKOV_LOG_FILE)
+    assert mock_compact.call_args[0][2].__self__.generation == 1
+
+
+def test_load_trigram_counts_converts_legacy_pickle(tmp_path):
+    legacy = {("a", "b"): Counter({"c": 2}), ("b", "c"): Counter({"d": 1})}
+    with open(tmp_path / "markov.pkl", "wb") as f:
+        pickle.dump(legacy, f)
+
+    with patch.object(utils, "_cache_initialized", False):
+        store = utils.load_trigram_counts(tmp_path / "markov.bin", tmp_path / "markov.log", tmp_path / "markov.pkl")
+
+    assert isinstance(store, TrigramStore)
+    assert store.memory_usage()["mapped_bytes"] > 0
+    assert dict(store.items()) == legacy
+    assert (tmp_path / "markov.bin").exists()
+
+
+def test_load_trigram_counts_replays_log(tmp_path):
+    TrigramStore.from_counts({("a", "b"): Counter({"c": 2})}).save(tmp_path / "markov.bin")
+    with open(tmp_path / "markov.log", "wb") as f:
+        pickle.dump({("a", "b"): Counter({"c": 1, "d": 1})}, f)
+        pickle.dump({("b", "c"): Counter({"d": 1})}, f)
+
+    with patch.object(utils, "_cache_initialized", False), patch.object(utils, "_logged_increments", 0):
+        store = utils.load_trigram_counts(tmp_path / "markov.bin", tmp_path / "markov.log", tmp_path / "markov.pkl")
+        assert utils._logged_increments == 2
+
+    assert dict(store.items()) == {("a", "b"): {"c": 3, "d": 1}, ("b", "c"): {"d": 1}}
+
+
+def test_load_trigram_counts_skips_log_folded_into_snapshot(tmp_path):
+    """The bot died after the snapshot was replaced but before the log was deleted."""
+    snapshot = TrigramStore.from_counts({("a", "b"): Counter({"c": 2})})
+    snapshot.generation = 1
+    snapshot.save(tmp_path / "markov.bin")
+    with open(tmp_path / "markov.log", "wb") as f:
+        pickle.dump((0, {("a", "b"): Counter({"c": 1})}), f)
+        pickle.dump((1, {("b", "c"): Counter({"d": 1})}), f)
+
+    with (
+        patch.object(utils, "_cache_initialized", False),
+        patch.object(utils, "_logged_increments", 0),
+        patch.object(utils, "_log_generation", 0),
+    ):
+        store = utils.load_trigram_counts(tmp_path / "markov.bin", tmp_path / "markov.log", tmp_path / "markov.pkl")
+        assert utils._log_generation == 1
+        assert utils._logged_increments == 1
+
+    assert dict(store.items()) == {("a", "b"): {"c": 2}, ("b", "c"): {"d": 1}}
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = utils.LruCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats() == {"hits": 2, "misses": 1, "size": 2, "maxsize": 2}
+
+
+async def test_run_async_uses_worker_processes():
+    utils.start_process_pool(1)
+    try:
+        assert utils.worker_count() == 1
+        assert await utils.run_async(os.getpid) != os.getpid()
+    finally:
+        utils.stop_process_pool()
+
+
+async def test_run_async_falls_back_when_pool_breaks():
+    broken: Future = Future()
+    broken.set_exception(BrokenProcessPool())
+    pool = MagicMock(submit=MagicMock(return_value=broken))
+    with patch.object(utils, "_process_pool", pool), patch.object(utils, "_process_count", 2):
+        assert utils.worker_count() == 2
+        assert await utils.run_async(os.getpid) == os.getpid()
+        assert utils._process_pool is None
+        assert utils.worker_count() == 1
+
+
+def test_markov_ingest_counts_each_message_once():
+    utils._markov_cache = TrigramStore()
+    ingest = utils.MarkovIngest(flush_every=100)
+
+    assert ingest.add(1, 10, "a b c")
+    assert not ingest.add(1, 10, "a b c")
+    # trigrams continue from the end of the previous message in the channel
+    ingest.add(2, 10, "d")
+    ingest.add(3, 20, "x y")
+
+    assert dict(utils._markov_cache.items()) == {("a", "b"): Counter({"c": 1}), ("b", "c"): Counter({"d": 1})}
+
+
+def test_markov_ingest_flushes_in_batches():
+    utils._markov_cache = TrigramStore()
+    ingest = utils.MarkovIngest(seen_size=2, flush_every=2)
+    with patch("šimek.utils.save_trigram_increment") as mock_save:
+        ingest.add(1, 10, "a b c")
+        mock_save.assert_not_called()
+        ingest.add(2, 10, "d")
+        mock_save.assert_called_once_with({("a", "b"): Counter({"c": 1}), ("b", "c"): Counter({"d": 1})})
+        # the oldest ID is forgotten
+        ingest.add(3, 10, "e")
+        assert ingest.add(1, 10, "f")
+
+
+async def test_prune_markov_replays_merges_and_saves():
+    utils._markov_cache = TrigramStore.from_counts({("a", "b"): Counter({"c": 4, "d": 1})})
+    ingest = utils.MarkovIngest(flush_every=100)
+    pruned = TrigramStore.pruned
+
+    def prune(store, policy):
+        # a message arriving while the pass runs in the background
+        ingest.add(1, 10, "x y z")
+        return pruned(store, policy)
+
+    with (
+        patch.object(TrigramStore, "pruned", prune),
+        patch("šimek.utils.save_trigram_increment") as mock_save,
+        patch("šimek.utils.compact_log_async") as mock_compact,
+    ):
+        report = await utils.prune_markov(PrunePolicy(decay=0.5), ingest=ingest)
+
+    assert dict(utils._markov_cache.items()) == {("a", "b"): {"c": 2}, ("x", "y"): {"z": 1}}
+    # the buffered increment is logged before the snapshot containing it
+    mock_save.assert_called_once_with({("x", "y"): Counter({"z": 1})})
+    mock_compact.assert_called_once()
+    assert report is not None
+    assert report["keys_before"] == 1
+    assert report["keys_after"] == 2
+    assert report["bytes_reclaimed"] == report["bytes_before"] - report["bytes_after"]
+    assert utils._replay is None
+
+
+async def test_merge_compacts_in_background():
+    utils._markov_cache = TrigramStore.from_counts({("a", "b"): Counter({"c": 1})})
+    with patch.object(utils, "COMPACT_THRESHOLD", 2):
+        utils._merge({("b", "c"): Counter({"d": 1}), ("c", "d"): Counter({"e": 1})})
+        # nothing is rebuilt on the event loop
+        assert utils._markov_cache.pending_transitions == 2
+        compaction = utils._compaction
+        assert compaction is not None
+        await asyncio.sleep(0)
+        # learned while the compaction runs
+        utils._merge({("x", "y"): Counter({"z": 1})})
+        await compaction
+
+    assert utils._markov_cache.pending_transitions == 1
+    assert dict(utils._markov_cache.items()) == {
+        ("a", "b"): {"c": 1},
+        ("b", "c"): {"d": 1},
+        ("c", "d"): {"e": 1},
+        ("x", "y"): {"z": 1},
+    }
+    assert utils._replay is None
+
+
+def test_channel_models_evict_least_recently_used():
+    models = utils.ChannelModels(budget=3)
+    models.merge(1, {("a", "b"): Counter({"c": 1}), ("b", "c"): Counter({"d": 1})})
+    models.merge(2, {("x", "y"): Counter({"z": 1})})
+    assert models.stats() == {"channels": 2, "transitions": 3, "budget": 3, "evictions": 0}
+
+    models.get(1)
+    models.merge(3, {("p", "q"): Counter({"r": 1})})
+
+    assert models.get(2) is None
+    assert models.get(1) is not None
+    assert models.stats() == {"channels": 2, "transitions": 3, "budget": 3, "evictions": 1}
+
+
+async def test_channel_models_compact_in_background():
+    models = utils.ChannelModels(budget=100, compact_threshold=2)
+    models.merge(1, {("a", "b"): Counter({"c": 1}), ("b", "c"): Counter({"d": 1})})
+    assert models.get(1).pending_transitions == 2
+    # learned while the compaction runs
+    models.merge(1, {("a", "b"): Counter({"c": 1})})
+    await asyncio.gather(*models._compactions)
+
+    model = models.get(1)
+    assert model.pending_transitions == 1
+    assert dict(model.items()) == {("a", "b"): {"c": 2}, ("b", "c"): {"d": 1}}
+    assert models.stats()["transitions"] == 2
+
+
+def test_channel_models_compact_without_event_loop():
+    models = utils.ChannelModels(budget=100, compact_threshold=2)
+    models.merge(1, {("a", "b"): Counter({"c": 1}), ("b", "c"): Counter({"d": 1})})
+
+    assert models.get(1).pending_transitions == 0
+    assert models.get(1).transitions == 2
+
+
+def test_generate_markov_backs_off_to_global_model():
+    utils._markov_cache = TrigramStore.from_counts({("c", "d"): Counter({"e.": 1})})
+    ingest = utils.MarkovIngest()
+    with patch.object(utils, "channel_models", utils.ChannelModels()):
+        ingest.add(1, 10, "a b c d")
+
+        # the channel knows how "a b" continues, the global model finishes the sentence
+        with patch.object(TrigramStore, "random_key", return_value=("a", "b")):
+            assert utils.generate_markov(channel_id=10) == "a b c d e."
+        assert utils.channel_models.get(10) is not None
+        assert utils.channel_models.get(20) is None